@@ -0,0 +1,94 @@
+import sys
+import time
+import math
+import numpy as np
+from Lidar_classes import A2M8, A2M8_PACKET_SIZE, RevolutionBuffer
+from Lidar_replay import ReplaySerial
+from Benchmarks.replay_data import a2m8_stream_from_scans
+
+
+def legacy_decode(stream):
+    # Per-point loop from the original A2M8.make_full_scan, collecting every saved revolution
+    sign = {0: 1, 1: -1}
+    revolutions = []
+    points_X = []
+    points_Y = []
+    previous_angle = 0
+    previous_start_angle = 0
+    for offset in range(0, len(stream) - A2M8_PACKET_SIZE + 1, A2M8_PACKET_SIZE):
+        package = stream[offset:offset + A2M8_PACKET_SIZE]
+        start_angle = (package[2] + ((package[3] & 0b01111111) << 8)) / 64
+
+        j = 1
+        for i in range(0, 80, 5):
+            for d_index, a_bits in ((i + 4, package[i + 8] & 0b00001111), (i + 6, package[i + 8] >> 4)):
+                d = ((package[d_index] >> 2) + (package[d_index + 1] << 6))
+                a = ((a_bits + ((package[d_index] & 0b00000001) << 4)) / 8
+                     * sign[(package[d_index] & 0b00000010) >> 1])
+
+                angle = (previous_start_angle + (
+                        (start_angle - previous_start_angle) % 360)
+                        / 32 * j - a) % 360 + 24
+                j += 1
+                if (previous_angle - angle) > 355:
+                    if len(points_X) > 100:
+                        revolutions.append((points_X, points_Y))
+                    points_X = []
+                    points_Y = []
+                points_X.append(d * math.sin(math.radians(angle)))
+                points_Y.append(d * math.cos(math.radians(angle)))
+
+                previous_angle = angle
+
+        previous_start_angle = start_angle
+    return revolutions
+
+
+def vectorized_decode(stream, chunk_size=None):
+    lidar = A2M8(ser=ReplaySerial(stream, chunk_size=chunk_size))
+    # Large enough to keep every revolution of the replayed stream
+    lidar.revolution_buffer = RevolutionBuffer(capacity=len(stream) // (A2M8_PACKET_SIZE * 4) + 2, max_points=4096)
+    previous_angle = previous_start_angle = 0
+    while lidar.ser.in_waiting:
+        _, previous_angle, previous_start_angle = lidar.make_full_scan(previous_angle, previous_start_angle)
+    revolutions = [lidar.revolution_buffer.view(index) for index in range(lidar.revolution_buffer.latest + 1)]
+    return [(revolution['X'], revolution['Y']) for revolution in revolutions]
+
+
+def compare(legacy_revolutions, revolutions):
+    if len(legacy_revolutions) != len(revolutions):
+        return np.inf
+    error = 0.0
+    for (legacy_X, legacy_Y), (points_X, points_Y) in zip(legacy_revolutions, revolutions):
+        if len(legacy_X) != len(points_X):
+            return np.inf
+        error = max(error, np.abs(np.array(legacy_X) - points_X).max(), np.abs(np.array(legacy_Y) - points_Y).max())
+    return error
+
+
+def measure(decode, *args):
+    start_time = time.perf_counter()
+    result = decode(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main(capture_files):
+    if capture_files:
+        stream = b''.join(open(filename, 'rb').read() for filename in capture_files)
+    else:
+        stream = a2m8_stream_from_scans()
+    n_packets = len(stream) // A2M8_PACKET_SIZE
+    print(f"Replaying {len(stream)} bytes, {n_packets} packets")
+
+    legacy_revolutions, legacy_time = measure(legacy_decode, stream)
+    print(f"before:            {n_packets / legacy_time:10.0f} packets/s, {len(legacy_revolutions)} revolutions")
+    for chunk_size in (A2M8_PACKET_SIZE, 16 * A2M8_PACKET_SIZE, None):
+        revolutions, vectorized_time = measure(vectorized_decode, stream, chunk_size)
+        # in_waiting limited to chunk_size, as when the driver keeps up with the line
+        label = 'whole stream' if chunk_size is None else f'{chunk_size // A2M8_PACKET_SIZE} waiting'
+        print(f"after ({label:>12}): {n_packets / vectorized_time:10.0f} packets/s "
+              f"({legacy_time / vectorized_time:.1f}x), max deviation {compare(legacy_revolutions, revolutions):.4f} mm")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
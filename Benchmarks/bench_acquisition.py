@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from Lidar_replay import make_replay_lidar, replay
+from Lidar_process import ProcessLiDAR
+from Benchmarks.replay_data import stl27l_stream_from_scans, a2m8_stream_from_scans
+
+
+def busy_gui(stop):
+    # Pure Python work standing in for matplotlib rendering - holds the GIL most of the time
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def run_threads(captures):
+    results = {}
+
+    def acquire(sensor, path):
+        results[sensor] = replay(make_replay_lidar(path, sensor, 0))['revolutions']
+
+    threads = [threading.Thread(target=acquire, args=item) for item in captures.items()]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start_time
+
+
+def run_processes(captures):
+    lidars = {sensor: ProcessLiDAR(sensor, path, speed=0) for sensor, path in captures.items()}
+    results = {}
+
+    def consume(sensor):
+        # Same loop as the acquisition workers, the decoding happens in the sensor's process
+        lidar = lidars[sensor]
+        results[sensor] = 0
+        while lidar.process.is_alive() or not lidar.indices.empty():
+            if lidar.make_full_scan() is not None:
+                results[sensor] += 1
+
+    threads = [threading.Thread(target=consume, args=(sensor,)) for sensor in lidars]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+    for lidar in lidars.values():
+        lidar.deactivate()
+    return results, elapsed
+
+
+def main(repeats):
+    with tempfile.TemporaryDirectory() as directory:
+        captures = {'STL27L': stl27l_stream_from_scans(), 'A2M8': a2m8_stream_from_scans()}
+        for sensor, stream in captures.items():
+            captures[sensor] = os.path.join(directory, f'{sensor}.bin')
+            with open(captures[sensor], mode='wb') as file:
+                file.write(stream * repeats)
+
+        print(f"{os.cpu_count()} CPUs, both sensors replayed as fast as possible")
+        for busy in (False, True):
+            for mode, run in (('threads', run_threads), ('processes', run_processes)):
+                stop = threading.Event()
+                gui = threading.Thread(target=busy_gui, args=(stop,))
+                if busy:
+                    gui.start()
+                results, elapsed = run(captures)
+                stop.set()
+                if busy:
+                    gui.join()
+                revolutions = sum(results.values())
+                print(f"{mode:9} {'busy GUI' if busy else 'idle GUI'}: {revolutions / elapsed:8.0f} revolutions/s "
+                      f"{results}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
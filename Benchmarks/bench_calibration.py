@@ -0,0 +1,52 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from ICP_function import apply_transformation
+from Lidar_calibration import calibrate
+from Benchmarks.replay_data import load_scan_polar, resample_revolution
+from Lidar_classes import polar_to_cartesian
+
+# STL27L -> A2M8 transform the synthetic pairs are generated with
+TRUE_PARAMS = np.array([85.0, -40.0, np.radians(100.0)])
+
+
+def synthetic_pairs(pattern, n_pairs, n_files=20, noise=10.0, outliers=0.1, seed=0):
+    # Both sensors see the same room: STL27L points in its own frame, A2M8 points moved by TRUE_PARAMS,
+    # each with its own sampling, range noise and a share of gross outliers
+    rng = np.random.default_rng(seed)
+    filenames = [filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename)]
+    scans = [load_scan_polar(filename) for filename in filenames[:n_files]]
+    pairs = []
+    for i in range(n_pairs):
+        angles, distances = scans[i % len(scans)]
+        clouds = []
+        for n_points in (2000, 1600):
+            sampled_angles, sampled_distances = resample_revolution(angles, distances, n_points)
+            sampled_angles = sampled_angles + rng.uniform(0, 360 / n_points)
+            sampled_distances = sampled_distances + rng.normal(0, noise, n_points)
+            wrong = rng.random(n_points) < outliers
+            sampled_distances[wrong] *= rng.uniform(0.2, 0.9, np.count_nonzero(wrong))
+            clouds.append(np.column_stack(polar_to_cartesian(sampled_angles, sampled_distances)))
+        pairs.append((clouds[0], apply_transformation(clouds[1], TRUE_PARAMS)))
+    return pairs
+
+
+def main(n_pairs):
+    pairs = synthetic_pairs('Scans/**/W_*.csv', n_pairs)
+    print(f"{len(pairs)} pairs, true params {TRUE_PARAMS[0]:.1f} mm, {TRUE_PARAMS[1]:.1f} mm, "
+          f"{np.degrees(TRUE_PARAMS[2]):.2f} deg")
+    for loss, max_workers in ((None, 1), ('trimmed', 1), ('huber', 1), ('huber', None)):
+        start_time = time.perf_counter()
+        result = calibrate(pairs, loss=loss, max_workers=max_workers)
+        elapsed = time.perf_counter() - start_time
+        error = result['params'] - TRUE_PARAMS
+        print(f"{str(loss):8} workers={max_workers or 'all'}: {elapsed:6.2f} s, error {error[0]:7.2f} mm "
+              f"{error[1]:7.2f} mm {np.degrees(error[2]):7.3f} deg, standard error {result['standard_error'][0]:.2f} mm "
+              f"{result['standard_error'][1]:.2f} mm {np.degrees(result['standard_error'][2]):.3f} deg, "
+              f"{result['pairs_used']}/{result['pairs']} pairs used")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,56 @@
+import sys
+import time
+import numpy as np
+from scipy.spatial import KDTree
+from scipy.optimize import minimize
+from ICP_function import apply_transformation, calculate_rmse, filter_points_by_distance, find_edge_points, icp, \
+    icp_algorithm
+
+SLICE_PAIRS = [('s3f.csv', 'w3f.csv'), ('s3l.csv', 'w3l.csv'), ('s3p.csv', 'w3p.csv'),
+               ('s5f.csv', 'w5f.csv'), ('s5l.csv', 'w5l.csv'), ('s5p.csv', 'w5p.csv')]
+
+
+def legacy_objective(params, source_cloud, target_cloud):
+    # Objective of the original BFGS alignment - rebuilds the KD-tree on every evaluation
+    transformed_source_cloud = apply_transformation(source_cloud, params)
+    kdtree = KDTree(target_cloud)
+    _, indices = kdtree.query(transformed_source_cloud)
+    return np.sum([np.linalg.norm(transformed_source_cloud[i] - target_cloud[indices[i]])
+                   for i in range(len(transformed_source_cloud))])
+
+
+def legacy_align(source_cloud, target_cloud, initial_params):
+    result = minimize(legacy_objective, initial_params, args=(source_cloud, target_cloud), method='BFGS')
+    return apply_transformation(source_cloud, result.x)
+
+
+def load_pair(cloud1_name, cloud2_name):
+    source_cloud = filter_points_by_distance(np.loadtxt(f'Slices/{cloud1_name}', delimiter=','), 1000)
+    target_cloud = np.loadtxt(f'Slices/{cloud2_name}', delimiter=',')
+    return find_edge_points(source_cloud), find_edge_points(target_cloud)
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def main(pairs):
+    print(f"{'pair':>20} {'BFGS 1 start':>20} {'point-to-point':>20} {'point-to-line':>20} {'multi-start':>10}")
+    for cloud1_name, cloud2_name in pairs:
+        source_cloud, target_cloud = load_pair(cloud1_name, cloud2_name)
+        initial_params = np.array([0.0, 0.0, 0.0])
+        legacy_cloud, legacy_time = timed(legacy_align, source_cloud, target_cloud, initial_params)
+        columns = [f"{calculate_rmse(legacy_cloud, target_cloud):7.2f} mm {legacy_time * 1000:6.0f} ms"]
+        for method in ('point_to_point', 'point_to_line'):
+            result, icp_time = timed(icp, source_cloud, target_cloud, initial_params, method)
+            columns.append(f"{calculate_rmse(result['transformed_cloud'], target_cloud):7.2f} mm "
+                           f"{icp_time * 1000:6.1f} ms")
+        _, search_time = timed(icp_algorithm, cloud1_name, cloud2_name)
+        print(f"{cloud1_name + '/' + cloud2_name:>20} {columns[0]:>20} {columns[1]:>20} {columns[2]:>20} "
+              f"{search_time:8.2f} s")
+
+
+if __name__ == '__main__':
+    main([tuple(arg.split(',')) for arg in sys.argv[1:]] or SLICE_PAIRS)
@@ -0,0 +1,101 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from Slice_metrics import fit_line, angle_metrics
+from Line_extraction import extract_lines, find_corners
+from Benchmarks.replay_data import load_scan_polar
+from Lidar_classes import polar_to_cartesian
+
+# Orientations showing fewer points of an arm have no corner to measure
+MIN_ARM_POINTS = 10
+
+
+def split_at_peak_angle(selected_slice):
+    # The angle as computed before: sorted by x, split at the highest point, two y = f(x) regressions
+    order = np.argsort(selected_slice[:, 0])
+    x, y = selected_slice[order, 0], selected_slice[order, 1]
+    peak = np.argmax(y)
+    m1, _ = fit_line(x[:peak + 1], y[:peak + 1])
+    m2, _ = fit_line(x[peak:], y[peak:])
+    return np.degrees(np.arctan(abs((m1 - m2) / (1 + m1 * m2))))
+
+
+def synthetic_profile(rotation, corner_angle=90.0, distance=3000.0, arms=(300.0, 200.0), step=np.radians(0.167),
+                      noise=5.0, seed=0):
+    # An L-profile with its corner at distance from the sensor, seen with the STL27L resolution: the points where
+    # the rays hit the two arms, with range noise, and how many points each arm got
+    rng = np.random.default_rng(seed)
+    corner = np.array([0.0, distance])
+    directions = [np.array([np.cos(angle), np.sin(angle)]) for angle in
+                  (rotation, rotation + np.radians(corner_angle))]
+    bearings = np.arctan2(*np.concatenate([[corner + arm * direction for direction, arm in zip(directions, arms)],
+                                           [corner]]).T[::-1])
+    points = []
+    counts = [0, 0]
+    for bearing in np.arange(bearings.min() - 0.01, bearings.max() + 0.01, step):
+        ray = np.array([np.cos(bearing), np.sin(bearing)])
+        hits = []
+        for k, (direction, arm) in enumerate(zip(directions, arms)):
+            # Ray t * ray meets the arm corner + s * direction
+            matrix = np.column_stack((ray, -direction))
+            if abs(np.linalg.det(matrix)) > 1e-9:
+                t, s = np.linalg.solve(matrix, corner)
+                if t > 0 and 0 <= s <= arm:
+                    hits.append((t, k))
+        if hits:
+            t, k = min(hits)
+            counts[k] += 1
+            points.append(ray * (t + rng.normal(0, noise)))
+    return np.array(points), counts
+
+
+def revolutions(pattern):
+    for filename in sorted(glob.glob(pattern, recursive=True)):
+        if os.path.getsize(filename):
+            yield filename, np.column_stack(polar_to_cartesian(*load_scan_polar(filename)))
+
+
+def main(pattern):
+    print('L-profile angle error [deg] by rotation of the profile')
+    print(f"{'rotation':>8} {'corner':>6} {'peak split':>10} {'split-and-merge':>15}")
+    errors = [[], []]
+    for corner_angle in (90.0, 120.0):
+        for rotation in range(0, 360, 30):
+            profile, counts = synthetic_profile(np.radians(rotation), corner_angle)
+            if min(counts) < MIN_ARM_POINTS:
+                print(f"{rotation:8d} {corner_angle:6.0f}   one arm hidden or seen edge-on")
+                continue
+            old = split_at_peak_angle(profile)
+            try:
+                new = angle_metrics(profile)['angle_deg']
+            except ValueError:
+                new = np.nan
+            # Both report the acute angle between the lines of the sides
+            expected = min(corner_angle, 180 - corner_angle)
+            errors[0].append(abs(old - expected))
+            errors[1].append(abs(new - expected))
+            print(f"{rotation:8d} {corner_angle:6.0f} {errors[0][-1]:10.2f} {errors[1][-1]:15.2f}")
+    print(f"largest error: peak split {max(errors[0]):.2f}, split-and-merge {np.nanmax(errors[1]):.2f}, "
+          f"no corner found {int(np.isnan(errors[1]).sum())} of {len(errors[1])} times")
+
+    times = []
+    points = []
+    segments = []
+    corners = []
+    for filename, revolution in revolutions(pattern):
+        start_time = time.perf_counter()
+        lines = extract_lines(revolution)
+        found = find_corners(lines)
+        times.append((time.perf_counter() - start_time) * 1000)
+        points.append(len(revolution))
+        segments.append(len(lines))
+        corners.append(len(found))
+    print(f"{len(times)} scans, {np.mean(points):.0f} points, {np.mean(segments):.1f} segments and "
+          f"{np.mean(corners):.1f} corners on average: lines + corners "
+          f"p50 {np.percentile(times, 50):.2f} ms, p95 {np.percentile(times, 95):.2f} ms, max {max(times):.2f} ms")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Scans/**/*.csv')
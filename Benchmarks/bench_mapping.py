@@ -0,0 +1,68 @@
+import sys
+import time
+import numpy as np
+from ICP_function import apply_transformation
+from Lidar_mapping import OccupancyGrid
+from Lidar_odometry import format_histogram, LATENCY_BINS
+from Benchmarks.bench_odometry import synthetic_run
+
+
+def bresenham(x0, y0, x1, y1):
+    # Classic integer Bresenham, cells from the start up to (not including) the end
+    cells = []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+    error = dx + dy
+    while (x0, y0) != (x1, y1):
+        cells.append((x0, y0))
+        doubled = 2 * error
+        if doubled >= dy:
+            error += dy
+            x0 += sx
+        if doubled <= dx:
+            error += dx
+            y0 += sy
+    return cells
+
+
+def integrate_loop(log_odds, x, y, pose, grid):
+    # Per-beam Python loop into one dense array, the way it would be written without vectorizing
+    origin = grid.cell(np.array(pose[:2]))
+    ends = grid.cell(apply_transformation(np.column_stack((x, y)), pose))
+    offset = log_odds.shape[0] // 2
+    for end in ends:
+        for cell in bresenham(origin[0], origin[1], end[0], end[1]):
+            log_odds[cell[1] + offset, cell[0] + offset] += grid.miss
+        log_odds[end[1] + offset, end[0] + offset] += grid.hit
+
+
+def main(n_revolutions):
+    # Finer angular steps than the odometry benchmark - the surfaces of the scan return 2000+ beams
+    revolutions, poses = synthetic_run('Scans/**/W_*.csv', n_revolutions, points_per_revolution=5400)
+    beams = np.mean([len(x) for x, _ in revolutions])
+    print(f"{n_revolutions} revolutions, {beams:.0f} beams per revolution")
+
+    grid = OccupancyGrid()
+    n_loop = min(5, n_revolutions)
+    dense = np.zeros((2048, 2048), dtype=np.float32)
+    start_time = time.perf_counter()
+    for (x, y), pose in zip(revolutions[:n_loop], poses):
+        integrate_loop(dense, x, y, pose, grid)
+    print(f"per-beam Bresenham loop: {(time.perf_counter() - start_time) / n_loop * 1000:8.1f} ms per revolution")
+
+    for (x, y), pose in zip(revolutions, poses):
+        grid.integrate(x, y, pose)
+    metrics = grid.metrics()
+    print(f"vectorized, tiled:       {metrics['latency_p50_ms']:8.1f} ms per revolution (p50), "
+          f"p95 {metrics['latency_p95_ms']:.1f} ms")
+    print(format_histogram(*np.histogram(np.array(grid.latencies) * 1000, bins=LATENCY_BINS)))
+
+    mosaic, _ = grid.to_array()
+    min_x, min_y, max_x, max_y = grid.bounds()
+    print(f"{metrics['tiles']} tiles of {grid.tile_size}x{grid.tile_size} cells: {metrics['megabytes']:.1f} MB, "
+          f"dense bounding box of the tiles {mosaic.nbytes / 1e6:.1f} MB "
+          f"({max_x - min_x + 1}x{max_y - min_y + 1} tiles)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
@@ -0,0 +1,75 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+from ICP_function import apply_transformation, invert_params, wrap_angle
+from Lidar_odometry import ScanOdometry, format_histogram
+from Benchmarks.replay_data import load_scan_polar
+from Lidar_classes import polar_to_cartesian
+
+
+def surface_points(room, spacing=10.0, max_gap=100.0):
+    # Neighbouring scan points closer than max_gap lie on one surface - fill it in, leave the depth jumps open
+    gaps = np.hypot(*np.diff(room, axis=0).T)
+    segments = [room[:1]]
+    for start, end, gap in zip(room[:-1], room[1:], gaps):
+        n = int(gap // spacing) + 1 if gap <= max_gap else 1
+        segments.append(start + (end - start) * (np.arange(1, n + 1) / n)[:, np.newaxis])
+    return np.concatenate(segments)
+
+
+def synthetic_run(pattern, n_revolutions, step=40.0, turn=np.radians(2.0), noise=5.0, points_per_revolution=2160,
+                  seed=0):
+    # A sensor driving circles around the spot where one scan was taken, at 10 Hz with the STL27L resolution.
+    # Further away the scan has not seen what the sensor would
+    rng = np.random.default_rng(seed)
+    filename = [filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename)][0]
+    room = surface_points(np.column_stack(polar_to_cartesian(*load_scan_polar(filename))))
+    poses = []
+    revolutions = []
+    pose = np.zeros(3)
+    for i in range(n_revolutions):
+        poses.append(pose.copy())
+        seen = apply_transformation(room, invert_params(pose))
+        distances = np.hypot(seen[:, 0], seen[:, 1])
+        bins = (np.degrees(np.arctan2(seen[:, 0], seen[:, 1])) % 360 * (points_per_revolution / 360)).astype(int)
+        # The nearest surface in every angular step hides everything behind it
+        order = np.lexsort((distances, bins))
+        bins, first = np.unique(bins[order], return_index=True)
+        angles = bins * (360 / points_per_revolution)
+        distances = distances[order][first] + rng.normal(0, noise, len(bins))
+        revolutions.append(polar_to_cartesian(angles, distances))
+        # Constant forward speed and turn rate in the sensor frame
+        pose = np.array([pose[0] + step * np.sin(-pose[2]), pose[1] + step * np.cos(-pose[2]), pose[2] + turn])
+    return revolutions, np.array(poses)
+
+
+def run(odometry, revolutions, poses):
+    start_time = time.perf_counter()
+    for i, (x, y) in enumerate(revolutions):
+        odometry.add_revolution(x, y, i * 0.1)
+    elapsed = time.perf_counter() - start_time
+    trajectory = np.array(odometry.trajectory)[:, 1:]
+    position_error = np.hypot(*(trajectory[:, :2] - poses[:, :2]).T)
+    return elapsed, position_error, np.degrees(abs(wrap_angle(trajectory[-1, 2] - poses[-1, 2])))
+
+
+def main(n_revolutions):
+    revolutions, poses = synthetic_run('Scans/**/W_*.csv', n_revolutions)
+    path_length = np.sum(np.hypot(*np.diff(poses[:, :2], axis=0).T))
+    print(f"{n_revolutions} revolutions, {path_length / 1000:.1f} m path")
+    variants = {'scan-to-scan, full resolution, 50 iterations':
+                ScanOdometry(voxel_size=0, max_iterations=50, keyframe_distance=0),
+                'keyframes, 50 mm voxels, 15 iterations': ScanOdometry()}
+    for name, odometry in variants.items():
+        elapsed, position_error, heading_error = run(odometry, revolutions, poses)
+        metrics = odometry.metrics()
+        print(f"{name}: {n_revolutions / elapsed:6.1f} revolutions/s, p95 {metrics['latency_p95_ms']:.1f} ms, "
+              f"{metrics['keyframes']} keyframes, final error {position_error[-1]:.1f} mm / {heading_error:.2f} deg, "
+              f"max {position_error.max():.1f} mm")
+        print(format_histogram(*odometry.latency_histogram()))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300)
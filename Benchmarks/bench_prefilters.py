@@ -0,0 +1,72 @@
+import sys
+import glob
+import os
+import time
+import numpy as np
+from ICP_function import find_edge_points, filter_points_by_distance, find_curvature_points, \
+    filter_points_by_angular_gap
+
+
+def legacy_find_edge_points(cloud, threshold=1):
+    edge_points = []
+    for i in range(len(cloud)):
+        if 0 < i < len(cloud) - 1:
+            prev_diff = np.linalg.norm(cloud[i - 1] - cloud[i])
+            next_diff = np.linalg.norm(cloud[i + 1] - cloud[i])
+            if prev_diff > threshold and next_diff > threshold:
+                edge_points.append(cloud[i])
+    return np.array(edge_points)
+
+
+def legacy_filter_points_by_distance(points, max_distance):
+    filtered_points = []
+
+    for i in range(0, len(points)-1):
+        ok_x = abs(points[i, 0] - points[i + 1, 0])
+        ok_y = abs(points[i, 1] - points[i + 1, 1])
+        if ok_x < max_distance and ok_y < max_distance:
+            filtered_points.append([points[i, 0], points[i, 1]])
+
+    return np.array(filtered_points)
+
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start_time) * 1000
+
+
+def same(legacy, result):
+    return np.array_equal(legacy.reshape(-1, 2), result)
+
+
+def main(pattern):
+    filenames = [filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename)]
+    clouds = [np.loadtxt(filename, delimiter=',', ndmin=2) for filename in filenames]
+    # Every scan of the tree merged into one large cloud, as a stress case
+    clouds.append(np.vstack(clouds))
+
+    totals = np.zeros(6)
+    identical = True
+    for cloud in clouds:
+        legacy_edges, t0 = timed(legacy_find_edge_points, cloud, 1)
+        edges, t1 = timed(find_edge_points, cloud, 1)
+        legacy_filtered, t2 = timed(legacy_filter_points_by_distance, cloud, 1000)
+        filtered, t3 = timed(filter_points_by_distance, cloud, 1000)
+        _, t4 = timed(find_curvature_points, cloud)
+        _, t5 = timed(filter_points_by_angular_gap, cloud, 100)
+        identical &= same(legacy_edges, edges) and same(legacy_filtered, filtered)
+        if cloud is not clouds[-1]:
+            totals += (t0, t1, t2, t3, t4, t5)
+
+    print(f"{len(clouds) - 1} scans, {sum(len(cloud) for cloud in clouds[:-1])} points, identical results: {identical}")
+    print(f"{'':>26} {'all scans [ms]':>15} {len(clouds[-1]):>8} points [ms]")
+    labels = ['find_edge_points (loop)', 'find_edge_points', 'filter_by_distance (loop)', 'filter_by_distance',
+              'find_curvature_points', 'filter_by_angular_gap']
+    merged_times = [t0, t1, t2, t3, t4, t5]
+    for label, total, merged in zip(labels, totals, merged_times):
+        print(f"{label:>26} {total:15.1f} {merged:15.2f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Scans/**/*.csv')
@@ -0,0 +1,57 @@
+import sys
+import time
+import numpy as np
+from Scan_format import load_cloud
+from Slice_metrics import diameter, find_slices
+
+# The distance matrix needs several n x n float64 temporaries - larger profiles are not run through it
+MATRIX_LIMIT_MB = 1000
+
+
+def pairwise_length(points):
+    # The profile length as computed before: full distance matrix and argmax
+    x, y = points[:, 0], points[:, 1]
+    distances = np.sqrt((x[:, np.newaxis] - x[np.newaxis, :]) ** 2 + (y[:, np.newaxis] - y[np.newaxis, :]) ** 2)
+    i, j = np.unravel_index(np.argmax(distances), distances.shape)
+    return distances[i, j], i, j
+
+
+def timed(function, points, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = function(points)
+    return (time.perf_counter() - start_time) / repeats * 1000, result
+
+
+def synthetic_profile(n_points, seed=0):
+    # L-shaped wall profile with range noise, like the angle slices but of any size
+    rng = np.random.default_rng(seed)
+    t = rng.uniform(0, 1, n_points)
+    corner = t < 0.5
+    points = np.where(corner[:, np.newaxis], np.column_stack((t * 4000, np.full(n_points, 3000.0))),
+                      np.column_stack((np.full(n_points, 2000.0), 3000 - (t - 0.5) * 4000)))
+    return points + rng.normal(0, 5, points.shape)
+
+
+def compare(name, points, repeats):
+    matrix_mb = 3 * len(points) ** 2 * 8 / 1e6
+    hull_time, (length, i, j) = timed(diameter, points, repeats)
+    if matrix_mb <= MATRIX_LIMIT_MB:
+        matrix_time, expected = timed(pairwise_length, points, repeats)
+        same = (length, i, j) == expected
+        print(f"{name:28} {len(points):8d} points  matrix {matrix_time:9.2f} ms  hull {hull_time:7.2f} ms  "
+              f"same endpoints: {same}")
+    else:
+        print(f"{name:28} {len(points):8d} points  matrix skipped ({matrix_mb / 1000:.0f} GB)  "
+              f"hull {hull_time:7.2f} ms  length {length:.1f} mm")
+
+
+def main(pattern):
+    for filename in find_slices([pattern]):
+        compare(filename, load_cloud(filename), 20)
+    for n_points in (1000, 5000, 20000, 100000, 1000000):
+        compare('synthetic L-profile', synthetic_profile(n_points), 3 if n_points <= 5000 else 1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Slices')
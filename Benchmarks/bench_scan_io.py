@@ -0,0 +1,45 @@
+import sys
+import os
+import glob
+import shutil
+import tempfile
+import time
+import numpy as np
+from Scan_format import SCAN_EXTENSION, convert_csv_tree, load_cloud, load_scan
+
+
+def timed_loop(function, filenames):
+    start_time = time.perf_counter()
+    for filename in filenames:
+        function(filename)
+    return time.perf_counter() - start_time
+
+
+def tree_size(filenames):
+    return sum(os.path.getsize(filename) for filename in filenames) / 1e6
+
+
+def main(root):
+    with tempfile.TemporaryDirectory() as directory:
+        # Convert a copy so the original tree is left untouched
+        tree = os.path.join(directory, 'tree')
+        shutil.copytree(root, tree)
+        start_time = time.perf_counter()
+        converted = convert_csv_tree(tree)
+        conversion_time = time.perf_counter() - start_time
+
+        csv_files = sorted(glob.glob(os.path.join(tree, '**', '*.csv'), recursive=True))
+        scan_files = [os.path.splitext(filename)[0] + SCAN_EXTENSION for filename in csv_files]
+        print(f"{converted} files converted in {conversion_time:.1f} s, "
+              f"CSV {tree_size(csv_files):.1f} MB -> binary {tree_size(scan_files):.1f} MB")
+
+        csv_time = timed_loop(lambda filename: np.loadtxt(filename, delimiter=',', ndmin=2), csv_files)
+        cloud_time = timed_loop(load_cloud, scan_files)
+        memmap_time = timed_loop(load_scan, scan_files)
+        print(f"np.loadtxt (CSV):          {csv_time * 1000:8.1f} ms")
+        print(f"load_cloud (binary, N x 2): {cloud_time * 1000:8.1f} ms  ({csv_time / cloud_time:.0f}x)")
+        print(f"load_scan (memmap columns): {memmap_time * 1000:8.1f} ms  ({csv_time / memmap_time:.0f}x)")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'Scans')
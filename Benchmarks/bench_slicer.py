@@ -0,0 +1,87 @@
+import os
+import sys
+import glob
+import time
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.path import Path
+from Scan_format import load_cloud
+from Cloud_index import GridIndex
+
+
+def merged_session(pattern, n_points, seed=0):
+    # Scans of the tree repeated at random offsets and with noise until the cloud has n_points points
+    rng = np.random.default_rng(seed)
+    scans = [load_cloud(filename) for filename in sorted(glob.glob(pattern, recursive=True))
+             if os.path.getsize(filename)]
+    clouds = []
+    total = 0
+    while total < n_points:
+        cloud = scans[rng.integers(len(scans))][:, :2]
+        clouds.append(cloud + rng.uniform(-20000, 20000, 2) + rng.normal(0, 10, cloud.shape))
+        total += len(cloud)
+    return np.concatenate(clouds)[:n_points]
+
+
+def timed(function, repeats=1):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return (time.perf_counter() - start_time) / repeats * 1000, result
+
+
+def main(n_points):
+    cloud = merged_session('Scans/**/*.csv', n_points)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    x_min, y_min = cloud.min(axis=0)
+    x_max, y_max = cloud.max(axis=0)
+    rect = (x_min + 0.4 * (x_max - x_min), y_min + 0.4 * (y_max - y_min),
+            x_min + 0.45 * (x_max - x_min), y_min + 0.45 * (y_max - y_min))
+    polygon = [(rect[0], rect[1]), (rect[2], rect[1]), ((rect[0] + rect[2]) / 2, rect[3])]
+    print(f"{len(cloud)} points")
+
+    # Slicer before: every point scattered, full masks for the selections
+    ax.scatter(cloud[:, 0], cloud[:, 1], color='blue', s=1)
+    scatter_time, _ = timed(fig.canvas.draw)
+    mask_time, expected = timed(lambda: np.flatnonzero((cloud[:, 0] >= rect[0]) & (cloud[:, 0] <= rect[2]) &
+                                                       (cloud[:, 1] >= rect[1]) & (cloud[:, 1] <= rect[3])), 5)
+    path_time, expected_polygon = timed(lambda: np.flatnonzero(Path(polygon).contains_points(cloud)))
+    print(f"scatter of every point:  draw {scatter_time:8.1f} ms, rectangle {mask_time:6.1f} ms, "
+          f"polygon {path_time:6.1f} ms")
+
+    # Slicer after: index built once, decimated view, selections from the index
+    build_time, index = timed(lambda: GridIndex(cloud))
+    ax.clear()
+    line, = ax.plot([], [], 'o', color='blue', markersize=1)
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+    fig.canvas.draw()
+    draw_times = []
+    shown = []
+    for zoom in (1, 4, 16, 64, 256):
+        half_x, half_y = (x_max - x_min) / 2 / zoom, (y_max - y_min) / 2 / zoom
+        center_x, center_y = (rect[0] + rect[2]) / 2, (rect[1] + rect[3]) / 2
+        ax.set_xlim(center_x - half_x, center_x + half_x)
+        ax.set_ylim(center_y - half_y, center_y + half_y)
+
+        def redraw():
+            points = index.view(*ax.get_xlim(), *ax.get_ylim(), ax.bbox.width, ax.bbox.height)
+            line.set_data(points[:, 0], points[:, 1])
+            fig.canvas.draw()
+            return len(points)
+        draw_time, count = timed(redraw)
+        draw_times.append(draw_time)
+        shown.append(count)
+    rect_time, selected = timed(lambda: index.points_in_rect(*rect), 5)
+    polygon_time, selected_polygon = timed(lambda: index.points_in_polygon(polygon))
+    print(f"grid index:              build {build_time:7.1f} ms, rectangle {rect_time:6.1f} ms, "
+          f"polygon {polygon_time:6.1f} ms, same selection: "
+          f"{np.array_equal(selected, expected) and np.array_equal(selected_polygon, expected_polygon)}")
+    for zoom, draw_time, count in zip((1, 4, 16, 64, 256), draw_times, shown):
+        print(f"  zoom {zoom:3d}x: view + draw {draw_time:7.1f} ms, {count} points drawn")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000000)
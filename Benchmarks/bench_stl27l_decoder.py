@@ -0,0 +1,78 @@
+import sys
+import time
+import math
+import numpy as np
+from Lidar_classes import STL27L, STL27L_FRAME_SIZE, find_stl27l_frames, decode_stl27l_frames, polar_to_cartesian
+from Lidar_replay import ReplaySerial
+from Benchmarks.replay_data import stl27l_stream_from_scans, corrupt_stream
+
+
+def legacy_decode(ser):
+    # Byte-by-byte loop from the original STL27L.make_full_scan
+    distances = []
+    angles = []
+    while ser.in_waiting >= STL27L_FRAME_SIZE:
+        first_byte = ord(ser.read(1))
+        if first_byte == 84:
+            second_byte = ord(ser.read(1))
+            if second_byte == 44:
+                data = ser.read(45)
+
+                start_angle = data[3] * 256 + data[2]
+                end_angle = data[41] * 256 + data[40]
+                diff = ((end_angle - start_angle) / 100) / 11
+
+                decimal_data = [int(byte) for byte in data[4:40]]
+
+                distances += [decimal_data[i * 3] + decimal_data[i * 3 + 1] * 256 for i in range(0, 12)]
+                angles += [start_angle / 100 + diff * j for j in range(0, 12)]
+
+    points_x = [distances[j] * math.sin(math.radians(angles[j])) for j in range(len(distances))]
+    points_y = [distances[j] * math.cos(math.radians(angles[j])) for j in range(len(distances))]
+    return points_x, points_y
+
+
+def vectorized_decode(ser):
+    buffer = bytearray(ser.read(ser.in_waiting))
+    starts, _ = find_stl27l_frames(buffer)
+    angles, distances, _ = decode_stl27l_frames(buffer, starts)
+    return polar_to_cartesian(angles, distances)
+
+
+def measure(decode, stream, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        ser = ReplaySerial(stream)
+        start_time = time.perf_counter()
+        decode(ser)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def main(capture_files):
+    if capture_files:
+        stream = b''.join(open(filename, 'rb').read() for filename in capture_files)
+    else:
+        stream = stl27l_stream_from_scans()
+    n_frames = len(find_stl27l_frames(stream)[0])
+    print(f"Replaying {len(stream)} bytes, {n_frames} frames")
+
+    legacy_time = measure(legacy_decode, stream, 3)
+    vectorized_time = measure(vectorized_decode, stream, 10)
+    print(f"before: {n_frames / legacy_time:12.0f} frames/s")
+    print(f"after:  {n_frames / vectorized_time:12.0f} frames/s  ({legacy_time / vectorized_time:.1f}x)")
+
+    # Decoding path of make_full_scan with CRC check and resynchronization, on a damaged stream
+    damaged = corrupt_stream(stream, n_frames // 20)
+    ser = ReplaySerial(damaged)
+    lidar = STL27L(ser=ser)
+    start_time = time.perf_counter()
+    while ser.in_waiting:
+        lidar.stream_buffer += ser.read(4096)
+        lidar.decode_stream_buffer()
+    elapsed = time.perf_counter() - start_time
+    print(f"damaged stream: {lidar.frame_counters['valid'] / elapsed:12.0f} frames/s, counters {lidar.frame_counters}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
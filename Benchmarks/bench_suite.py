@@ -0,0 +1,275 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import scipy
+from Lidar_classes import STL27L, A2M8, A2M8_POINTS_PER_PACKET, STL27L_POINTS_PER_FRAME, polar_to_cartesian
+from Lidar_replay import ReplaySerial
+from Lidar_instrumentation import METRICS_DIRECTORY
+from ICP_function import apply_transformation, find_edge_points, filter_points_by_distance, icp, icp_algorithm
+from Slice_metrics import slice_metrics, angle_metrics
+from Scan_format import save_scan, load_cloud
+from Benchmarks.replay_data import load_scan_polar, resample_revolution, stl27l_stream_from_scans, \
+    a2m8_stream_from_scans
+from Benchmarks.bench_icp import SLICE_PAIRS
+
+# Points per revolution, slice or file - every case is run at each size so the scaling is recorded too
+SIZES = [500, 1000, 2000, 4000, 8000]
+# Revolutions per decoded stream
+DECODER_REVOLUTIONS = 5
+# Each size is repeated for at least MIN_TIME seconds and MIN_REPEATS times, after one warm-up call
+MIN_TIME = 0.5
+MIN_REPEATS = 5
+MAX_REPEATS = 1000
+# A case is reported as a regression when its median is this many times the one of the compared run
+REGRESSION_RATIO = 1.2
+
+
+def reference_revolution(pattern='Scans/**/W_*.csv'):
+    filename = next(filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename))
+    return load_scan_polar(filename)
+
+
+def cloud_of_size(n_points):
+    # A recorded revolution resampled to n_points, as an (N, 2) cloud in scan order
+    return np.column_stack(polar_to_cartesian(*resample_revolution(*reference_revolution(), n_points)))
+
+
+def l_profile(n_points, corner_angle=90.0, rotation=np.radians(30), noise=5.0, seed=0):
+    # A slice of an L-profile with its corner 3 m in front of the sensor and n_points split between the sides
+    rng = np.random.default_rng(seed)
+    corner = np.array([0.0, 3000.0])
+    n_first = n_points * 3 // 5
+    sides = []
+    for angle, arm, count in ((rotation, 300.0, n_first),
+                              (rotation + np.radians(corner_angle), 200.0, n_points - n_first)):
+        direction = np.array([np.cos(angle), np.sin(angle)])
+        sides.append(corner + np.linspace(0, arm, count)[:, np.newaxis] * direction)
+    points = np.concatenate(sides) + rng.normal(0, noise, (n_points, 2))
+    return points[np.argsort(np.arctan2(points[:, 0], points[:, 1]))]
+
+
+def decode_stl27l(stream):
+    lidar = STL27L(ser=ReplaySerial(stream))
+    while lidar.make_full_scan() is not None:
+        pass
+    return lidar
+
+
+def decode_a2m8(stream):
+    lidar = A2M8(ser=ReplaySerial(stream))
+    previous_angle = previous_start_angle = 0
+    while lidar.ser.in_waiting:
+        _, previous_angle, previous_start_angle = lidar.make_full_scan(previous_angle, previous_start_angle)
+    return lidar
+
+
+def stl27l_case(n_points):
+    n_points -= n_points % STL27L_POINTS_PER_FRAME
+    stream = stl27l_stream_from_scans(n_files=DECODER_REVOLUTIONS, points_per_revolution=n_points)
+    return lambda: decode_stl27l(stream), n_points
+
+
+def a2m8_case(n_points):
+    n_points -= n_points % A2M8_POINTS_PER_PACKET
+    stream = a2m8_stream_from_scans(n_files=DECODER_REVOLUTIONS, points_per_revolution=n_points)
+    return lambda: decode_a2m8(stream), n_points
+
+
+def icp_case(n_points):
+    # Point-to-line ICP of a profile against itself moved by a known transform
+    target = l_profile(n_points)
+    source = apply_transformation(l_profile(n_points, seed=1), np.array([20.0, -15.0, np.radians(3.0)]))
+    return lambda: icp(source, target, method='point_to_line'), n_points
+
+
+def icp_algorithm_case(pair):
+    # The whole multi-start search of the ICP tab on a recorded slice pair
+    n_points = sum(len(load_cloud(f'Slices/{name}')) for name in pair)
+    return lambda: icp_algorithm(*pair), n_points
+
+
+def slice_metrics_case(n_points):
+    profile = l_profile(n_points)
+    return lambda: slice_metrics(profile), n_points
+
+
+def angle_metrics_case(n_points):
+    profile = l_profile(n_points)
+    return lambda: angle_metrics(profile), n_points
+
+
+def edge_points_case(n_points):
+    cloud = cloud_of_size(n_points)
+    return lambda: find_edge_points(cloud), n_points
+
+
+def filter_distance_case(n_points):
+    cloud = cloud_of_size(n_points)
+    return lambda: filter_points_by_distance(cloud, 1000), n_points
+
+
+def save_in_directory(lidar, directory):
+    # save_scan_to_csv writes to Scans/ of the working directory
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        lidar.save_scan_to_csv()
+    finally:
+        os.chdir(working_directory)
+
+
+def csv_save_case(n_points, directory):
+    # The app's own CSV save of the latest revolution in the buffer
+    lidar = STL27L(ser=ReplaySerial(b''))
+    lidar.revolution_buffer.append(*resample_revolution(*reference_revolution(), n_points))
+    lidar.revolution_buffer.commit()
+    os.makedirs(os.path.join(directory, 'Scans'), exist_ok=True)
+    return lambda: save_in_directory(lidar, directory), n_points
+
+
+def csv_load_case(n_points, directory):
+    filename = os.path.join(directory, f'load_{n_points}.csv')
+    np.savetxt(filename, cloud_of_size(n_points), delimiter=',')
+    return lambda: load_cloud(filename), n_points
+
+
+def scan_save_case(n_points, directory):
+    cloud = cloud_of_size(n_points)
+    filename = os.path.join(directory, f'save_{n_points}.lscan')
+    return lambda: save_scan(filename, cloud[:, 0], cloud[:, 1]), n_points
+
+
+def scan_load_case(n_points, directory):
+    cloud = cloud_of_size(n_points)
+    filename = os.path.join(directory, f'load_{n_points}.lscan')
+    save_scan(filename, cloud[:, 0], cloud[:, 1])
+    return lambda: load_cloud(filename), n_points
+
+
+def make_cases(directory):
+    # name -> (setup(size) returning the timed function and its point count, sizes)
+    return {'decode.stl27l': (stl27l_case, SIZES),
+            'decode.a2m8': (a2m8_case, SIZES),
+            'icp.point_to_line': (icp_case, SIZES),
+            'icp.icp_algorithm': (icp_algorithm_case, SLICE_PAIRS),
+            'analysis.slice_metrics': (slice_metrics_case, SIZES),
+            'analysis.angle_metrics': (angle_metrics_case, SIZES),
+            'filter.find_edge_points': (edge_points_case, SIZES),
+            'filter.filter_points_by_distance': (filter_distance_case, SIZES),
+            'io.csv_save': (lambda n_points: csv_save_case(n_points, directory), SIZES),
+            'io.csv_load': (lambda n_points: csv_load_case(n_points, directory), SIZES),
+            'io.scan_save': (lambda n_points: scan_save_case(n_points, directory), SIZES),
+            'io.scan_load': (lambda n_points: scan_load_case(n_points, directory), SIZES)}
+
+
+def measure(function, min_time=MIN_TIME, min_repeats=MIN_REPEATS, max_repeats=MAX_REPEATS):
+    function()
+    times = []
+    start_time = time.perf_counter()
+    while len(times) < max_repeats and (len(times) < min_repeats or time.perf_counter() - start_time < min_time):
+        call_start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - call_start)
+    times = np.array(times) * 1000
+    return {'repeats': len(times), 'min_ms': float(times.min()), 'median_ms': float(np.median(times)),
+            'p95_ms': float(np.percentile(times, 95)), 'std_ms': float(times.std())}
+
+
+def scaling_exponent(runs):
+    # Slope of log(time) over log(points): about 1 for linear, 2 for quadratic cases
+    points = np.array([run['points'] for run in runs], dtype=float)
+    medians = np.array([run['median_ms'] for run in runs])
+    if len(np.unique(points)) < 2:
+        return None
+    return float(np.polyfit(np.log(points), np.log(medians), 1)[0])
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.strip(), bool(dirty.strip())
+
+
+def run_suite(selected=None, min_time=MIN_TIME, min_repeats=MIN_REPEATS):
+    commit, dirty = git_commit()
+    results = {'commit': commit, 'dirty': dirty, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+               'machine': platform.machine(), 'cpu_count': os.cpu_count(), 'cases': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, (setup, sizes) in make_cases(directory).items():
+            if selected and not any(name.startswith(prefix) for prefix in selected):
+                continue
+            runs = []
+            for size in sizes:
+                function, n_points = setup(size)
+                run = {'size': size if np.isscalar(size) else '/'.join(size), 'points': n_points}
+                run.update(measure(function, min_time, min_repeats))
+                run['points_per_s'] = n_points / run['median_ms'] * 1000
+                runs.append(run)
+                print(f"{name:>34} {run['size']:>18} {n_points:6d} points {run['median_ms']:10.3f} ms "
+                      f"(p95 {run['p95_ms']:.3f}, {run['repeats']} runs)")
+            results['cases'][name] = {'runs': runs, 'scaling_exponent': scaling_exponent(runs)}
+    return results
+
+
+def compare(results, previous, threshold=REGRESSION_RATIO):
+    # Median of every case and size against a previous run; the regressions are returned
+    print(f"compared with {previous['commit']} of {previous['timestamp']}")
+    regressions = []
+    for name, case in results['cases'].items():
+        previous_runs = {run['size']: run for run in previous['cases'].get(name, {}).get('runs', [])}
+        for run in case['runs']:
+            if run['size'] not in previous_runs:
+                continue
+            ratio = run['median_ms'] / previous_runs[run['size']]['median_ms']
+            flag = 'slower' if ratio > threshold else 'faster' if ratio < 1 / threshold else ''
+            print(f"{name:>34} {run['size']:>18} {previous_runs[run['size']]['median_ms']:10.3f} -> "
+                  f"{run['median_ms']:10.3f} ms  {ratio:5.2f}x {flag}")
+            if flag == 'slower':
+                regressions.append((name, run['size'], ratio))
+    return regressions
+
+
+def main(args):
+    results = run_suite(args.cases, args.min_time, args.min_repeats)
+    print('scaling exponents: ' + ', '.join(f"{name} {case['scaling_exponent']:.2f}"
+                                            for name, case in results['cases'].items()
+                                            if case['scaling_exponent'] is not None))
+    filename = args.output
+    if filename is None:
+        commit = (results['commit'] or 'nogit')[:10] + ('-dirty' if results['dirty'] else '')
+        filename = os.path.join(METRICS_DIRECTORY, f"bench_{time.strftime('%Y%m%d-%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, mode='w') as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {filename}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} regressions over {args.threshold:.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless timings of the decoders, ICP, slice analysis and scan '
+                                                 'file I/O at several point counts, stored as JSON')
+    parser.add_argument('cases', nargs='*', help='case name prefixes, e.g. decode icp.point_to_line (default all)')
+    parser.add_argument('--output', default=None, help='JSON file, by default Metrics/bench_<time>_<commit>.json')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_RATIO,
+                        help='slowdown ratio reported as a regression (exit status 1)')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds per case and size')
+    parser.add_argument('--min-repeats', type=int, default=MIN_REPEATS)
+    main(parser.parse_args())
@@ -0,0 +1,61 @@
+import glob
+import os
+import numpy as np
+from Lidar_classes import STL27L_POINTS_PER_FRAME, A2M8_POINTS_PER_PACKET, A2M8_ANGLE_OFFSET
+from Lidar_simulator import encode_stl27l_frames, encode_a2m8_packets
+
+
+def load_scan_polar(filename):
+    cloud = np.loadtxt(filename, delimiter=',', ndmin=2)
+    angles = np.degrees(np.arctan2(cloud[:, 0], cloud[:, 1])) % 360
+    distances = np.hypot(cloud[:, 0], cloud[:, 1])
+    order = np.argsort(angles)
+    return angles[order], distances[order]
+
+
+def resample_revolution(angles, distances, n_points):
+    new_angles = np.arange(n_points) * (360 / n_points)
+    new_distances = np.interp(new_angles, angles, distances, period=360)
+    return new_angles, new_distances
+
+
+def encode_stl27l_revolution(angles, distances, timestamp=0):
+    n_frames = len(angles) // STL27L_POINTS_PER_FRAME
+    return encode_stl27l_frames(angles, distances, timestamps=timestamp + np.arange(n_frames))
+
+
+def stl27l_stream_from_scans(pattern='Scans/**/W_*.csv', n_files=20, points_per_revolution=2160):
+    stream = bytearray()
+    filenames = [filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename)]
+    for filename in filenames[:n_files]:
+        angles, distances = resample_revolution(*load_scan_polar(filename), points_per_revolution)
+        stream += encode_stl27l_revolution(angles, distances, len(stream) // 47)
+    return bytes(stream)
+
+
+def corrupt_stream(stream, n_errors, seed=0):
+    # Flip random bytes and cut random byte runs out of the stream
+    rng = np.random.default_rng(seed)
+    data = bytearray(stream)
+    for position in rng.integers(0, len(data), n_errors // 2):
+        data[position] ^= 0xFF
+    for position in np.sort(rng.integers(0, len(data) - 20, n_errors - n_errors // 2))[::-1]:
+        del data[position:position + int(rng.integers(1, 20))]
+    return bytes(data)
+
+
+def a2m8_stream_from_scans(pattern='Scans/**/S_*.csv', n_files=20, points_per_revolution=1600, seed=0):
+    rng = np.random.default_rng(seed)
+    filenames = [filename for filename in sorted(glob.glob(pattern, recursive=True)) if os.path.getsize(filename)]
+    step = 360 / points_per_revolution
+    packets_per_revolution = points_per_revolution // A2M8_POINTS_PER_PACKET
+    stream = bytearray()
+    for filename in filenames[:n_files]:
+        scan_angles, scan_distances = load_scan_polar(filename)
+        start_angles = np.arange(packets_per_revolution) * A2M8_POINTS_PER_PACKET * step
+        point_angles = start_angles[:, np.newaxis] + step * np.arange(1, A2M8_POINTS_PER_PACKET + 1) \
+            - A2M8_POINTS_PER_PACKET * step + A2M8_ANGLE_OFFSET
+        compensation = rng.integers(-31, 32, size=point_angles.shape) / 8
+        distances = np.interp((point_angles - compensation) % 360, scan_angles, scan_distances, period=360)
+        stream += encode_a2m8_packets(start_angles, distances, compensation)
+    return bytes(stream)
@@ -0,0 +1,105 @@
+import numpy as np
+from matplotlib.path import Path
+
+# Fine grid of the index: about this many points per occupied cell, at most this many cells
+POINTS_PER_CELL = 4
+MAX_CELLS = 1 << 22
+# Coarser levels are added until one has at most this many points
+MIN_LEVEL_POINTS = 2000
+
+
+def cell_runs(keys, nx, cx0, cx1, cy0, cy1):
+    # Entries of the sorted keys in cell columns cx0..cx1 of rows cy0..cy1 - one contiguous run per row, found
+    # with two binary searches. Returns the start and length of every run
+    rows = np.arange(cy0, cy1 + 1, dtype=np.int64) * nx
+    starts = np.searchsorted(keys, rows + cx0, side='left')
+    return starts, np.searchsorted(keys, rows + cx1, side='right') - starts
+
+
+def expand_runs(starts, counts):
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()))
+
+
+class GridIndex:
+    # Points sorted by the cell of a fine grid. Level 0 holds every point, each coarser level one real point per
+    # cell of twice the size of the level before, so a view never needs more points than it has pixels
+    def __init__(self, points):
+        self.points = np.asarray(points)[:, :2]
+        n = len(self.points)
+        # Column by column - a reduction along axis 0 of an (N, 2) array is an order of magnitude slower
+        self.origin = np.array([self.points[:, 0].min(), self.points[:, 1].min()]) if n else np.zeros(2)
+        extent = np.array([self.points[:, 0].max(), self.points[:, 1].max()]) - self.origin if n else np.ones(2)
+        extent = np.maximum(extent, 1e-9)
+        cells = min(max(n // POINTS_PER_CELL, 1), MAX_CELLS)
+        self.cell_size = max(np.sqrt(extent[0] * extent[1] / cells), extent.max() / np.sqrt(MAX_CELLS))
+        self.shape = (extent // self.cell_size).astype(np.int64) + 1
+
+        columns, rows = self.cells(self.points).T
+        order = np.argsort(rows * self.shape[0] + columns)
+        self.levels = [self.make_level(columns[order], rows[order], order, 0, 0.0)]
+        shift = 0
+        while len(self.levels[-1]['indices']) > MIN_LEVEL_POINTS and (self.shape >> shift > 1).any():
+            self.levels.append(self.coarser_level(self.levels[-1], shift))
+            shift += 1
+
+    def cells(self, points):
+        # Truncation is the floor for the points right of the origin, those left of it are clipped to 0 anyway
+        cells = ((points - self.origin) * (1 / self.cell_size)).astype(np.int64)
+        return np.clip(cells, 0, self.shape - 1)
+
+    def make_level(self, columns, rows, indices, shift, cell_size):
+        # Entries keep their fine-grid cells; the level's keys are those of cells 2 ** shift times larger
+        nx = int(((self.shape[0] - 1) >> shift) + 1)
+        return {'keys': (rows >> shift) * nx + (columns >> shift), 'columns': columns, 'rows': rows,
+                'indices': indices, 'shift': shift, 'nx': nx, 'cell_size': cell_size}
+
+    def coarser_level(self, level, shift):
+        # The first entry of the finer level in every cell of the new one
+        nx = int(((self.shape[0] - 1) >> shift) + 1)
+        keys = (level['rows'] >> shift) * nx + (level['columns'] >> shift)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        first = order[np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]]
+        return self.make_level(level['columns'][first], level['rows'][first], level['indices'][first], shift,
+                               self.cell_size * 2 ** shift)
+
+    def level_runs(self, level, x_min, x_max, y_min, y_max):
+        # Runs of the level's entries whose cells overlap the rectangle
+        outside = x_max < self.origin[0] or y_max < self.origin[1] or \
+            x_min > self.origin[0] + self.shape[0] * self.cell_size or \
+            y_min > self.origin[1] + self.shape[1] * self.cell_size
+        if outside or x_max < x_min or y_max < y_min:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        (cx0, cy0), (cx1, cy1) = self.cells(np.array([[x_min, y_min], [x_max, y_max]])) >> level['shift']
+        return cell_runs(level['keys'], level['nx'], cx0, cx1, cy0, cy1)
+
+    def view(self, x_min, x_max, y_min, y_max, width_pixels, height_pixels, pixels_per_point=2):
+        # Points to draw for the axes limits: the finest level with at most one point per pixels_per_point x
+        # pixels_per_point pixels in view - every point once zoomed in far enough
+        budget = width_pixels * height_pixels / pixels_per_point ** 2
+        for level in self.levels:
+            starts, counts = self.level_runs(level, x_min, x_max, y_min, y_max)
+            if counts.sum() <= budget:
+                break
+        return self.points[level['indices'][expand_runs(starts, counts)]]
+
+    def candidates(self, x_min, x_max, y_min, y_max):
+        # Original indices of the points in the cells overlapping the rectangle
+        level = self.levels[0]
+        return level['indices'][expand_runs(*self.level_runs(level, x_min, x_max, y_min, y_max))]
+
+    def points_in_rect(self, x1, y1, x2, y2):
+        # Corners in any order; points keep the order they were loaded in
+        x_min, x_max, y_min, y_max = min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)
+        indices = np.sort(self.candidates(x_min, x_max, y_min, y_max))
+        points = self.points[indices]
+        inside = (points[:, 0] >= x_min) & (points[:, 0] <= x_max) & (points[:, 1] >= y_min) & (points[:, 1] <= y_max)
+        return indices[inside]
+
+    def points_in_polygon(self, vertices):
+        vertices = np.asarray(vertices, dtype=float)
+        if len(vertices) < 3:
+            return np.empty(0, dtype=np.int64)
+        (x_min, y_min), (x_max, y_max) = vertices.min(axis=0), vertices.max(axis=0)
+        indices = np.sort(self.candidates(x_min, x_max, y_min, y_max))
+        return indices[Path(vertices).contains_points(self.points[indices])]
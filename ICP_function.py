@@ -1,37 +1,46 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 from scipy.spatial import KDTree
-from scipy.optimize import minimize
-
-
-def find_edge_points(cloud, threshold=1):
-    edge_points = []
-    for i in range(len(cloud)):
-        if 0 < i < len(cloud) - 1:
-            prev_diff = np.linalg.norm(cloud[i - 1] - cloud[i])
-            next_diff = np.linalg.norm(cloud[i + 1] - cloud[i])
-            if prev_diff > threshold and next_diff > threshold:
-                edge_points.append(cloud[i])
-    return np.array(edge_points)
-
-
-def distance(point_a, point_b):
-    return np.linalg.norm(point_a - point_b)
-
-
-def minimize_objective_function(objective_function, source_cloud, target_cloud, initial_params):
-    result = minimize(
-        objective_function,
-        initial_params,
-        args=(source_cloud, target_cloud),
-        method='BFGS'
-    )
-
-    print("Wynik optymalizacji:", result.x)
-
-    params = result.x
-    transformed_cloud = apply_transformation(source_cloud, params)
-
-    return transformed_cloud, target_cloud
+from Scan_format import load_cloud
+from Lidar_instrumentation import instruments
+
+INITIAL_TRANSLATIONS_X = [-100, -75, -50, -25, 0, 25, 50, 75, 100]
+INITIAL_TRANSLATIONS_Y = [-100, -50, 0, 50, 100]
+# Radians, like the theta of apply_transformation
+INITIAL_ANGLES = np.radians([-20, -10, 0, 10, 20])
+# Pool workers are spawned, not forked - the searches run from a GUI thread while acquisition threads are running
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def find_edge_points(cloud, threshold=1, window=1):
+    # Points further than threshold from both their window-th previous and next neighbour
+    if len(cloud) < 2 * window + 1:
+        return np.empty((0, cloud.shape[1] if cloud.ndim == 2 else 2))
+    centre = cloud[window:len(cloud) - window]
+    prev_diff = np.linalg.norm(cloud[:len(cloud) - 2 * window] - centre, axis=1)
+    next_diff = np.linalg.norm(cloud[2 * window:] - centre, axis=1)
+    return centre[(prev_diff > threshold) & (next_diff > threshold)]
+
+
+def point_curvature(cloud, window=5):
+    # LOAM-style smoothness: norm of the summed offsets to the 2 * window neighbours, relative to the range
+    curvature = np.full(len(cloud), np.nan)
+    if len(cloud) < 2 * window + 1:
+        return curvature
+    cumulative = np.vstack((np.zeros((1, 2)), np.cumsum(cloud[:, :2], axis=0)))
+    neighbour_sum = cumulative[2 * window + 1:] - cumulative[:len(cloud) - 2 * window]
+    centre = cloud[window:len(cloud) - window, :2]
+    offsets = neighbour_sum - (2 * window + 1) * centre
+    curvature[window:len(cloud) - window] = (np.linalg.norm(offsets, axis=1)
+                                             / (2 * window * np.maximum(np.linalg.norm(centre, axis=1), 1e-9)))
+    return curvature
+
+
+def find_curvature_points(cloud, threshold=0.05, window=5):
+    curvature = point_curvature(cloud, window)
+    return cloud[np.nan_to_num(curvature) > threshold]
 
 
 def apply_transformation(source_cloud, params):
@@ -42,21 +51,163 @@ def apply_transformation(source_cloud, params):
     return transformed_cloud
 
 
-def objective_function_spin(params, source_cloud, target_cloud):
-    transformed_source_cloud = apply_transformation(source_cloud, params)
+def transformation_matrix(params):
+    # Homogeneous 3x3 matrix of apply_transformation for column vectors
+    tx, ty, theta = params
+    return np.array([[np.cos(theta), np.sin(theta), tx],
+                     [-np.sin(theta), np.cos(theta), ty],
+                     [0.0, 0.0, 1.0]])
 
-    kdtree = KDTree(target_cloud)
 
-    _, indices = kdtree.query(transformed_source_cloud)
+def wrap_angle(angle):
+    return (angle + np.pi) % (2 * np.pi) - np.pi
 
-    total_distance = np.sum(
-        [distance(transformed_source_cloud[i], target_cloud[indices[i]]) for i in range(len(transformed_source_cloud))])
 
-    return total_distance
+def compose_params(first, second):
+    # Single (tx, ty, theta) doing apply_transformation with first, then with second
+    tx, ty, theta = first
+    second_tx, second_ty, second_theta = second
+    cos, sin = np.cos(second_theta), np.sin(second_theta)
+    return np.array([tx * cos + ty * sin + second_tx, -tx * sin + ty * cos + second_ty,
+                     wrap_angle(theta + second_theta)])
 
 
-def calculate_rmse(transformed_cloud, target_cloud):
-    kdtree = KDTree(target_cloud)
+def invert_params(params):
+    # (tx, ty, theta) undoing apply_transformation with params
+    tx, ty, theta = params
+    cos, sin = np.cos(theta), np.sin(theta)
+    return np.array([-(tx * cos - ty * sin), -(tx * sin + ty * cos), wrap_angle(-theta)])
+
+
+def estimate_normals(cloud, kdtree, k=5):
+    k = min(k, len(cloud))
+    _, indices = kdtree.query(cloud, k=k)
+    neighbours = cloud[indices.reshape(len(cloud), k)]
+    centered = neighbours - neighbours.mean(axis=1, keepdims=True)
+    cxx = np.einsum('ij,ij->i', centered[:, :, 0], centered[:, :, 0])
+    cyy = np.einsum('ij,ij->i', centered[:, :, 1], centered[:, :, 1])
+    cxy = np.einsum('ij,ij->i', centered[:, :, 0], centered[:, :, 1])
+    # Closed-form principal direction of the 2x2 covariance, the normal is perpendicular to it
+    direction = 0.5 * np.arctan2(2 * cxy, cxx - cyy)
+    return np.column_stack((-np.sin(direction), np.cos(direction)))
+
+
+def point_to_point_step(source, target, weights=None):
+    # Closed-form (SVD) rigid motion mapping source onto target: target ~ rotation @ source + translation
+    source_centroid = np.average(source, axis=0, weights=weights)
+    target_centroid = np.average(target, axis=0, weights=weights)
+    centered_source = source - source_centroid
+    if weights is not None:
+        centered_source *= weights[:, np.newaxis]
+    covariance = centered_source.T @ (target - target_centroid)
+    u, _, vt = np.linalg.svd(covariance)
+    rotation = vt.T @ u.T
+    if np.linalg.det(rotation) < 0:
+        vt[-1] *= -1
+        rotation = vt.T @ u.T
+    angle = np.arctan2(rotation[1, 0], rotation[0, 0])
+    return angle, target_centroid - rotation @ source_centroid
+
+
+def point_to_line_step(source, target, normals, weights=None):
+    # One Gauss-Newton step minimizing the distance of source points to the target tangent lines
+    residuals = np.einsum('ij,ij->i', source - target, normals)
+    jacobian = np.column_stack((normals[:, 1] * source[:, 0] - normals[:, 0] * source[:, 1], normals))
+    if weights is not None:
+        # Weighted least squares - rows scaled by the square root of the weights
+        root_weights = np.sqrt(weights)
+        jacobian *= root_weights[:, np.newaxis]
+        residuals *= root_weights
+    delta = np.linalg.lstsq(jacobian, -residuals, rcond=None)[0]
+    angle = delta[0]
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    # Linearized around the origin - re-express the translation for the exact rotation
+    return angle, delta[1:] + (np.eye(2) + np.array([[0, -angle], [angle, 0]]) - rotation) @ np.average(
+        source, axis=0, weights=weights)
+
+
+def robust_correspondences(distances, matched, loss, trim_fraction=0.8, huber_scale=None):
+    # Narrows the matched correspondences (trimmed) or weights them (huber); plain least squares otherwise
+    if loss == 'trimmed':
+        # Only the closest share of the correspondences takes part
+        matched = matched & (distances <= np.quantile(distances[matched], trim_fraction))
+        return matched, None
+    if loss == 'huber':
+        matched_distances = distances[matched]
+        if huber_scale is None:
+            # 1.345 robust standard deviations, estimated from the median distance
+            huber_scale = max(1.345 * 1.4826 * np.median(matched_distances), 1e-9)
+        return matched, np.minimum(1.0, huber_scale / np.maximum(matched_distances, 1e-12))
+    return matched, None
+
+
+def find_correspondences(kdtree, cloud, max_distance=None):
+    if max_distance is None:
+        distances, indices = kdtree.query(cloud)
+        return distances, indices, np.ones(len(distances), dtype=bool)
+    # Points without a neighbour within the bound come back with an infinite distance
+    distances, indices = kdtree.query(cloud, distance_upper_bound=max_distance)
+    return distances, indices, distances <= max_distance
+
+
+def icp(source_cloud, target_cloud, initial_params=(0.0, 0.0, 0.0), method='point_to_point', max_iterations=50,
+        tolerance=1e-6, max_correspondence_distance=None, kdtree=None, normals=None, loss=None, trim_fraction=0.8,
+        huber_scale=None):
+    if kdtree is None:
+        kdtree = KDTree(target_cloud)
+    if method == 'point_to_line' and normals is None:
+        normals = estimate_normals(target_cloud, kdtree)
+
+    # Work with p' = rotation @ p + translation; apply_transformation uses the transposed rotation
+    tx, ty, theta = initial_params
+    angle = -theta
+    translation = np.array([tx, ty], dtype=float)
+    residuals = []
+    converged = False
+    inlier_ratio = 0.0
+    for _ in range(max_iterations):
+        params = (translation[0], translation[1], -angle)
+        transformed_cloud = apply_transformation(source_cloud, params)
+        distances, indices, matched = find_correspondences(kdtree, transformed_cloud, max_correspondence_distance)
+        if np.count_nonzero(matched) < 3:
+            break
+        matched, weights = robust_correspondences(distances, matched, loss, trim_fraction, huber_scale)
+        inlier_ratio = np.count_nonzero(matched) / len(matched)
+        residuals.append(np.sqrt(np.mean(distances[matched] ** 2)))
+        if len(residuals) > 1 and abs(residuals[-2] - residuals[-1]) < tolerance:
+            converged = True
+            break
+
+        if method == 'point_to_line':
+            step_angle, step_translation = point_to_line_step(transformed_cloud[matched], target_cloud[indices[matched]],
+                                                              normals[indices[matched]], weights)
+        else:
+            step_angle, step_translation = point_to_point_step(transformed_cloud[matched],
+                                                               target_cloud[indices[matched]], weights)
+        step_rotation = np.array([[np.cos(step_angle), -np.sin(step_angle)],
+                                  [np.sin(step_angle), np.cos(step_angle)]])
+        angle += step_angle
+        translation = step_rotation @ translation + step_translation
+        if abs(step_angle) < tolerance and np.linalg.norm(step_translation) < tolerance:
+            converged = True
+            break
+
+    params = np.array([translation[0], translation[1], -angle])
+    transformed_cloud = apply_transformation(source_cloud, params)
+    # The residuals are measured before each step, so the last one does not include the last update
+    rmse = np.inf
+    distances, _, matched = find_correspondences(kdtree, transformed_cloud, max_correspondence_distance)
+    if residuals and np.count_nonzero(matched) >= 3:
+        matched, _ = robust_correspondences(distances, matched, loss, trim_fraction, huber_scale)
+        rmse = np.sqrt(np.mean(distances[matched] ** 2))
+    return {'params': params, 'matrix': transformation_matrix(params), 'transformed_cloud': transformed_cloud,
+            'rmse': rmse, 'residuals': residuals,
+            'iterations': len(residuals), 'converged': converged, 'inlier_ratio': inlier_ratio}
+
+
+def calculate_rmse(transformed_cloud, target_cloud, kdtree=None):
+    if kdtree is None:
+        kdtree = KDTree(target_cloud)
     _, indices = kdtree.query(transformed_cloud)
     distances = np.linalg.norm(transformed_cloud - target_cloud[indices], axis=1)
     rmse = np.sqrt(np.mean(distances**2))
@@ -64,40 +215,132 @@ def calculate_rmse(transformed_cloud, target_cloud):
 
 
 def filter_points_by_distance(points, max_distance):
-    filtered_points = []
+    # Keeps points whose x and y steps to the next point are both below max_distance
+    steps = np.abs(np.diff(points[:, :2], axis=0))
+    return points[:-1, :2][np.all(steps < max_distance, axis=1)]
 
-    for i in range(0, len(points)-1):
-        ok_x = abs(points[i, 0] - points[i + 1, 0])
-        ok_y = abs(points[i, 1] - points[i + 1, 1])
-        if ok_x < max_distance and ok_y < max_distance:
-            filtered_points.append([points[i, 0], points[i, 1]])
 
-    return np.array(filtered_points)
+def filter_points_by_angular_gap(points, max_distance, angle_step=None):
+    # Removes isolated points; the allowed step grows with the number of missing beams between neighbours
+    if len(points) < 2:
+        return points[:0, :2]
+    angles = np.arctan2(points[:, 0], points[:, 1])
+    angle_gaps = np.abs((np.diff(angles) + np.pi) % (2 * np.pi) - np.pi)
+    if angle_step is None:
+        angle_step = np.median(angle_gaps[angle_gaps > 0]) if np.any(angle_gaps > 0) else 1.0
+    allowed = max_distance * np.maximum(1, angle_gaps / angle_step)
+    close = np.linalg.norm(np.diff(points[:, :2], axis=0), axis=1) < allowed
+    keep = np.zeros(len(points), dtype=bool)
+    keep[:-1] |= close
+    keep[1:] |= close
+    return points[keep, :2]
 
 
-def icp_algorithm(cloud1_name, cloud2_name):
-    source_cloud = np.loadtxt(f'Slices/{cloud1_name}', delimiter=',')
-    target_cloud = np.loadtxt(f'Slices/{cloud2_name}', delimiter=',')
+def initial_params_grid(tx_values=INITIAL_TRANSLATIONS_X, ty_values=INITIAL_TRANSLATIONS_Y,
+                        theta_values=INITIAL_ANGLES):
+    tx, ty, theta = np.meshgrid(tx_values, ty_values, theta_values, indexing='ij')
+    return np.column_stack((tx.ravel(), ty.ravel(), theta.ravel())).astype(float)
 
-    source_cloud = filter_points_by_distance(source_cloud, 1000)
 
-    edge_source_cloud = find_edge_points(source_cloud)
-    edge_target_cloud = find_edge_points(target_cloud)
+_icp_worker_state = {}
 
-    init = [-100, -75, -50, -25, 0, 25, 50, 75, 100]
 
-    best_cloud = None
-    best_rmse = np.inf
+def _init_icp_worker(source_cloud, target_cloud, method):
+    # Runs once per pool process, so every start reuses the same KD-tree and normals
+    kdtree = KDTree(target_cloud)
+    _icp_worker_state.update(source_cloud=source_cloud, target_cloud=target_cloud, method=method, kdtree=kdtree,
+                             normals=estimate_normals(target_cloud, kdtree) if method == 'point_to_line' else None)
+
+
+def _run_icp_start(initial_params, max_iterations):
+    state = _icp_worker_state
+    result = icp(state['source_cloud'], state['target_cloud'], initial_params, state['method'], max_iterations,
+                 kdtree=state['kdtree'], normals=state['normals'])
+    return result['params'], calculate_rmse(result['transformed_cloud'], state['target_cloud'], state['kdtree'])
+
+
+def _run_icp_starts(pool, starts, max_iterations, rmse_threshold, progress=None, cancelled=None, done=0, total=None):
+    # Returns the finished results and whether the threshold was reached or the search was cancelled
+    results = []
+
+    def should_stop():
+        if progress is not None:
+            progress(done + len(results), total or len(starts), min(result[1] for result in results))
+        if rmse_threshold is not None and results[-1][1] <= rmse_threshold:
+            return True
+        return cancelled is not None and cancelled()
+
+    if pool is None:
+        for initial_params in starts:
+            results.append(_run_icp_start(initial_params, max_iterations))
+            if should_stop():
+                return results, True
+        return results, False
+
+    futures = [pool.submit(_run_icp_start, initial_params, max_iterations) for initial_params in starts]
+    for future in as_completed(futures):
+        results.append(future.result())
+        if should_stop():
+            # Good enough or cancelled - drop the starts that have not been picked up yet
+            for pending in futures:
+                pending.cancel()
+            return results, True
+    return results, False
+
+
+def multi_start_icp(source_cloud, target_cloud, initial_params, method='point_to_point', max_iterations=50,
+                    rmse_threshold=None, refine_best=None, coarse_iterations=5, max_workers=None, progress=None,
+                    cancelled=None):
+    max_workers = min(max_workers or os.cpu_count() or 1, len(initial_params))
+    pool = None
+    if max_workers > 1:
+        pool = ProcessPoolExecutor(max_workers, mp_context=POOL_CONTEXT, initializer=_init_icp_worker,
+                                   initargs=(source_cloud, target_cloud, method))
+    else:
+        _init_icp_worker(source_cloud, target_cloud, method)
+    try:
+        if refine_best:
+            # Coarse pass with a few iterations per start, then full ICP only from the k best
+            total = len(initial_params) + refine_best
+            results, stopped_early = _run_icp_starts(pool, initial_params, coarse_iterations, rmse_threshold,
+                                                     progress, cancelled, 0, total)
+            starts_run = len(results)
+            # Threshold reached or cancelled in the coarse pass - nothing left to refine
+            if not stopped_early:
+                results.sort(key=lambda result: result[1])
+                results, stopped_early = _run_icp_starts(pool, [params for params, _ in results[:refine_best]],
+                                                         max_iterations, rmse_threshold, progress, cancelled,
+                                                         starts_run, starts_run + refine_best)
+        else:
+            results, stopped_early = _run_icp_starts(pool, initial_params, max_iterations, rmse_threshold,
+                                                     progress, cancelled)
+            starts_run = len(results)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    if cancelled is not None and cancelled():
+        return None
+    best_params, best_rmse = min(results, key=lambda result: result[1])
+    return {'params': best_params, 'rmse': best_rmse, 'transformed_cloud': apply_transformation(source_cloud, best_params),
+            'starts_run': starts_run, 'stopped_early': stopped_early}
+
+
+def icp_algorithm(cloud1_name, cloud2_name, method='point_to_point', rmse_threshold=1.0, refine_best=5,
+                  max_workers=None, progress=None, cancelled=None):
+    source_cloud = load_cloud(f'Slices/{cloud1_name}')
+    target_cloud = load_cloud(f'Slices/{cloud2_name}')
+
+    source_cloud = filter_points_by_distance(source_cloud, 1000)
 
-    for i in init:
-        for j in init:
-            initial_params = np.array([j, 0.0, i])
-            transformed_source_cloud, target_cloud = minimize_objective_function(
-                objective_function_spin, edge_source_cloud, edge_target_cloud, initial_params)
+    edge_source_cloud = find_edge_points(source_cloud)
+    edge_target_cloud = find_edge_points(target_cloud)
 
-            rmse = calculate_rmse(transformed_source_cloud, target_cloud)
-            if rmse < best_rmse:
-                best_rmse = rmse
-                best_cloud = transformed_source_cloud
+    with instruments.span('icp.optimize'):
+        result = multi_start_icp(edge_source_cloud, edge_target_cloud, initial_params_grid(), method,
+                                 rmse_threshold=rmse_threshold, refine_best=refine_best, max_workers=max_workers,
+                                 progress=progress, cancelled=cancelled)
+    if result is None:
+        return None
 
-    return best_cloud, target_cloud, best_rmse
+    return result['transformed_cloud'], edge_target_cloud, result['rmse']
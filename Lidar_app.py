@@ -1,35 +1,55 @@
 import sys
+import argparse
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QFrame, QHBoxLayout, \
-    QWidget, QStackedWidget, QComboBox, QLineEdit
+    QWidget, QStackedWidget, QComboBox, QLineEdit, QLabel, QShortcut
+from PyQt5.QtGui import QKeySequence
 from PyQt5.uic import loadUi
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QPropertyAnimation, QMutex
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QObject, QPropertyAnimation, QMutex, QTimer
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.collections import LineCollection
 import matplotlib.pyplot as plt
 import os
-from ICP_function import icp_algorithm
+import time
+from queue import Queue, Empty
+from ICP_function import icp_algorithm, apply_transformation
 from Lidar_classes import STL27L, A2M8
+from Scan_format import load_cloud
+from Scan_recorder import ScanRecorder
+from Lidar_replay import make_replay_lidar
+from Lidar_process import ProcessLiDAR
+from Lidar_fusion import RevolutionFuser, load_extrinsics
+from Lidar_calibration import calibrate, fused_frame_pair, save_calibration, CALIBRATION_PAIRS
+from Lidar_odometry import ScanOdometry
+from Lidar_features import FeaturePipeline
+from Lidar_instrumentation import instruments
+from Cloud_index import GridIndex
+from Slice_metrics import slice_metrics, angle_metrics
 import numpy as np
 import csv
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
 
+RENDER_FPS = 20
+# Runner of each job kind - the short slice analyses do not wait behind an ICP search or a calibration
+JOB_QUEUES = {'icp': 'search', 'calibration': 'search', 'rmse': 'analysis', 'angle': 'analysis',
+              'slicer': 'analysis'}
 
 class WaveWorker(QObject):
-    queue_W = pyqtSignal(list)
+    queue_W = pyqtSignal(int)
     finished_W = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, lidar=None):
         super().__init__()
         self.is_running = False
-        self.Wave_lidar = STL27L()
+        self.Wave_lidar = lidar if lidar is not None else STL27L()
 
     # noinspection PyUnresolvedReferences
     def do_work(self):
         self.is_running = True
         if self.Wave_lidar.is_active is True:
-            while self.is_running:
-                data_wave = self.Wave_lidar.make_full_scan()
-                self.queue_W.emit(data_wave)
+            # A process-backed sensor reports later whether it started, and stops being active if it did not
+            while self.is_running and self.Wave_lidar.is_active is True:
+                revolution_index = self.Wave_lidar.make_full_scan()
+                if revolution_index is not None:
+                    self.queue_W.emit(revolution_index)
 
             self.Wave_lidar.deactivate()
         self.finished_W.emit()
@@ -47,13 +67,13 @@ class WaveWorker(QObject):
 
 
 class SlamWorker(QObject):
-    queue_S = pyqtSignal(list)
+    queue_S = pyqtSignal(int)
     finished_S = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, lidar=None):
         super().__init__()
         self.is_running = False
-        self.Slam_lidar = A2M8()
+        self.Slam_lidar = lidar if lidar is not None else A2M8()
         self.previous_angle = 0
         self.previous_start_angle = 0
 
@@ -63,10 +83,11 @@ class SlamWorker(QObject):
         if self.Slam_lidar.is_active is True:
             self.Slam_lidar.reset()
             self.Slam_lidar.run()
-            while self.is_running:
-                data_slam, self.previous_angle, self.previous_start_angle = self.Slam_lidar.make_full_scan(
+            while self.is_running and self.Slam_lidar.is_active is True:
+                revolution_index, self.previous_angle, self.previous_start_angle = self.Slam_lidar.make_full_scan(
                     self.previous_angle, self.previous_start_angle)
-                self.queue_S.emit(data_slam)
+                if revolution_index is not None:
+                    self.queue_S.emit(revolution_index)
             self.Slam_lidar.deactivate()
         self.finished_S.emit()
 
@@ -81,10 +102,176 @@ class SlamWorker(QObject):
     def save_lidar_scan(self):
         self.Slam_lidar.save_scan_to_csv()
 
+class FeatureWorker(QObject):
+    result_F = pyqtSignal(str, object)
+    finished_F = pyqtSignal()
+
+    def __init__(self, sensor, pipeline):
+        super().__init__()
+        self.is_running = False
+        self.sensor = sensor
+        self.pipeline = pipeline
+        self.revolutions = Queue()
+        self.dropped = 0
+
+    # noinspection PyUnresolvedReferences
+    def do_work(self):
+        self.is_running = True
+        while self.is_running:
+            try:
+                revolution = self.revolutions.get(timeout=0.1)
+            except Empty:
+                continue
+            # Only the newest revolution is worth the work, the ones that piled up meanwhile are skipped
+            while not self.revolutions.empty():
+                revolution = self.revolutions.get_nowait()
+                self.dropped += 1
+            self.result_F.emit(self.sensor, self.pipeline.process(revolution))
+        self.finished_F.emit()
+
+    def add_revolution(self, revolution):
+        # A copy - the ring buffer slot is written again a few revolutions later
+        self.revolutions.put(revolution)
+
+    def stop_work(self):
+        self.is_running = False
+
+
+class OdometryWorker(QObject):
+    result_O = pyqtSignal(object)
+    finished_O = pyqtSignal()
+
+    def __init__(self, odometry):
+        super().__init__()
+        self.is_running = False
+        self.odometry = odometry
+        self.revolutions = Queue()
+        self.dropped = 0
+
+    # noinspection PyUnresolvedReferences
+    def do_work(self):
+        self.is_running = True
+        while self.is_running:
+            try:
+                revolution = self.revolutions.get(timeout=0.1)
+            except Empty:
+                continue
+            # A match takes several milliseconds - revolutions that piled up meanwhile are skipped, like features
+            while not self.revolutions.empty():
+                revolution = self.revolutions.get_nowait()
+                self.dropped += 1
+            result = self.odometry.add_revolution(revolution['X'], revolution['Y'], revolution['timestamp'])
+            if result is not None:
+                # The statistics are read here, the GUI thread never touches the odometry while it runs
+                result['metrics'] = self.odometry.metrics()
+                self.result_O.emit(result)
+        self.finished_O.emit()
+
+    def add_revolution(self, revolution):
+        # A copy - the ring buffer slot is written again a few revolutions later
+        self.revolutions.put(revolution)
+
+    def stop_work(self):
+        self.is_running = False
+
+
+class JobWorker(QObject):
+    progress_J = pyqtSignal(str, str)
+    result_J = pyqtSignal(str, str, object)
+    finished_J = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.is_running = False
+        self.cancel_requested = False
+        self.jobs = Queue()
+
+    # noinspection PyUnresolvedReferences
+    def do_work(self):
+        self.is_running = True
+        while self.is_running:
+            try:
+                kind, label, function = self.jobs.get(timeout=0.1)
+            except Empty:
+                continue
+            self.cancel_requested = False
+            self.progress_J.emit(kind, f"{label}: running ({self.jobs.qsize()} queued)")
+            try:
+                with instruments.span(f'job.{kind}'):
+                    result = function(lambda text: self.progress_J.emit(
+                        kind, f"{label}: {text} ({self.jobs.qsize()} queued)"), lambda: self.cancel_requested)
+            except Exception as error:
+                # A failed job must not take the runner down with it
+                self.progress_J.emit(kind, f"{label}: failed - {error} ({self.jobs.qsize()} queued)")
+                continue
+            if self.cancel_requested or result is None:
+                self.progress_J.emit(kind, f"{label}: cancelled ({self.jobs.qsize()} queued)")
+            else:
+                self.progress_J.emit(kind, f"{label}: done ({self.jobs.qsize()} queued)")
+                self.result_J.emit(kind, label, result)
+        self.finished_J.emit()
+
+    def add_job(self, kind, label, function):
+        # function(progress, cancelled) runs in the worker thread and must not touch any widgets
+        self.jobs.put((kind, label, function))
+
+    def cancel_job(self):
+        self.cancel_requested = True
+
+    def stop_work(self):
+        self.cancel_requested = True
+        self.is_running = False
+
+
+def icp_job(selected_file1, selected_file2):
+    def run(progress, cancelled):
+        result = icp_algorithm(selected_file1, selected_file2, cancelled=cancelled,
+                               progress=lambda done, total, best_rmse: progress(
+                                   f"start {done}/{total}, best RMSE so far {best_rmse:.4f}"))
+        if result is None:
+            return None
+        return {'transformed_source_cloud': result[0], 'target_cloud': result[1], 'rmse_icp': result[2]}
+    return run
+
+
+def calibration_job(pairs, current_params):
+    def run(progress, cancelled):
+        return calibrate(pairs, current_params, cancelled=cancelled,
+                         progress=lambda done, total: progress(f"pair {done}/{total}"))
+    return run
+
+
+def slicer_job(selected_file):
+    def run(progress, cancelled):
+        cloud = load_cloud(f'Scans/{selected_file}')
+        progress(f"indexing {len(cloud)} points")
+        return {'cloud': cloud, 'index': GridIndex(cloud)}
+    return run
+
+
 # noinspection PyUnresolvedReferences,PyTypeChecker
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, replay_sources=None, replay_speed=1.0, replay_loop=False, acquisition_processes=False,
+                 odometry=False, features=False, profiler='sampling', ports=None, render_fps=RENDER_FPS):
         super().__init__()
+        # Sensor name -> recording, scan files or raw capture played back instead of the hardware
+        self.replay_sources = replay_sources or {}
+        # Sensor name -> serial device or URL (sim:// for the simulator) opened instead of searching by hwid
+        self.ports = ports or {}
+        self.replay_speed = replay_speed
+        self.replay_loop = replay_loop
+        # Read and decode each sensor in its own process instead of a thread of the GUI process
+        self.acquisition_processes = acquisition_processes
+        # Track the STL27L pose from revolution to revolution
+        self.odometry_enabled = odometry
+        self.odometry_worker = None
+        self.odometry_result = None
+        # Lines, corners and clusters of every revolution, drawn over the points
+        self.features_enabled = features
+        self.feature_workers = {}
+        self.latest_features = {}
+        # Instrumentation (spans, counters, profiler) - toggled with F9, profiler F10, export F11
+        self.profiler_kind = profiler
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setWindowFlags(Qt.WindowMinimizeButtonHint | Qt.CustomizeWindowHint)
         QApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
@@ -180,10 +367,26 @@ class MainWindow(QMainWindow):
         self.hLayout1.addWidget(self.canvas1)
         self.plot1 = None
         self.plot2 = None
+        self.stats_text = None
+        self.feature_artists = []
+        self.page1_background = None
+        self.canvas1.mpl_connect('draw_event', self.on_page1_draw)
+        # Page 1 render scheduler - only the latest revolution of each sensor is drawn
+        self.render_fps = render_fps
+        self.render_timer = QTimer(self)
+        self.render_timer.timeout.connect(self.render_plot)
+        self.sensor_plots = {}
+        self.pending_revolutions = {}
+        # With both sensors running, time-matched revolutions are drawn in the A2M8 frame
+        self.fuser = None
+        self.fused_frame = None
+        self.render_stats = {}
         # Page 1 buttons
         self.start_button = self.findChild(QPushButton, 'StartButton')
         self.stop_button = self.findChild(QPushButton, 'StopButton')
         self.saveScan_button = self.findChild(QPushButton, 'SaveScanButton')
+        self.record_button = self.findChild(QPushButton, 'RecordButton')
+        self.calibrate_button = self.findChild(QPushButton, 'CalibrateButton')
         # Page 1 line edit init
         self.radius_value = self.findChild(QLineEdit, 'RadiusValue')
         # Page 1 threads init
@@ -194,6 +397,11 @@ class MainWindow(QMainWindow):
         # Page 1 actions
         self.start_button.clicked.connect(self.start_worker)
         self.stop_button.clicked.connect(self.stop_worker)
+        self.record_button.toggled.connect(self.toggle_recording)
+        self.recorder = None
+        self.calibrate_button.clicked.connect(self.start_calibration)
+        # Fused (STL27L, A2M8) point pairs collected for the next calibration, None when not capturing
+        self.calibration_pairs = None
 
         # Page 2 layout and canvas
         self.page2_plt = self.findChild(QFrame, 'frame_page2')
@@ -210,12 +418,19 @@ class MainWindow(QMainWindow):
         # Page 2 combo box init
         self.choose_scan1 = self.findChild(QComboBox, 'Scan1Box')
         self.choose_scan2 = self.findChild(QComboBox, 'Scan2Box')
+        self.choose_icp_run = self.findChild(QComboBox, 'IcpRunBox')
         # Page 2 buttons
         self.runICP_button = self.findChild(QPushButton, 'MergeButton')
+        self.cancelJob_button = self.findChild(QPushButton, 'CancelJobButton')
+        # Page 2 labels init
+        self.job_status = self.findChild(QLabel, 'JobStatus')
         # Page 3 line edit init
         self.rmseICP_val = self.findChild(QLineEdit, 'RmseIcpValue')
         # Page 2 actions
         self.runICP_button.clicked.connect(self.icp_result)
+        self.cancelJob_button.clicked.connect(self.cancel_job)
+        self.choose_icp_run.currentIndexChanged.connect(self.show_icp_run)
+        self.icp_runs = []
 
         # Page 3 layout and canvas
         self.page3_plt = self.findChild(QFrame, 'frame_page3')
@@ -225,6 +440,16 @@ class MainWindow(QMainWindow):
         self.hLayout3.addWidget(self.canvas3)
         self.canvas3.mpl_connect('scroll_event', self.zoom)
         self.canvas3.mpl_connect('button_press_event', self.on_press)
+        self.canvas3.mpl_connect('motion_notify_event', self.on_move)
+        self.canvas3.mpl_connect('button_release_event', self.on_release)
+        # Loaded scan, its grid index and the decimated points drawn for the current zoom
+        self.selected_cloud = None
+        self.cloud_index = None
+        self.page3_points = None
+        # Rectangle drawn with the left button, polygon clicked with the right one (double click closes it)
+        self.rect = None
+        self.polygon = None
+        self.polygon_vertices = []
         # Page 3 combo box init
         self.choose_scan3 = self.findChild(QComboBox, 'Scan3Box')
         # Page 3 buttons
@@ -271,6 +496,24 @@ class MainWindow(QMainWindow):
         # Page 5 actions
         self.calcANG_button.clicked.connect(self.ang_result)
 
+        # Background jobs (ICP, calibration, slice parameters, angle) - computed off the GUI thread, plotted here
+        self.job_workers = {}
+        for queue in dict.fromkeys(JOB_QUEUES.values()):
+            job_thread = QThread()
+            job_worker = JobWorker()
+            job_worker.moveToThread(job_thread)
+            job_worker.progress_J.connect(self.show_job_status)
+            job_worker.result_J.connect(self.on_job_result)
+            job_worker.finished_J.connect(job_thread.quit)
+            job_thread.started.connect(job_worker.do_work)
+            job_thread.start()
+            self.job_workers[queue] = (job_worker, job_thread)
+
+        # Instrumentation shortcuts, from any page
+        QShortcut(QKeySequence('F9'), self).activated.connect(self.toggle_instrumentation)
+        QShortcut(QKeySequence('F10'), self).activated.connect(self.toggle_profiler)
+        QShortcut(QKeySequence('F11'), self).activated.connect(self.export_metrics)
+
         # Mutex
         self.mutex = QMutex()
 
@@ -286,6 +529,35 @@ class MainWindow(QMainWindow):
         animation.setDirection(QPropertyAnimation.Backward)
         animation.start()
 
+    def toggle_instrumentation(self):
+        instruments.set_enabled(not instruments.enabled)
+        self.statusBar().showMessage(f"Instrumentation {'on' if instruments.enabled else 'off'}")
+
+    def toggle_profiler(self):
+        if instruments.profiling:
+            self.statusBar().showMessage(f"Profile written to {instruments.stop_profiler()}")
+        else:
+            instruments.start_profiler(self.profiler_kind)
+            self.statusBar().showMessage(f"Profiling ({self.profiler_kind})")
+
+    def export_metrics(self):
+        if instruments.enabled:
+            self.statusBar().showMessage(f"Metrics written to {instruments.export()}")
+        else:
+            self.statusBar().showMessage("Instrumentation is off (F9)")
+
+    def make_lidar(self, sensor):
+        # None lets the worker open the sensor itself
+        replay_source = self.replay_sources.get(sensor)
+        port = self.ports.get(sensor)
+        if self.acquisition_processes:
+            return ProcessLiDAR(sensor, replay_source, self.replay_speed, self.replay_loop, port=port)
+        if replay_source:
+            return make_replay_lidar(replay_source, sensor, self.replay_speed, self.replay_loop)
+        if port:
+            return STL27L(port=port) if sensor == 'STL27L' else A2M8(port=port)
+        return None
+
     def start_worker(self):
         value = self.radius_value.text()
         if value.isdigit() and not self.stop_button.isEnabled() and int(value) < 100000:
@@ -294,11 +566,30 @@ class MainWindow(QMainWindow):
             self.ax1.set_xlim(-1 * radius, radius)
             self.ax1.set_ylim(-1 * radius, radius)
             self.ax1.grid(True, color='gray')  # Dodaj siatkę do wykresu
-            self.plot1, = self.ax1.plot([], [], 'bo', markersize=1, label='A2M8')
-            self.plot2, = self.ax1.plot([], [], 'ro', markersize=1, label='STL27L')
+            # Animated artists are left out of the full redraw and blitted over the cached background
+            self.plot1, = self.ax1.plot([], [], 'bo', markersize=1, label='A2M8', animated=True)
+            self.plot2, = self.ax1.plot([], [], 'ro', markersize=1, label='STL27L', animated=True)
+            self.stats_text = self.ax1.text(0.01, 0.99, '', transform=self.ax1.transAxes, fontsize=8,
+                                            verticalalignment='top', animated=True)
+            self.feature_artists = []
+            if self.features_enabled:
+                self.feature_lines = LineCollection([], colors='black', linewidths=1.5, label='Lines',
+                                                    animated=True)
+                self.ax1.add_collection(self.feature_lines, autolim=False)
+                self.feature_corners, = self.ax1.plot([], [], 'gx', markersize=8, label='Corners', animated=True)
+                self.feature_clusters, = self.ax1.plot([], [], 'o', color='orange', markerfacecolor='none',
+                                                       markersize=10, label='Clusters', animated=True)
+                self.feature_artists = [self.feature_lines, self.feature_corners, self.feature_clusters]
             self.ax1.legend()
-
-            self.Slam_worker = SlamWorker()
+            self.sensor_plots = {'A2M8': self.plot1, 'STL27L': self.plot2}
+            self.pending_revolutions = {}
+            self.fused_frame = None
+            self.render_stats = {'time': time.monotonic(), 'frames': 0, 'A2M8': 0, 'STL27L': 0, 'fused': 0,
+                                 'dropped': 0}
+            with instruments.span('render.draw'):
+                self.canvas1.draw()
+
+            self.Slam_worker = SlamWorker(self.make_lidar('A2M8'))
             if self.Slam_worker.check_lidar_status() is True:
                 self.Slam_thread = QThread()
                 self.Slam_worker.finished_S.connect(self.on_finished)
@@ -307,10 +598,10 @@ class MainWindow(QMainWindow):
                 self.start_button.setEnabled(False)
                 self.stop_button.setEnabled(True)
                 if not self.Slam_thread.isRunning():
-                    self.Slam_thread.start()
                     self.Slam_thread.started.connect(self.Slam_worker.do_work)
+                    self.Slam_thread.start()
 
-            self.Wave_worker = WaveWorker()
+            self.Wave_worker = WaveWorker(self.make_lidar('STL27L'))
             if self.Wave_worker.check_lidar_status() is True:
                 self.Wave_thread = QThread()
                 self.Wave_worker.finished_W.connect(self.on_finished)
@@ -319,15 +610,119 @@ class MainWindow(QMainWindow):
                 self.start_button.setEnabled(False)
                 self.stop_button.setEnabled(True)
                 if not self.Wave_thread.isRunning():
-                    self.Wave_thread.start()
                     self.Wave_thread.started.connect(self.Wave_worker.do_work)
+                    self.Wave_thread.start()
 
+            self.fuser = None
+            if self.Slam_worker.check_lidar_status() is True and self.Wave_worker.check_lidar_status() is True:
+                self.fuser = RevolutionFuser(load_extrinsics()['params'])
+                self.calibrate_button.setEnabled(True)
+            if self.odometry_enabled and self.Wave_worker.check_lidar_status() is True:
+                self.start_odometry_worker()
+            if self.features_enabled:
+                self.start_feature_workers(radius)
             if self.Slam_worker.check_lidar_status() is True or self.Wave_worker.check_lidar_status() is True:
                 self.saveScan_button.setEnabled(True)
                 self.saveScan_button.clicked.connect(self.init_save_scan)
+                self.record_button.setEnabled(True)
+                self.render_timer.start(int(1000 / self.render_fps))
         else:
             self.radius_value.setText("")
 
+    def start_feature_workers(self, radius):
+        # One worker thread per running sensor, so both revolutions of a moment are processed side by side
+        self.latest_features = {}
+        for sensor, worker in (('A2M8', self.Slam_worker), ('STL27L', self.Wave_worker)):
+            if worker.check_lidar_status() is not True:
+                continue
+            feature_worker = FeatureWorker(sensor, FeaturePipeline(max_range=radius))
+            feature_thread = QThread()
+            feature_worker.moveToThread(feature_thread)
+            feature_worker.result_F.connect(self.on_features)
+            feature_worker.finished_F.connect(feature_thread.quit)
+            feature_thread.started.connect(feature_worker.do_work)
+            feature_thread.start()
+            self.feature_workers[sensor] = (feature_worker, feature_thread)
+
+    def start_odometry_worker(self):
+        # Scan matching off the GUI thread, the pose comes back with every match
+        self.odometry_result = None
+        odometry_worker = OdometryWorker(ScanOdometry())
+        odometry_thread = QThread()
+        odometry_worker.moveToThread(odometry_thread)
+        odometry_worker.result_O.connect(self.on_odometry)
+        odometry_worker.finished_O.connect(odometry_thread.quit)
+        odometry_thread.started.connect(odometry_worker.do_work)
+        odometry_thread.start()
+        self.odometry_worker = (odometry_worker, odometry_thread)
+
+    def stop_odometry_worker(self):
+        if self.odometry_worker is not None:
+            odometry_worker, odometry_thread = self.odometry_worker
+            odometry_worker.stop_work()
+            odometry_thread.quit()
+            odometry_thread.wait()
+        self.odometry_worker = None
+        self.odometry_result = None
+
+    def on_odometry(self, result):
+        # Results of a worker that was already stopped are dropped
+        if self.odometry_worker is not None:
+            self.odometry_result = result
+
+    def stop_feature_workers(self):
+        for feature_worker, feature_thread in self.feature_workers.values():
+            feature_worker.stop_work()
+            feature_thread.quit()
+            feature_thread.wait()
+        self.feature_workers = {}
+
+    def on_features(self, sensor, features):
+        # Results of a worker that was already stopped are dropped
+        if sensor in self.feature_workers:
+            self.latest_features[sensor] = features
+            self.update_feature_artists()
+
+    def update_feature_artists(self):
+        segments, corners, clusters = [], [], []
+        for sensor, features in self.latest_features.items():
+            sensor_segments = [line['endpoints'] for line in features['lines']]
+            sensor_corners = [corner['point'] for corner in features['corners']]
+            sensor_clusters = [cluster['centroid'] for cluster in features['clusters']]
+            if self.fuser is not None and sensor == 'STL27L':
+                # Fused frames show the STL27L in the A2M8 frame
+                sensor_segments = [apply_transformation(segment, self.fuser.params) for segment in sensor_segments]
+                sensor_corners = list(apply_transformation(np.reshape(sensor_corners, (-1, 2)), self.fuser.params))
+                sensor_clusters = list(apply_transformation(np.reshape(sensor_clusters, (-1, 2)), self.fuser.params))
+            segments += sensor_segments
+            corners += sensor_corners
+            clusters += sensor_clusters
+        corners = np.reshape(corners, (-1, 2))
+        clusters = np.reshape(clusters, (-1, 2))
+        self.feature_lines.set_segments(segments)
+        self.feature_corners.set_data(corners[:, 0], corners[:, 1])
+        self.feature_clusters.set_data(clusters[:, 0], clusters[:, 1])
+
+    def toggle_recording(self, checked):
+        if checked:
+            os.makedirs('Recordings', exist_ok=True)
+            filename = os.path.join('Recordings', f"session_{time.strftime('%Y%m%d-%H%M%S')}.lslog")
+            self.recorder = ScanRecorder(filename)
+            self.recorder.start()
+            self.set_lidar_recorder(self.recorder)
+            print(f"Recording to {filename}")
+        elif self.recorder is not None:
+            self.set_lidar_recorder(None)
+            self.recorder.stop()
+            print(f"Recording finished: {self.recorder.snapshot()}")
+            self.recorder = None
+
+    def set_lidar_recorder(self, recorder):
+        if self.Slam_worker is not None and self.Slam_worker.check_lidar_status() is True:
+            self.Slam_worker.Slam_lidar.recorder = recorder
+        if self.Wave_worker is not None and self.Wave_worker.check_lidar_status() is True:
+            self.Wave_worker.Wave_lidar.recorder = recorder
+
     def init_save_scan(self):
         if self.Slam_worker.check_lidar_status() is True:
             self.Slam_worker.save_lidar_scan()
@@ -335,54 +730,246 @@ class MainWindow(QMainWindow):
         if self.Wave_worker.check_lidar_status() is True:
             self.Wave_worker.save_lidar_scan()
 
-    def process_slam_data(self, data_slam):
-        """self.mutex.lock()
-        try:
-            self.update_plot(data_slam[0], data_slam[1], [], [])
-        finally:
-            self.mutex.unlock()"""
-        self.update_plot(data_slam[0], data_slam[1], [], [])
-
-    def process_wave_data(self, data_wave):
-        self.update_plot([], [], data_wave[0], data_wave[1])
-    
-
-    def update_plot(self, x1, y1, x2, y2):
-        if x1 and y1:
-            self.plot1.set_xdata(x1)
-            self.plot1.set_ydata(y1)
-        if x2 and y2:
-            self.plot2.set_xdata(x2)
-            self.plot2.set_ydata(y2)
-
-        self.ax1.relim()
-        self.ax1.autoscale_view()
-        self.canvas1.draw()
+    def process_slam_data(self, revolution_index):
+        self.queue_revolution('A2M8', self.Slam_worker.Slam_lidar.revolution_buffer, revolution_index)
 
-    def on_finished(self):
-        if self.Slam_worker.check_lidar_status() is True:
-            self.Slam_thread.quit()
-            self.Slam_thread.wait()
-            print("Slamtec worker finished.")
+    def process_wave_data(self, revolution_index):
+        self.queue_revolution('STL27L', self.Wave_worker.Wave_lidar.revolution_buffer, revolution_index)
 
-        if self.Wave_worker.check_lidar_status() is True:
-            self.Wave_thread.quit()
-            self.Wave_thread.wait()
-            print("Waveshare worker finished.")
+    def queue_revolution(self, sensor, revolution_buffer, revolution_index):
+        if revolution_buffer is None:
+            # Index queued by an acquisition process that has been stopped since - its buffer is released
+            return
+        self.render_stats[sensor] += 1
+        if instruments.enabled:
+            revolution = revolution_buffer.view(revolution_index)
+            if revolution is not None:
+                # Commit in the acquisition thread or process to this slot: the queued signal's latency
+                instruments.record(f'{sensor.lower()}.signal', time.monotonic() - revolution['timestamp'])
+                instruments.count(f'{sensor.lower()}.revolutions')
+                instruments.count(f'{sensor.lower()}.points', len(revolution['X']))
+        if sensor in self.feature_workers:
+            revolution = revolution_buffer.copy(revolution_index)
+            if revolution is not None:
+                self.feature_workers[sensor][0].add_revolution(revolution)
+        if self.odometry_worker is not None and sensor == 'STL27L':
+            revolution = revolution_buffer.copy(revolution_index)
+            if revolution is not None:
+                self.odometry_worker[0].add_revolution(revolution)
+        if self.fuser is not None:
+            self.queue_fused_frames(self.fuser.add(sensor, revolution_buffer, revolution_index))
+            return
+        if sensor in self.pending_revolutions:
+            # The previous revolution was never drawn
+            self.render_stats['dropped'] += 1
+            instruments.count('render.dropped')
+        self.pending_revolutions[sensor] = (revolution_buffer, revolution_index)
+
+    def start_calibration(self):
+        self.calibration_pairs = []
+        self.calibrate_button.setEnabled(False)
+        self.calibrate_button.setText(f"Capturing 0/{CALIBRATION_PAIRS}")
+
+    def collect_calibration_pair(self, frame):
+        self.calibration_pairs.append(fused_frame_pair(frame))
+        captured = len(self.calibration_pairs)
+        self.calibrate_button.setText(f"Capturing {captured}/{CALIBRATION_PAIRS}")
+        if captured == CALIBRATION_PAIRS:
+            pairs, self.calibration_pairs = self.calibration_pairs, None
+            self.add_job('calibration', f"Calibration from {len(pairs)} pairs",
+                         calibration_job(pairs, self.fuser.params))
+            self.calibrate_button.setText("Calibrate sensors")
+            self.calibrate_button.setEnabled(True)
+
+    def queue_fused_frames(self, frames):
+        for frame in frames:
+            if self.calibration_pairs is not None:
+                self.collect_calibration_pair(frame)
+            self.render_stats['fused'] += 1
+            if self.fused_frame is not None:
+                self.render_stats['dropped'] += 1
+                instruments.count('render.dropped')
+            self.fused_frame = frame
+
+    def on_page1_draw(self, event):
+        # Full redraw (start, resize) - cache the axes background without the animated artists
+        self.page1_background = self.canvas1.copy_from_bbox(self.ax1.bbox)
+        if self.stats_text is not None:
+            self.draw_animated_artists()
+
+    def render_plot(self):
+        with instruments.span('render.frame'):
+            self.render_frame()
+
+    def render_frame(self):
+        if self.fuser is not None:
+            # Revolutions whose partner did not arrive within the tolerance are settled here
+            self.queue_fused_frames(self.fuser.flush())
+        if not self.pending_revolutions and self.fused_frame is None or self.page1_background is None:
+            return
+        if self.fused_frame is not None:
+            points = self.fused_frame['points']
+            n_reference = self.fused_frame['counts']['A2M8']
+            self.plot1.set_data(points[:n_reference, 0], points[:n_reference, 1])
+            self.plot2.set_data(points[n_reference:, 0], points[n_reference:, 1])
+            self.fused_frame = None
+        for sensor, (revolution_buffer, revolution_index) in self.pending_revolutions.items():
+            # The worker may already have overwritten an old revolution - skip it
+            revolution = revolution_buffer.view(revolution_index)
+            if revolution is None:
+                self.render_stats['dropped'] += 1
+                instruments.count('render.dropped')
+            else:
+                self.sensor_plots[sensor].set_data(revolution['X'], revolution['Y'])
+        self.pending_revolutions.clear()
+        self.render_stats['frames'] += 1
+
+        elapsed = time.monotonic() - self.render_stats['time']
+        if elapsed >= 1:
+            stats = (f"A2M8 {self.render_stats['A2M8'] / elapsed:.1f} Hz   "
+                     f"STL27L {self.render_stats['STL27L'] / elapsed:.1f} Hz   "
+                     f"render {self.render_stats['frames'] / elapsed:.1f} FPS   "
+                     f"dropped {self.render_stats['dropped']}")
+            if self.recorder is not None:
+                recorder_stats = self.recorder.snapshot()
+                stats += (f"\nrecorded {recorder_stats['recorded']}   queue {self.recorder.queue.qsize()}"
+                          f"   not recorded {recorder_stats['dropped']}")
+            if self.fuser is not None:
+                fusion = self.fuser.metrics()
+                stats += f"\nfused {self.render_stats['fused'] / elapsed:.1f} Hz   unmatched {fusion['unmatched']}"
+                if 'latency_p95_ms' in fusion:
+                    stats += (f"   latency p95 {fusion['latency_p95_ms']:.0f} ms"
+                              f"   offset {fusion['offset_mean_ms']:.0f} ms")
+            if self.odometry_result is not None:
+                tx, ty, theta = self.odometry_result['pose']
+                stats += f"\npose {tx:.0f} mm, {ty:.0f} mm, {np.degrees(theta):.1f} deg"
+                odometry = self.odometry_result['metrics']
+                if 'latency_p95_ms' in odometry:
+                    stats += (f"   match p95 {odometry['latency_p95_ms']:.0f} ms   keyframes {odometry['keyframes']}"
+                              f"   skipped {self.odometry_worker[0].dropped}")
+            for sensor, (feature_worker, _) in self.feature_workers.items():
+                pipeline = feature_worker.pipeline.metrics()
+                features = self.latest_features.get(sensor)
+                if 'latency_p95_ms' in pipeline and features is not None:
+                    stages = ', '.join(f"{name} {pipeline[f'{name}_p95_ms']:.1f}" for name in features['timings'])
+                    stats += (f"\n{sensor} features p95 {pipeline['latency_p95_ms']:.1f} ms ({stages})"
+                              f"   lines {len(features['lines'])}   corners {len(features['corners'])}"
+                              f"   clusters {len(features['clusters'])}   skipped {feature_worker.dropped}")
+            if instruments.enabled:
+                stats += f"\n{instruments.overlay_text()}"
+            self.stats_text.set_text(stats)
+            self.render_stats.update({'time': time.monotonic(), 'frames': 0, 'A2M8': 0, 'STL27L': 0, 'fused': 0})
+        self.blit_plot()
+
+    def draw_animated_artists(self):
+        self.ax1.draw_artist(self.plot1)
+        self.ax1.draw_artist(self.plot2)
+        for artist in self.feature_artists:
+            self.ax1.draw_artist(artist)
+        self.ax1.draw_artist(self.stats_text)
+
+    def blit_plot(self):
+        with instruments.span('render.blit'):
+            self.canvas1.restore_region(self.page1_background)
+            self.draw_animated_artists()
+            self.canvas1.blit(self.ax1.bbox)
+
+    def on_finished(self):
+        worker = self.sender()
+        name = 'A2M8' if isinstance(worker, SlamWorker) else 'STL27L'
+        # The thread the worker was moved to - a restart may have replaced self.Slam_thread / self.Wave_thread
+        thread = worker.thread()
+        thread.quit()
+        thread.wait()
+        print(f"{'Slamtec' if name == 'A2M8' else 'Waveshare'} worker finished.")
+        if worker.is_running and worker in (self.Slam_worker, self.Wave_worker):
+            # The loop ended without stop_worker - the sensor (or its acquisition process) did not start
+            worker.stop_work()
+            self.statusBar().showMessage(f"{name} could not be started")
+            if self.fuser is not None:
+                # The other sensor's revolutions are drawn on their own again
+                self.fuser = None
+                self.calibration_pairs = None
+                self.calibrate_button.setEnabled(False)
+            if not any(other is not None and other.is_running for other in (self.Slam_worker, self.Wave_worker)):
+                self.stop_worker()
 
     def stop_worker(self):
+        self.render_timer.stop()
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.saveScan_button.setEnabled(False)
+        self.record_button.setChecked(False)
+        self.record_button.setEnabled(False)
+        self.calibration_pairs = None
+        self.calibrate_button.setText("Calibrate sensors")
+        self.calibrate_button.setEnabled(False)
 
         if self.Slam_worker.check_lidar_status() is True:
             self.Slam_worker.stop_work()
         if self.Wave_worker.check_lidar_status() is True:
             self.Wave_worker.stop_work()
+        self.stop_feature_workers()
+        self.stop_odometry_worker()
 
     def exit_application(self):
+        self.stop_feature_workers()
+        self.stop_odometry_worker()
+        if instruments.profiling:
+            print(f"Profile written to {instruments.stop_profiler()}")
+        if instruments.enabled:
+            print(f"Metrics written to {instruments.export()}")
+        for job_worker, job_thread in self.job_workers.values():
+            job_worker.stop_work()
+            job_thread.quit()
+            job_thread.wait()
         QApplication.quit()
 
+    def add_job(self, kind, label, function):
+        queue = JOB_QUEUES[kind]
+        if queue == 'search':
+            self.cancelJob_button.setEnabled(True)
+        self.show_job_status(kind, f"{label}: queued")
+        self.job_workers[queue][0].add_job(kind, label, function)
+
+    def cancel_job(self):
+        # The cancel button is next to the ICP run, the analyses are over before it could be pressed
+        self.job_workers['search'][0].cancel_job()
+
+    def show_job_status(self, kind, text):
+        # ICP runs are started next to their label on page 2, the other jobs report in the status bar of every page
+        if kind == 'icp':
+            self.job_status.setText(text)
+        else:
+            self.statusBar().showMessage(text)
+
+    def on_job_result(self, kind, label, result):
+        if kind == 'icp':
+            self.icp_runs.append((label, result))
+            self.choose_icp_run.addItem(f"{label}, RMSE {result['rmse_icp']:.4f}")
+            self.choose_icp_run.setCurrentIndex(len(self.icp_runs) - 1)
+        elif kind == 'rmse':
+            self.show_rmse_result(result)
+        elif kind == 'angle':
+            self.show_ang_result(result)
+        elif kind == 'calibration':
+            self.apply_calibration(result)
+        elif kind == 'slicer':
+            self.show_slicer_cloud(result)
+
+    def apply_calibration(self, result):
+        save_calibration(result)
+        # Straight into the live display, the next fused frame already uses it
+        if self.fuser is not None:
+            self.fuser.set_extrinsics(result['params'])
+        tx, ty, theta = result['params']
+        tx_error, ty_error, theta_error = result['standard_error']
+        summary = (f"Calibration: tx {tx:.1f} +- {tx_error:.1f} mm, ty {ty:.1f} +- {ty_error:.1f} mm, "
+                   f"theta {np.degrees(theta):.2f} +- {np.degrees(theta_error):.2f} deg "
+                   f"({result['pairs_used']}/{result['pairs']} pairs)")
+        self.show_job_status('calibration', summary)
+        print(summary)
+
     def show_page1(self):
         self.mb_widget.setCurrentWidget(self.mb_page1)
         self.header_widget.setCurrentWidget(self.header_back)
@@ -429,49 +1016,77 @@ class MainWindow(QMainWindow):
         # Select current chosen 2 scans
         selected_file1 = self.choose_scan1.currentText()
         selected_file2 = self.choose_scan2.currentText()
+        self.add_job('icp', f"{selected_file1} -> {selected_file2}", icp_job(selected_file1, selected_file2))
 
-        # Show merged plot
-        self.ax2.clear()
-        transformed_source_cloud, target_cloud, rmse_icp = icp_algorithm(selected_file1, selected_file2)
+    def show_icp_run(self, index):
+        if index < 0 or index >= len(self.icp_runs):
+            return
+        _, result = self.icp_runs[index]
+        transformed_source_cloud = result['transformed_source_cloud']
+        target_cloud = result['target_cloud']
 
-        self.rmseICP_val.setText(f"{rmse_icp:.4f}".replace('.', ','))
+        self.rmseICP_val.setText(f"{result['rmse_icp']:.4f}".replace('.', ','))
 
+        # Show merged plot
+        self.ax2.clear()
         self.ax2.set_xlabel('x [mm]')
         self.ax2.set_ylabel('y [mm]')
         self.ax2.scatter(transformed_source_cloud[:, 0], transformed_source_cloud[:, 1], color='blue', s=1)
         self.ax2.scatter(target_cloud[:, 0], target_cloud[:, 1], color='red', s=1)
         self.ax2.set_title('Merged point cloud')
-        self.canvas2.draw()
+        with instruments.span('render.draw'):
+            self.canvas2.draw()
 
     def on_press(self, event):
+        if self.cloud_index is None or event.xdata is None or event.ydata is None:
+            return
         if event.button == 1:
+            self.clear_selection()
             self.x_start, self.y_start = event.xdata, event.ydata
-            if self.x_start is None or self.y_start is None:
-                pass
+            self.rect = plt.Rectangle((self.x_start, self.y_start), 0, 0, alpha=0.3)
+            self.ax3.add_patch(self.rect)
+            self.canvas3.draw_idle()
+        elif event.button == 3:
+            if self.polygon is None or self.polygon.get_color() == 'r':
+                self.clear_selection()
+                self.polygon, = self.ax3.plot([], [], color='b')
+            if event.dblclick and len(self.polygon_vertices) >= 3:
+                vertices = self.polygon_vertices + self.polygon_vertices[:1]
+                self.polygon.set_data(*zip(*vertices))
+                self.polygon.set_color('r')
+                self.selected_points = self.selected_cloud[self.cloud_index.points_in_polygon(self.polygon_vertices)]
             else:
-                self.rect = plt.Rectangle((self.x_start, self.y_start), 0, 0, alpha=0.3)
-                self.ax3.add_patch(self.rect)
-                self.fig3.canvas.draw_idle()
-                self.fig3.canvas.mpl_connect('motion_notify_event', self.on_move)
-                self.fig3.canvas.mpl_connect('button_release_event', self.on_release)
+                self.polygon_vertices.append((event.xdata, event.ydata))
+                self.polygon.set_data(*zip(*self.polygon_vertices))
+            self.canvas3.draw_idle()
             # self.check_slice()
 
+    def clear_selection(self):
+        if self.rect is not None:
+            self.rect.remove()
+        if self.polygon is not None:
+            self.polygon.remove()
+        self.rect = None
+        self.polygon = None
+        self.polygon_vertices = []
+        self.selected_points = np.empty(0)
+
     def on_move(self, event):
-        if event.button == 1:
+        if event.button == 1 and self.rect is not None and event.xdata is not None and event.ydata is not None:
             x_end, y_end = event.xdata, event.ydata
             self.rect.set_width(x_end - self.x_start)
             self.rect.set_height(y_end - self.y_start)
             self.rect.set_xy((self.x_start, self.y_start))
-            self.fig3.canvas.draw()
+            self.canvas3.draw_idle()
 
     def on_release(self, event):
-        if event.button == 1:
+        if event.button == 1 and self.rect is not None and event.xdata is not None and event.ydata is not None:
             x_end, y_end = event.xdata, event.ydata
             self.rect.set_width(x_end - self.x_start)
             self.rect.set_height(y_end - self.y_start)
             self.rect.set_color('r')
             self.selected_points = self.get_points_in_rect(self.x_start, y_end, x_end, self.y_start)
-            self.ax3.figure.canvas.draw_idle()
+            self.canvas3.draw_idle()
             # self.check_slice()
 
     def check_slice(self):
@@ -483,9 +1098,7 @@ class MainWindow(QMainWindow):
             self.sliceScan_button.setEnabled(False)
 
     def get_points_in_rect(self, x1, y1, x2, y2):
-        mask = (self.selected_cloud[:, 0] >= x1) & (self.selected_cloud[:, 0] <= x2) & (
-                self.selected_cloud[:, 1] >= y1) & (self.selected_cloud[:, 1] <= y2)
-        return self.selected_cloud[mask]
+        return self.selected_cloud[self.cloud_index.points_in_rect(x1, y1, x2, y2)]
 
     def zoom(self, event):
         # Skalowanie współczynników
@@ -520,8 +1133,18 @@ class MainWindow(QMainWindow):
         self.ax3.set_xlim([new_x_min, new_x_max])
         self.ax3.set_ylim([new_y_min, new_y_max])
 
-        # Odświeżanie wykresu
-        self.canvas3.draw()
+        # Odświeżanie wykresu - several scroll ticks between two frames are drawn once
+        self.update_page3_view()
+        self.canvas3.draw_idle()
+
+    def update_page3_view(self):
+        # Only as many points as the axes have pixels, taken from the index for the visible area
+        if self.page3_points is None:
+            return
+        x_min, x_max = self.ax3.get_xlim()
+        y_min, y_max = self.ax3.get_ylim()
+        points = self.cloud_index.view(x_min, x_max, y_min, y_max, self.ax3.bbox.width, self.ax3.bbox.height)
+        self.page3_points.set_data(points[:, 0], points[:, 1])
 
     def save_slice_to_csv(self):
         new_file = self.slice_name.text()
@@ -539,15 +1162,31 @@ class MainWindow(QMainWindow):
                     writer.writerow(point)
 
     def page3_plot_refresh(self):
+        # Loading and indexing a large scan runs as a background job, the plot follows in show_slicer_cloud
         selected_file = self.choose_scan3.currentText()
-        self.selected_cloud = np.loadtxt(f'Scans/{selected_file}', delimiter=',')
+        self.add_job('slicer', selected_file, slicer_job(selected_file))
+
+    def show_slicer_cloud(self, result):
+        self.selected_cloud = result['cloud']
+        self.cloud_index = result['index']
 
         self.ax3.clear()
+        self.rect = None
+        self.polygon = None
+        self.polygon_vertices = []
         self.ax3.set_xlabel('x [mm]')
         self.ax3.set_ylabel('y [mm]')
-        self.ax3.scatter(self.selected_cloud[:, 0], self.selected_cloud[:, 1], color='blue', s=1)
+        self.page3_points, = self.ax3.plot([], [], 'o', color='blue', markersize=1)
+        if len(self.selected_cloud):
+            x_min, y_min = self.cloud_index.origin
+            x_max, y_max = self.cloud_index.origin + self.cloud_index.shape * self.cloud_index.cell_size
+            margin_x, margin_y = 0.05 * (x_max - x_min), 0.05 * (y_max - y_min)
+            self.ax3.set_xlim(x_min - margin_x, x_max + margin_x)
+            self.ax3.set_ylim(y_min - margin_y, y_max + margin_y)
+        self.update_page3_view()
         self.ax3.set_title('Select an area to crop')
-        self.canvas3.draw()
+        with instruments.span('render.draw'):
+            self.canvas3.draw()
         self.selected_points = np.empty(0)
         # self.check_slice()
         # self.canvas3.mpl_connect('button_press_event', self.on_press)
@@ -555,115 +1194,86 @@ class MainWindow(QMainWindow):
     def rmse_result(self):
         # Select current chosen slice
         selected_file = self.choose_scan4.currentText()
-        selected_slice = np.loadtxt(f'Slices/{selected_file}', delimiter=',')
-
-        x = selected_slice[:, 0]
-        y = selected_slice[:, 1]
-        # Linear regression
-        model = LinearRegression()
-        model.fit(x.reshape(-1, 1), y)
-        y_pred = model.predict(x.reshape(-1, 1))
-        # RMS error
-        rmse = np.sqrt(mean_squared_error(y, y_pred))
-        # Pearson correlation
-        correlation_matrix = np.corrcoef(y, y_pred)
-        correlation_coefficient = correlation_matrix[0, 1]
-        # Length (largest distance vector)
-        distances = np.sqrt((x[:, np.newaxis] - x[np.newaxis, :]) ** 2 + (y[:, np.newaxis] - y[np.newaxis, :]) ** 2)
-        i, j = np.unravel_index(np.argmax(distances), distances.shape)
-        longest_distance = distances[i, j]
-        point1 = (x[i], y[i])
-        point2 = (x[j], y[j])
-        # Distance (distance from lidar to point cloud centroid)
-        centroid_x = np.mean(x)
-        centroid_y = np.mean(y)
-        distance_to_lidar = np.sqrt(centroid_x ** 2 + centroid_y ** 2)
+        self.add_job('rmse', selected_file,
+                     lambda progress, cancelled: slice_metrics(load_cloud(f'Slices/{selected_file}')))
+
+    def show_rmse_result(self, result):
+        x = result['x']
+        y = result['y']
+        point1 = result['point1']
+        point2 = result['point2']
 
         # Return calculated values
-        self.rmse_val.setText(f"{rmse:.4f}".replace('.', ','))
-        self.pear_val.setText(f"{correlation_coefficient:.4f}".replace('.', ','))
-        self.len_val.setText(f"{longest_distance:.2f}".replace('.', ','))
-        self.dist_val.setText(f"{distance_to_lidar:.2f}".replace('.', ','))
+        self.rmse_val.setText(f"{result['rmse']:.4f}".replace('.', ','))
+        self.pear_val.setText(f"{result['correlation_coefficient']:.4f}".replace('.', ','))
+        self.len_val.setText(f"{result['longest_distance']:.2f}".replace('.', ','))
+        self.dist_val.setText(f"{result['distance_to_lidar']:.2f}".replace('.', ','))
 
         # Show plot
         self.ax4.clear()
         self.ax4.set_xlabel('x [mm]')
         self.ax4.set_ylabel('y [mm]')
         self.ax4.scatter(x, y, label='Actual')
-        self.ax4.scatter(x, y_pred, color='red', label='Predicted')
+        self.ax4.scatter(x, result['y_pred'], color='red', label='Predicted')
         self.ax4.plot([point1[0], point2[0]], [point1[1], point2[1]], color='green', linestyle='-',
                       linewidth=1, label=f'Length')
         self.ax4.legend()
         self.ax4.set_title(f'Linear regression and largest distance vector')
-        self.canvas4.draw()
+        with instruments.span('render.draw'):
+            self.canvas4.draw()
 
     def ang_result(self):
         # Select current chosen slice
         selected_file = self.choose_scan5.currentText()
-        selected_slice = np.loadtxt(f'Slices/{selected_file}', delimiter=',')
-
-        x = selected_slice[:, 0]
-        y = selected_slice[:, 1]
-
-        # Filter out points that are more than 150 units away from the previous point
-        """filtered_x = [x[0]]
-        filtered_y = [y[0]]
-
-        for i in range(1, len(x)):
-            distance = np.sqrt((x[i] - filtered_x[-1]) ** 2 + (y[i] - filtered_y[-1]) ** 2)
-            if distance <= 150:
-                filtered_x.append(x[i])
-                filtered_y.append(y[i])
-
-        filtered_x = np.array(filtered_x)
-        filtered_y = np.array(filtered_y)"""
-
-        # Sort by x while preserving the associated y values
-        sorted_indices = np.argsort(x)
-        x_sorted = x[sorted_indices]
-        y_sorted = y[sorted_indices]
-
-        # Find the index of the maximum value in filtered_y
-        max_index = np.argmax(y_sorted)
-
-        # Split filtered_x and filtered_y into two parts at the index of the maximum y
-        x1, x2 = x_sorted[:max_index + 1], x_sorted[max_index:]
-        y1, y2 = y_sorted[:max_index + 1], y_sorted[max_index:]
-
-        # Linear regression 1
-        model1 = LinearRegression()
-        model1.fit(x1.reshape(-1, 1), y1)
-        y_pred1 = model1.predict(x1.reshape(-1, 1))
-        m1 = model1.coef_[0]
-
-        # Linear regression 2
-        model2 = LinearRegression()
-        model2.fit(x2.reshape(-1, 1), y2)
-        y_pred2 = model2.predict(x2.reshape(-1, 1))
-        m2 = model2.coef_[0]
-
-        # Calculate the angle between the two lines
-        angle_rad = np.arctan(abs((m1 - m2) / (1 + m1 * m2)))
-        angle_deg = np.degrees(angle_rad)
+        self.add_job('angle', selected_file,
+                     lambda progress, cancelled: angle_metrics(load_cloud(f'Slices/{selected_file}')))
+
+    def show_ang_result(self, result):
+        angle_deg = result['angle_deg']
         self.ang_val.setText(f"{angle_deg:.2f}".replace('.', ','))
 
         # Show plot
         self.ax5.clear()
         self.ax5.set_xlabel('x [mm]')
         self.ax5.set_ylabel('y [mm]')
-        self.ax5.scatter(x1, y1, color='blue', label='Actual left side')
-        self.ax5.plot(x1, y_pred1, color='lightblue', label='Predicted left side', linewidth=2)
-        self.ax5.scatter(x2, y2, color='red', label='Actual right side')
-        self.ax5.plot(x2, y_pred2, color='pink', label='Predicted right side', linewidth=2)
+        self.ax5.scatter(result['x1'], result['y1'], color='blue', label='Actual first side')
+        self.ax5.plot(*result['line1'].T, color='lightblue', label='Fitted first side', linewidth=2)
+        self.ax5.scatter(result['x2'], result['y2'], color='red', label='Actual second side')
+        self.ax5.plot(*result['line2'].T, color='pink', label='Fitted second side', linewidth=2)
+        self.ax5.scatter(*result['corner'], color='green', marker='x', label='Corner')
         self.ax5.legend()
         self.ax5.text(0.05, 0.95, f'Angle: {angle_deg:.2f} degrees', transform=self.ax5.transAxes, fontsize=12,
                       verticalalignment='top')
-        self.ax5.set_title(f'Linear regression of two sides of an L-shaped profile\n and the angle between them')
-        self.canvas5.draw()
-
+        self.ax5.set_title(f'Line fits of two sides of an L-shaped profile\n and the angle between them')
+        with instruments.span('render.draw'):
+            self.canvas5.draw()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    parser = argparse.ArgumentParser(description='2D LiDAR app')
+    parser.add_argument('--replay-a2m8', metavar='PATH', help='recording, scan files or raw capture instead of the A2M8')
+    parser.add_argument('--replay-stl27l', metavar='PATH', help='recording, scan files or raw capture instead of the STL27L')
+    parser.add_argument('--port-a2m8', metavar='PORT',
+                        help='serial device or URL of the A2M8, e.g. /dev/ttyUSB1 or sim://A2M8?speed=1&drop=0.001')
+    parser.add_argument('--port-stl27l', metavar='PORT',
+                        help='serial device or URL of the STL27L, e.g. /dev/ttyUSB0 or sim://STL27L?speed=4')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 = as fast as possible')
+    parser.add_argument('--loop', action='store_true', help='start the replay over when it ends')
+    parser.add_argument('--processes', action='store_true', help='read and decode each sensor in its own process')
+    parser.add_argument('--odometry', action='store_true', help='track the STL27L pose by scan matching')
+    parser.add_argument('--features', action='store_true', help='draw lines, corners and clusters of every revolution')
+    parser.add_argument('--instrument', action='store_true',
+                        help='time every stage from the start (F9 toggles it), metrics are exported on exit')
+    parser.add_argument('--profiler', choices=['sampling', 'cprofile'], default='sampling',
+                        help='profiler started and stopped with F10: every thread, or cProfile of the GUI thread')
+    parser.add_argument('--fps', type=float, default=RENDER_FPS,
+                        help=f'largest frame rate of the live plot (default {RENDER_FPS})')
+    args, qt_args = parser.parse_known_args()
+    if args.fps <= 0:
+        parser.error('--fps must be positive')
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow({'A2M8': args.replay_a2m8, 'STL27L': args.replay_stl27l}, args.speed, args.loop,
+                        args.processes, args.odometry, args.features, args.profiler,
+                        {'A2M8': args.port_a2m8, 'STL27L': args.port_stl27l}, args.fps)
+    instruments.set_enabled(args.instrument)
     window.show()
     sys.exit(app.exec_())
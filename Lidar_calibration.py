@@ -0,0 +1,102 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ICP_function import icp, multi_start_icp, compose_params, wrap_angle, POOL_CONTEXT
+from Lidar_fusion import REFERENCE_SENSOR, CALIBRATION_FILE, save_extrinsics
+
+CALIBRATION_PAIRS = 100
+# Never calibrated sensors may be mounted at any angle to each other
+CALIBRATION_START_ANGLES = np.radians(np.arange(0, 360, 30))
+# Pairs fitting much worse than the typical one (moving objects, bad synchronization) are left out
+PAIR_RMSE_LIMIT = 3.0
+PARAM_MAD_LIMIT = 3.0
+# Convergence in mm / rad - a micrometre is far below the spread between pairs
+CALIBRATION_TOLERANCE = 1e-3
+
+
+def fused_frame_pair(frame):
+    # (moved STL27L points, A2M8 points) of a fused frame; the STL27L part already carries the current extrinsics
+    n_reference = frame['counts'][REFERENCE_SENSOR]
+    points = frame['points'].astype(float)
+    return points[n_reference:], points[:n_reference]
+
+
+def initial_correction(pair):
+    source, target = pair
+    starts = np.column_stack((np.zeros_like(CALIBRATION_START_ANGLES), np.zeros_like(CALIBRATION_START_ANGLES),
+                              CALIBRATION_START_ANGLES))
+    return multi_start_icp(source, target, starts, refine_best=3, max_workers=1)['params']
+
+
+def _calibrate_pair(pair, initial_params, loss):
+    source, target = pair
+    result = icp(source, target, initial_params, method='point_to_line', tolerance=CALIBRATION_TOLERANCE, loss=loss)
+    return result['params'], result['rmse']
+
+
+def robust_average(params, rmse):
+    # Mean over the pairs that agree with the majority, with spread and standard error of the mean
+    aligned = np.isfinite(rmse) & np.all(np.isfinite(params), axis=1)
+    # Without a single aligned pair the mean would be NaN and saved as the extrinsics
+    if not np.any(aligned):
+        raise ValueError('No calibration pair aligned')
+    keep = aligned & (rmse <= PAIR_RMSE_LIMIT * np.median(rmse[aligned]))
+    mean_angle = np.arctan2(np.mean(np.sin(params[keep, 2])), np.mean(np.cos(params[keep, 2])))
+    # Angles relative to their circular mean, so the statistics below do not see the wrap at +-pi
+    relative = np.column_stack((params[:, :2], wrap_angle(params[:, 2] - mean_angle)))
+    median = np.median(relative[keep], axis=0)
+    mad = np.maximum(1.4826 * np.median(np.abs(relative[keep] - median), axis=0), 1e-9)
+    keep &= np.all(np.abs(relative - median) <= PARAM_MAD_LIMIT * mad, axis=1)
+
+    used = relative[keep]
+    mean = used.mean(axis=0)
+    std = used.std(axis=0, ddof=1) if len(used) > 1 else np.zeros(3)
+    mean[2] = wrap_angle(mean[2] + mean_angle)
+    return mean, std, keep
+
+
+def calibrate(pairs, current_params=(0.0, 0.0, 0.0), loss='huber', search_initial=None, max_workers=None,
+              progress=None, cancelled=None):
+    # Pairs are (moved STL27L points, A2M8 points) moved with current_params - ICP finds the remaining correction
+    if search_initial is None:
+        search_initial = not np.any(current_params)
+    initial_params = initial_correction(pairs[len(pairs) // 2]) if search_initial else np.zeros(3)
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(pairs))
+    results = []
+    if max_workers == 1:
+        for pair in pairs:
+            results.append(_calibrate_pair(pair, initial_params, loss))
+            if progress is not None:
+                progress(len(results), len(pairs))
+            if cancelled is not None and cancelled():
+                return None
+    else:
+        with ProcessPoolExecutor(max_workers, mp_context=POOL_CONTEXT) as pool:
+            futures = [pool.submit(_calibrate_pair, pair, initial_params, loss) for pair in pairs]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if progress is not None:
+                    progress(len(results), len(pairs))
+                if cancelled is not None and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+                    return None
+
+    params = np.array([result[0] for result in results])
+    rmse = np.array([result[1] for result in results])
+    correction, std, keep = robust_average(params, rmse)
+    n_used = int(np.count_nonzero(keep))
+    return {'params': compose_params(current_params, correction), 'correction': correction, 'std': std,
+            'standard_error': std / np.sqrt(max(n_used, 1)), 'rmse': float(np.median(rmse[keep])),
+            'pairs': len(pairs), 'pairs_used': n_used, 'loss': loss}
+
+
+def save_calibration(result, filename=CALIBRATION_FILE):
+    # Uncertainties are stored in the units of params: mm, mm, rad
+    details = {'std': [float(value) for value in result['std']],
+               'standard_error': [float(value) for value in result['standard_error']],
+               'rmse': result['rmse'], 'pairs': result['pairs'], 'pairs_used': result['pairs_used'],
+               'loss': result['loss'], 'time': time.strftime("%Y-%m-%d %H:%M:%S")}
+    save_extrinsics(result['params'], filename, **details)
@@ -5,10 +5,270 @@ from abc import ABC, abstractmethod
 from queue import Queue
 import os
 import csv
-import math
 import struct
-import copy
+import numpy as np
 from serial.serialutil import SerialException
+from Lidar_instrumentation import instruments
+
+
+STL27L_HEADER = b'\x54\x2C'
+STL27L_FRAME_SIZE = 47
+STL27L_POINTS_PER_FRAME = 12
+STL27L_FRAME_DTYPE = np.dtype([
+    ('header', 'u1'),
+    ('ver_len', 'u1'),
+    ('speed', '<u2'),
+    ('start_angle', '<u2'),
+    ('points', [('distance', '<u2'), ('intensity', 'u1')], (STL27L_POINTS_PER_FRAME,)),
+    ('end_angle', '<u2'),
+    ('timestamp', '<u2'),
+    ('crc', 'u1'),
+])
+
+
+def make_crc8_table(polynomial):
+    table = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[byte] = crc
+    return table
+
+
+STL27L_CRC_TABLE = make_crc8_table(0x4D)
+
+
+def stl27l_crc8(frames):
+    # CRC-8 of every row of an (N, k) uint8 array, one table lookup per column for the whole batch
+    crc = np.zeros(len(frames), dtype=np.uint8)
+    for column in frames.T:
+        crc = STL27L_CRC_TABLE[crc ^ column]
+    return crc
+
+
+def find_stl27l_frames(buffer):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size < STL27L_FRAME_SIZE:
+        return np.empty(0, dtype=np.intp), 0
+    candidates = np.flatnonzero((data[:-1] == STL27L_HEADER[0]) & (data[1:] == STL27L_HEADER[1]))
+    candidates = candidates[candidates + STL27L_FRAME_SIZE <= data.size]
+    frames = data[candidates[:, np.newaxis] + np.arange(STL27L_FRAME_SIZE)]
+    valid = stl27l_crc8(frames[:, :-1]) == frames[:, -1]
+    return select_frames(candidates, valid, STL27L_FRAME_SIZE)
+
+
+def select_frames(candidates, valid, frame_size):
+    # Starts of the valid frames that do not overlap and the number of corrupt frames among the other candidates
+    starts = candidates[valid]
+    if starts.size > 1 and np.any(np.diff(starts) < frame_size):
+        # A valid-looking frame inside another one - keep the first, skip anything it overlaps
+        selected = []
+        next_free = 0
+        for start in starts.tolist():
+            if start >= next_free:
+                selected.append(start)
+                next_free = start + frame_size
+        starts = np.array(selected, dtype=np.intp)
+
+    # Failed candidates lying inside an accepted frame are payload bytes, not corrupt frames
+    invalid = candidates[~valid]
+    owner = np.searchsorted(starts, invalid, side='right') - 1
+    if starts.size:
+        inside = (owner >= 0) & (invalid < starts[np.maximum(owner, 0)] + frame_size)
+    else:
+        inside = np.zeros(len(invalid), dtype=bool)
+    return starts, int(np.count_nonzero(~inside))
+
+
+def decode_stl27l_frames(buffer, starts=None):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if starts is None:
+        starts, _ = find_stl27l_frames(buffer)
+    frames = data[starts[:, np.newaxis] + np.arange(STL27L_FRAME_SIZE)].view(STL27L_FRAME_DTYPE)[:, 0]
+
+    start_angle = frames['start_angle'] / 100
+    step = ((frames['end_angle'] / 100 - start_angle) % 360) / (STL27L_POINTS_PER_FRAME - 1)
+    angles = (start_angle[:, np.newaxis] + step[:, np.newaxis] * np.arange(STL27L_POINTS_PER_FRAME)) % 360
+    distances = frames['points']['distance'].astype(np.float64)
+    intensities = frames['points']['intensity']
+    return angles.ravel(), distances.ravel(), intensities.ravel()
+
+
+A2M8_PACKET_SIZE = 84
+A2M8_CABINS_PER_PACKET = 16
+A2M8_POINTS_PER_PACKET = 2 * A2M8_CABINS_PER_PACKET
+A2M8_ANGLE_OFFSET = 24
+A2M8_PACKET_DTYPE = np.dtype([
+    ('sync', 'u1', (2,)),
+    ('start_angle', '<u2'),
+    ('cabins', [('distance', '<u2', (2,)), ('compensation', 'u1')], (A2M8_CABINS_PER_PACKET,)),
+])
+# Packets read before decoding - about one revolution (96 ms at the line rate); on single packets the per-call cost
+# of validating and decoding makes the vectorized decoder slower than a per-point loop
+A2M8_MIN_READ_PACKETS = 12
+# Express scan packets start with the sync nibbles 0xA and 0x5; the low nibbles hold the XOR of the other 82 bytes
+A2M8_SYNC_NIBBLES = (0xA, 0x5)
+# Start angle step between packets at 10 Hz and 4000 samples/s, until the stream shows the actual one
+A2M8_PACKET_SPAN = 360 / (4000 / 10 / A2M8_POINTS_PER_PACKET)
+# Every response starts with a 7-byte descriptor: A5 5A, length, send mode and data type
+A2M8_RESPONSE_SYNC = b'\xA5\x5A'
+A2M8_DESCRIPTOR_SIZE = 7
+
+
+def a2m8_packets_valid(packets):
+    # Sync nibbles and checksum of every row of an (N, 84) uint8 array
+    checksum = np.bitwise_xor.reduce(packets[:, 2:], axis=1)
+    return (((packets[:, 0] >> 4) == A2M8_SYNC_NIBBLES[0]) & ((packets[:, 1] >> 4) == A2M8_SYNC_NIBBLES[1]) &
+            (((packets[:, 0] & 0x0F) | ((packets[:, 1] & 0x0F) << 4)) == checksum))
+
+
+def find_a2m8_packets(buffer):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = data.size - data.size % A2M8_PACKET_SIZE
+    if size == 0:
+        return np.empty(0, dtype=np.intp), 0
+    # Usually the buffer starts at a packet and holds nothing but packets - checked without searching
+    if a2m8_packets_valid(data[:size].reshape(-1, A2M8_PACKET_SIZE)).all():
+        return np.arange(0, size, A2M8_PACKET_SIZE), 0
+    candidates = np.flatnonzero(((data[:-1] >> 4) == A2M8_SYNC_NIBBLES[0]) & ((data[1:] >> 4) == A2M8_SYNC_NIBBLES[1]))
+    candidates = candidates[candidates + A2M8_PACKET_SIZE <= data.size]
+    valid = a2m8_packets_valid(data[candidates[:, np.newaxis] + np.arange(A2M8_PACKET_SIZE)])
+    return select_frames(candidates, valid, A2M8_PACKET_SIZE)
+
+
+def decode_a2m8_packets(packets, previous_start_angle, follows=None, gap_span=A2M8_PACKET_SPAN):
+    packets = np.ascontiguousarray(packets).view(A2M8_PACKET_DTYPE)[:, 0]
+    start_angles = (packets['start_angle'] & 0x7FFF) / 64
+    previous_start_angles = np.concatenate(([previous_start_angle], start_angles[:-1]))
+    if follows is not None and not follows.all():
+        # The start angle before a packet after a lost one is unknown - its cabins are spread over the usual span
+        previous_start_angles = np.where(follows, previous_start_angles, start_angles - gap_span)
+
+    # Each cabin distance word holds the distance above two flag bits: the compensation's fifth bit and its sign
+    words = packets['cabins']['distance'].reshape(len(packets), A2M8_POINTS_PER_PACKET)
+    bits = packets['cabins']['compensation']
+    compensation = np.empty(words.shape, dtype=np.int16)
+    compensation[:, 0::2] = bits & 0b00001111
+    compensation[:, 1::2] = bits >> 4
+    compensation |= (words & 0b01) << 4
+    compensation[(words & 0b10) != 0] *= -1
+
+    # Cabins hold the points between the previous and the current packet start angle
+    j = np.arange(1, A2M8_POINTS_PER_PACKET + 1)
+    angle_diff = ((start_angles - previous_start_angles) % 360) / 32
+    angles = (previous_start_angles[:, np.newaxis] + angle_diff[:, np.newaxis] * j) - compensation / 8
+    angles %= 360
+    angles += A2M8_ANGLE_OFFSET
+    return angles.ravel(), (words >> 2).ravel().astype(np.float64), start_angles
+
+
+def find_revolution_boundaries(angles, previous_angle, wrap_threshold=355):
+    previous_angles = np.concatenate(([previous_angle], angles[:-1]))
+    return np.flatnonzero((previous_angles - angles) > wrap_threshold)
+
+
+def polar_to_cartesian(angles, distances):
+    radians = np.radians(angles)
+    return distances * np.sin(radians), distances * np.cos(radians)
+
+
+def read_only(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class RevolutionBuffer:
+    def __init__(self, capacity=8, max_points=8192, buffer=None):
+        self.capacity = capacity
+        self.max_points = max_points
+        # Given a buffer (e.g. a SharedMemory block) the ring lives in it, so another process can map it
+        if buffer is None:
+            buffer = bytearray(self.nbytes(capacity, max_points))
+        offset = 0
+        for name, dtype, shape in self.layout(capacity, max_points):
+            column = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(self, name, column)
+            offset += column.nbytes
+        self.fill = 0
+
+    @staticmethod
+    def layout(capacity, max_points):
+        # Number of committed revolutions first - zeroed memory is an empty ring
+        return [('committed', np.int64, (1,)), ('count', np.int64, (capacity,)), ('timestamp', np.float64, (capacity,)),
+                ('angle', np.float32, (capacity, max_points)), ('distance', np.float32, (capacity, max_points)),
+                ('x', np.float32, (capacity, max_points)), ('y', np.float32, (capacity, max_points)),
+                ('intensity', np.float32, (capacity, max_points))]
+
+    @classmethod
+    def nbytes(cls, capacity=8, max_points=8192):
+        return sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in cls.layout(capacity, max_points))
+
+    @property
+    def latest(self):
+        # Index of the newest committed revolution; the next slot is the one being filled
+        return int(self.committed[0]) - 1
+
+    def append(self, angles, distances, intensities=None):
+        slot = (self.latest + 1) % self.capacity
+        n = min(len(angles), self.max_points - self.fill)
+        part = slice(self.fill, self.fill + n)
+        angle, distance, x, y = self.angle[slot, part], self.distance[slot, part], self.x[slot, part], self.y[slot, part]
+        angle[:] = angles[:n]
+        distance[:] = distances[:n]
+        # Sensors without an intensity (the A2M8 express scan) leave NaN, which no intensity filter removes
+        self.intensity[slot, part] = np.nan if intensities is None else intensities[:n]
+        np.radians(angle, out=x)
+        np.cos(x, out=y)
+        np.sin(x, out=x)
+        x *= distance
+        y *= distance
+        self.fill += n
+
+    def commit(self, timestamp=None):
+        slot = (self.latest + 1) % self.capacity
+        self.count[slot] = self.fill
+        self.timestamp[slot] = time.monotonic() if timestamp is None else timestamp
+        self.fill = 0
+        # Publishing the revolution is the last write, readers never see a half-written slot as committed
+        self.committed[0] += 1
+        return self.latest
+
+    def discard(self):
+        self.fill = 0
+
+    def release(self):
+        # Drops the columns' views of the buffer, so a SharedMemory block can be closed while readers still hold the
+        # ring - from then on it reads as empty and every index as overwritten
+        for name, dtype, shape in self.layout(self.capacity, 0):
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+        self.max_points = 0
+        self.fill = 0
+
+    def view(self, index=None):
+        if index is None:
+            index = self.latest
+        # The slot after the latest one is already being overwritten
+        latest = self.latest
+        if index < 0 or index > latest or index <= latest - self.capacity + 1:
+            return None
+        slot = index % self.capacity
+        count = self.count[slot]
+        return {'X': read_only(self.x[slot, :count]), 'Y': read_only(self.y[slot, :count]),
+                'angle': read_only(self.angle[slot, :count]), 'distance': read_only(self.distance[slot, :count]),
+                'intensity': read_only(self.intensity[slot, :count]), 'timestamp': self.timestamp[slot]}
+
+    def copy(self, index=None):
+        # For readers in another process than the writer: the slot is checked again after copying
+        if index is None:
+            index = self.latest
+        revolution = self.view(index)
+        if revolution is None:
+            return None
+        revolution = {name: np.array(value) for name, value in revolution.items()}
+        revolution['timestamp'] = float(revolution['timestamp'])
+        return revolution if self.view(index) is not None else None
 
 
 class LiDAR(ABC):
@@ -17,9 +277,8 @@ class LiDAR(ABC):
         self.port = None
         self.bandrate = bandrate
         self.is_active = False
-        self.points_X = []
-        self.points_Y = []
-        self.save_point_cloud = {'X': [], 'Y': []}
+        self.revolution_buffer = RevolutionBuffer()
+        self.recorder = None
         self.scan = Queue()
         self.hwid = None
         self.name = None
@@ -28,10 +287,50 @@ class LiDAR(ABC):
     def save_scan_to_csv(self):
         timestamp = time.strftime("%Y%m%d-%H%M%S")
         filename = os.path.join('Scans', f"{self.name[0]}_scan_{timestamp}.csv")
+        revolution = self.revolution_buffer.view()
+        if revolution is None:
+            return
         with open(filename, mode='w', newline='') as file:
             writer = csv.writer(file)
-            for i in range(len(self.save_point_cloud['X'])):
-                writer.writerow([self.save_point_cloud['X'][i], self.save_point_cloud['Y'][i]])
+            for i in range(len(revolution['X'])):
+                writer.writerow([revolution['X'][i], revolution['Y'][i]])
+
+    def commit_revolution(self):
+        index = self.revolution_buffer.commit()
+        # The GUI thread may detach the recorder at any time
+        recorder = self.recorder
+        if recorder is not None:
+            revolution = self.revolution_buffer.view(index)
+            recorder.add_revolution(self.name, index, revolution['timestamp'], revolution)
+        return index
+
+    def split_revolutions(self, angles, distances, boundaries, intensities=None, min_points=100):
+        # Points before each boundary close the revolution being filled, the rest start a new one
+        edges = np.concatenate(([0], boundaries, [len(angles)]))
+        for segment, (start, end) in enumerate(zip(edges[:-1], edges[1:])):
+            if segment > 0:
+                if self.revolution_buffer.fill > min_points:
+                    self.commit_revolution()
+                else:
+                    self.revolution_buffer.discard()
+            self.revolution_buffer.append(angles[start:end], distances[start:end],
+                                          None if intensities is None else intensities[start:end])
+
+    def attach_serial(self, ser):
+        # Any object with the pyserial read/write interface, e.g. a replayed capture
+        self.ser = ser
+        self.is_active = True
+
+    def open_port(self, port):
+        # A device path or any pyserial URL instead of the hwid search; sim:// opens the simulator
+        from Lidar_simulator import serial_for_url
+        self.port = port
+        try:
+            ser = serial_for_url(port, self.bandrate, timeout=self.timeout)
+        except (SerialException, ValueError) as error:
+            print(f"{self.name} could not open {port}: {error}")
+            return
+        self.attach_serial(ser)
 
     def check_serial_port(self):
         available_ports = list(serial.tools.list_ports.comports())
@@ -60,121 +359,155 @@ class LiDAR(ABC):
 
 
 class STL27L(LiDAR):
-    def __init__(self, bandrate=921600, timeout=None):
+    def __init__(self, bandrate=921600, timeout=None, ser=None, port=None):
         super().__init__(bandrate, timeout)
         self.hwid = '1C6DF6D68E44ED11BFABCEC90A86E0B4'
         self.name = 'Waveshare-STL27L'
-        self.check_serial_port()
+        self.stream_buffer = bytearray()
+        self.frame_counters = {'valid': 0, 'corrupt': 0, 'dropped': 0, 'skipped_bytes': 0}
+        self.previous_angle = 0
+        if ser is not None:
+            self.attach_serial(ser)
+        elif port is not None:
+            self.open_port(port)
+        else:
+            self.check_serial_port()
+
+    def decode_stream_buffer(self):
+        buffer = self.stream_buffer
+        starts, n_corrupt = find_stl27l_frames(buffer)
+        angles, distances, intensities = decode_stl27l_frames(buffer, starts)
+        # Resynchronize inside the buffer: everything up to the last valid frame or to the last
+        # possible frame start is consumed, the unfinished tail waits for the next revolution
+        consumed = max(starts[-1] + STL27L_FRAME_SIZE if starts.size else 0, len(buffer) - STL27L_FRAME_SIZE + 1, 0)
+        del buffer[:consumed]
+
+        self.frame_counters['valid'] += int(starts.size)
+        self.frame_counters['corrupt'] += n_corrupt
+        if n_corrupt:
+            instruments.count('stl27l.corrupt_frames', n_corrupt)
+        self.frame_counters['skipped_bytes'] += int(consumed - starts.size * STL27L_FRAME_SIZE)
+        self.frame_counters['dropped'] = self.frame_counters['skipped_bytes'] // STL27L_FRAME_SIZE
+        return angles, distances, intensities
 
     def make_full_scan(self):
         try:
-            distances = []
-            angles = []
-            start_time = time.time()
-            while (time.time() - start_time) < 0.1:
-                first_byte = ord(self.ser.read(1))
-                if first_byte == 84:
-                    second_byte = ord(self.ser.read(1))
-                    if second_byte == 44:
-                        data = self.ser.read(45)
-
-                        start_angle = data[3] * 256 + data[2]
-                        end_angle = data[41] * 256 + data[40]
-                        diff = ((end_angle - start_angle) / 100) / 11
-
-                        decimal_data = [int(byte) for byte in data[4:40]]
-
-                        distances += [decimal_data[i * 3] + decimal_data[i * 3 + 1] * 256 for i in range(0, 12)]
-                        angles += [start_angle / 100 + diff * j for j in range(0, 12)]
-
-            self.points_X = [distances[j] * math.sin(math.radians(angles[j]))
-                             for j in range(len(distances)) if distances != 0]
-            self.points_Y = [distances[j] * math.cos(math.radians(angles[j]))
-                             for j in range(len(distances)) if distances != 0]
-
-            self.save_point_cloud['X'] = copy.deepcopy(self.points_X)
-            self.save_point_cloud['Y'] = copy.deepcopy(self.points_Y)
-            if len(self.save_point_cloud['Y']) > 2000:
-                return [self.save_point_cloud['X'], self.save_point_cloud['Y']]
-            else:
-                return [[], []]
-        except IndexError:
-            pass
+            latest = self.revolution_buffer.latest
+            while self.revolution_buffer.latest == latest:
+                waiting = self.ser.in_waiting
+                instruments.gauge('stl27l.serial_waiting_bytes', waiting)
+                with instruments.span('stl27l.read'):
+                    data = self.ser.read(max(waiting, 1))
+                if not data:
+                    # Timeout or end of a replayed stream - give the worker a chance to stop
+                    return None
+                with instruments.span('stl27l.decode'):
+                    self.stream_buffer += data
+                    angles, distances, intensities = self.decode_stream_buffer()
+                    if distances.size == 0:
+                        continue
+                    # Revolutions end where the angle wraps; a backward jump of more than half a turn
+                    # still counts when frames around 0 degrees were lost
+                    boundaries = find_revolution_boundaries(angles, self.previous_angle, 180)
+                    self.previous_angle = angles[-1]
+                    valid = distances != 0
+                    valid_boundaries = np.concatenate(([0], np.cumsum(valid)))[boundaries]
+                    self.split_revolutions(angles[valid], distances[valid], valid_boundaries, intensities[valid])
+            return self.revolution_buffer.latest
         except SerialException:
             self.ser.close()
 
     def deactivate(self):
         self.ser.close()
         self.scan.queue.clear()
+        print(f"{self.name} frames: {self.frame_counters}")
 
 
 class A2M8(LiDAR):
-    def __init__(self, bandrate=115200, timeout=1):
+    def __init__(self, bandrate=115200, timeout=1, ser=None, port=None):
         super().__init__(bandrate, timeout)
         self.hwid = '0001'
         self.name = 'Slamtec-A2M8-R5'
-        self.full_scan = False
         self.sync_byte = b'\xA5'
         self.set_pwm_byte = b'\xF0'
         self.scan_type_byte = b'\x82'
         self.reset_byte = b'\x40'
         self.motor_pwm = 660
-        self.check_serial_port()
-
-    def is_scan_full(self, prev_angle, angle):
-        if (prev_angle - angle) > 355:
-            if len(self.points_X) > 100 and len(self.points_Y) > 100:
-                self.save_point_cloud['X'] = copy.deepcopy(self.points_X)
-                self.save_point_cloud['Y'] = copy.deepcopy(self.points_Y)
-                self.full_scan = True
-            self.points_X = []
-            self.points_Y = []
+        self.packet_buffer = bytearray()
+        self.frame_counters = {'valid': 0, 'corrupt': 0, 'dropped': 0, 'skipped_bytes': 0}
+        # The next packet follows the last decoded one without a gap, so its cabins can be placed between both start
+        # angles; the first packet follows the previous start angle the caller passes
+        self.packet_follows = True
+        self.packet_span = A2M8_PACKET_SPAN
+        if ser is not None:
+            self.attach_serial(ser)
+        elif port is not None:
+            self.open_port(port)
+        else:
+            self.check_serial_port()
 
     def make_full_scan(self, previous_angle, previous_start_angle):
-        sign = {0: 1, 1: -1}
-        while self.full_scan is False:
-            package = self.ser.read(84)
-            if len(package) == 84:
-                start_angle = (package[2] + ((package[3] & 0b01111111) << 8)) / 64
-
-                j = 1
-                for i in range(0, 80, 5):
-                    d = ((package[i + 4] >> 2) + (package[i + 5] << 6))
-                    a = (((package[i + 8] & 0b00001111) + ((package[i + 4] & 0b00000001) << 4)) / 8 * sign[(
-                            package[i + 4] & 0b00000010) >> 1])
-
-                    angle = (previous_start_angle + (
-                            (start_angle - previous_start_angle) % 360)
-                            / 32 * j - a) % 360 + 24
-                    j += 1
-                    self.is_scan_full(previous_angle, angle)
-                    self.points_X.append(d * math.sin(math.radians(angle)))
-                    self.points_Y.append(d * math.cos(math.radians(angle)))
-
-                    previous_angle = angle
-
-                    d = ((package[i + 6] >> 2) + (package[i + 7] << 6))
-                    a = (((package[i + 8] >> 4) + ((package[i + 6] & 0b00000001) << 4)) / 8 * sign[(
-                            package[i + 6] & 0b00000010) >> 1])
-
-                    angle = (previous_start_angle + (
-                            (start_angle - previous_start_angle) % 360)
-                            / 32 * j - a) % 360 + 24
-                    j += 1
-                    self.is_scan_full(previous_angle, angle)
-                    self.points_X.append(d * math.sin(math.radians(angle)))
-                    self.points_Y.append(d * math.cos(math.radians(angle)))
-
-                    previous_angle = angle
-
-                previous_start_angle = start_angle
-        self.full_scan = False
-        return [self.save_point_cloud['X'], self.save_point_cloud['Y']], previous_angle, previous_start_angle
+        latest = self.revolution_buffer.latest
+        while self.revolution_buffer.latest == latest:
+            waiting = self.ser.in_waiting
+            instruments.gauge('a2m8.serial_waiting_bytes', waiting)
+            n_packets = max(waiting // A2M8_PACKET_SIZE, A2M8_MIN_READ_PACKETS)
+            with instruments.span('a2m8.read'):
+                data = self.ser.read(A2M8_PACKET_SIZE * n_packets)
+            if not data:
+                # Timeout without data - give the worker a chance to stop
+                return None, previous_angle, previous_start_angle
+            self.packet_buffer += data
+            with instruments.span('a2m8.decode'):
+                packets, follows = self.take_packets()
+                if len(packets) == 0:
+                    continue
+                angles, distances, start_angles = decode_a2m8_packets(packets, previous_start_angle, follows,
+                                                                      self.packet_span)
+                if follows[-1]:
+                    # Start angle step of the newest packet, for the next packet after a lost one
+                    previous = start_angles[-2] if len(start_angles) > 1 else previous_start_angle
+                    self.packet_span = float((start_angles[-1] - previous) % 360)
+                boundaries = find_revolution_boundaries(angles, previous_angle)
+                if not follows.all():
+                    # The cabins of a lost packet leave a hole - across 0 degrees the angle jumps back by less
+                    # than the wrap threshold, half a turn is enough right after the hole
+                    holes = np.flatnonzero(~follows) * A2M8_POINTS_PER_PACKET
+                    before = np.concatenate(([previous_angle], angles[:-1]))[holes]
+                    boundaries = np.union1d(boundaries, holes[before - angles[holes] > 180])
+                self.split_revolutions(angles, distances, boundaries)
+                previous_angle = angles[-1]
+                previous_start_angle = start_angles[-1]
+
+        return self.revolution_buffer.latest, previous_angle, previous_start_angle
+
+    def take_packets(self):
+        # Valid packets of the buffer and whether each one directly follows a valid packet. Like the STL27L, the
+        # driver resynchronizes on the next valid packet after a corrupted or shortened one
+        buffer = self.packet_buffer
+        starts, n_corrupt = find_a2m8_packets(buffer)
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        packets = data[starts[:, np.newaxis] + np.arange(A2M8_PACKET_SIZE)]
+        follows = np.diff(starts, prepend=-A2M8_PACKET_SIZE if self.packet_follows else -1) == A2M8_PACKET_SIZE
+        consumed = max(starts[-1] + A2M8_PACKET_SIZE if starts.size else 0, len(buffer) - A2M8_PACKET_SIZE + 1, 0)
+        if starts.size or consumed:
+            self.packet_follows = starts.size > 0 and consumed == starts[-1] + A2M8_PACKET_SIZE
+        del data
+        del buffer[:consumed]
+
+        self.frame_counters['valid'] += int(starts.size)
+        self.frame_counters['corrupt'] += n_corrupt
+        if n_corrupt:
+            instruments.count('a2m8.corrupt_packets', n_corrupt)
+        self.frame_counters['skipped_bytes'] += int(consumed - starts.size * A2M8_PACKET_SIZE)
+        self.frame_counters['dropped'] = self.frame_counters['skipped_bytes'] // A2M8_PACKET_SIZE
+        return packets, follows
 
     def deactivate(self):
         self.set_pwm(0)
         self.ser.close()
         self.scan.queue.clear()
+        print(f"{self.name} packets: {self.frame_counters}")
 
     def set_pwm(self, pwm):
         payload = struct.pack("<H", pwm)
@@ -194,9 +527,18 @@ class A2M8(LiDAR):
         self.ser.write(req)
 
     def run(self):
-        self.ser.setDTR(False)
+        try:
+            self.ser.setDTR(False)
+        except OSError:
+            # Pseudo terminals (the simulator served on a pty) have no modem lines
+            pass
         self.set_pwm(self.motor_pwm)
         self.send_payload_command(self.scan_type_byte, b'\x00\x00\x00\x00\x00')
+        # The express scan answers with a response descriptor before the first packet; a replayed capture
+        # starts right at a packet, so those bytes are kept
+        descriptor = self.ser.read(A2M8_DESCRIPTOR_SIZE)
+        if not descriptor.startswith(A2M8_RESPONSE_SYNC):
+            self.packet_buffer += descriptor
 
     def reset(self):
         self.send_command(self.reset_byte)
@@ -0,0 +1,170 @@
+import sys
+import time
+import argparse
+from collections import deque
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import connected_components
+from Line_extraction import extract_lines, find_corners
+from Lidar_instrumentation import instruments
+
+# Both sensors spin at about 10 Hz - the features of a revolution should be ready before the next one is
+REVOLUTION_PERIOD_MS = 100.0
+# Closer points are the sensor housing or no return at all (distance 0)
+MIN_RANGE = 100.0
+# Adaptive breakpoint detector (Borges & Aldon): the largest gap for a surface seen at BREAKPOINT_ANGLE to the
+# beam, plus three sigma of range noise
+BREAKPOINT_ANGLE = np.radians(10)
+BREAKPOINT_NOISE = 30.0
+# Weaker STL27L returns (dark, distant or grazing surfaces) are mostly range noise; 0 is no return at all
+MIN_INTENSITY = 10
+# Points closer than this end up in one cluster, and so does every chain of them
+CLUSTER_DISTANCE = 150.0
+MIN_CLUSTER_POINTS = 5
+
+
+def filter_points(revolution, max_range=None, min_range=MIN_RANGE, min_intensity=MIN_INTENSITY):
+    # Points of a revolution in scan order inside the range band; the radius of the live view is the upper limit.
+    # Points below the intensity are dropped where the sensor measures one (NaN, the A2M8, is kept)
+    distance = np.asarray(revolution['distance'])
+    keep = distance >= min_range
+    if max_range:
+        keep &= distance <= max_range
+    intensity = revolution.get('intensity')
+    if min_intensity and intensity is not None:
+        keep &= ~(np.asarray(intensity) < min_intensity)
+    return {'points': np.column_stack((revolution['X'], revolution['Y']))[keep].astype(float),
+            'angle': np.radians(np.asarray(revolution['angle'])[keep], dtype=float),
+            'distance': distance[keep].astype(float)}
+
+
+def breakpoints(angles, distances, angle=BREAKPOINT_ANGLE, noise=BREAKPOINT_NOISE):
+    # Indices of the points starting a new segment - the gap to the point before is larger than a surface at the
+    # given angle to the beam could make it
+    if len(distances) < 2:
+        return np.zeros(0, dtype=np.intp)
+    step = np.abs(np.diff(angles)) % (2 * np.pi)
+    step = np.minimum(step, 2 * np.pi - step)
+    # Holes of at least the angle (doorways, occlusions, no returns) always break, no surface spans them
+    hole = step >= angle
+    max_gap = distances[:-1] * np.sin(step) / np.sin(np.where(hole, angle, angle - step)) + noise
+    # Law of cosines: the distance between neighbouring points straight from their polar coordinates
+    gaps = np.sqrt(np.maximum(distances[:-1] ** 2 + distances[1:] ** 2 -
+                              2 * distances[:-1] * distances[1:] * np.cos(step), 0))
+    return np.flatnonzero(hole | (gaps > max_gap)) + 1
+
+
+def euclidean_clusters(points, distance=CLUSTER_DISTANCE, min_points=MIN_CLUSTER_POINTS):
+    # Single linkage: connected components of the graph joining every pair of points at most the distance apart.
+    # Labels of the points, -1 for clusters with fewer than min_points, and every cluster's size, centroid and
+    # bounding box
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.intp), []
+    pairs = cKDTree(points).query_pairs(distance, output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(len(points),) * 2)
+    _, labels = connected_components(graph, directed=False)
+
+    counts = np.bincount(labels)
+    order = np.argsort(labels, kind='stable')
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    sorted_points = points[order]
+    centroids = np.column_stack((np.bincount(labels, weights=points[:, 0]),
+                                 np.bincount(labels, weights=points[:, 1]))) / counts[:, np.newaxis]
+    lower = np.minimum.reduceat(sorted_points, starts)
+    upper = np.maximum.reduceat(sorted_points, starts)
+    kept = np.flatnonzero(counts >= min_points)
+    new_labels = np.full(len(counts), -1)
+    new_labels[kept] = np.arange(len(kept))
+    clusters = [{'points': int(counts[k]), 'centroid': centroids[k], 'lower': lower[k], 'upper': upper[k]}
+                for k in kept]
+    return new_labels[labels], clusters
+
+
+class FeaturePipeline:
+    # Stages run one after the other on a dict of features: each reads what the ones before it added and adds its
+    # own. More stages are plugged in with add_stage(name, function(features)); every stage is timed on its own
+    def __init__(self, max_range=None, min_intensity=MIN_INTENSITY, budget_ms=REVOLUTION_PERIOD_MS, window=1000):
+        self.max_range = max_range
+        self.min_intensity = min_intensity
+        self.budget_ms = budget_ms
+        self.stages = [('filter', self.filter_stage), ('segments', self.segment_stage),
+                       ('lines', self.line_stage), ('clusters', self.cluster_stage)]
+        self.timings = {}
+        self.totals = deque(maxlen=window)
+        self.window = window
+        self.stats = {'revolutions': 0, 'over_budget': 0}
+
+    def add_stage(self, name, function):
+        self.stages.append((name, function))
+
+    def filter_stage(self, features):
+        features.update(filter_points(features['revolution'], self.max_range, min_intensity=self.min_intensity))
+
+    def segment_stage(self, features):
+        features['breaks'] = breakpoints(features['angle'], features['distance'])
+
+    def line_stage(self, features):
+        features['lines'] = extract_lines(features['points'], breaks=features['breaks'])
+        features['corners'] = find_corners(features['lines'])
+
+    def cluster_stage(self, features):
+        features['labels'], features['clusters'] = euclidean_clusters(features['points'])
+
+    def process(self, revolution):
+        features = {'revolution': revolution, 'timestamp': float(revolution['timestamp']), 'timings': {}}
+        start_time = time.perf_counter()
+        for name, function in self.stages:
+            stage_start = time.perf_counter()
+            function(features)
+            elapsed = (time.perf_counter() - stage_start) * 1000
+            features['timings'][name] = elapsed
+            self.timings.setdefault(name, deque(maxlen=self.window)).append(elapsed)
+            if instruments.enabled:
+                instruments.record(f'features.{name}', elapsed / 1000)
+        # The raw columns may belong to a ring buffer slot that is written again soon
+        del features['revolution']
+        features['total_ms'] = (time.perf_counter() - start_time) * 1000
+        self.totals.append(features['total_ms'])
+        self.stats['revolutions'] += 1
+        if features['total_ms'] > self.budget_ms:
+            self.stats['over_budget'] += 1
+        return features
+
+    def metrics(self):
+        metrics = dict(self.stats)
+        if self.totals:
+            totals = np.array(self.totals)
+            metrics.update(latency_p50_ms=float(np.percentile(totals, 50)),
+                           latency_p95_ms=float(np.percentile(totals, 95)),
+                           latency_max_ms=float(totals.max()))
+            for name, timings in self.timings.items():
+                metrics[f'{name}_p95_ms'] = float(np.percentile(np.array(timings), 95))
+        return metrics
+
+
+if __name__ == '__main__':
+    from Lidar_replay import make_replay_lidar, iter_revolutions
+    parser = argparse.ArgumentParser(description='Per-revolution lines, corners and clusters over a recording, '
+                                                 'scan files or a capture')
+    parser.add_argument('path')
+    parser.add_argument('--sensor', choices=['A2M8', 'STL27L'], default='STL27L')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, 0 = as fast as possible')
+    parser.add_argument('--radius', type=float, default=None, help='largest range in mm, as in the live view')
+    parser.add_argument('--min-intensity', type=float, default=MIN_INTENSITY,
+                        help='weakest STL27L return kept, 0 keeps all')
+    args = parser.parse_args()
+    lidar = make_replay_lidar(args.path, args.sensor, args.speed)
+    if not lidar.is_active:
+        sys.exit(f"{args.path}: nothing to replay for {args.sensor}")
+    pipeline = FeaturePipeline(args.radius, args.min_intensity)
+    counts = np.zeros(3)
+    for revolution in iter_revolutions(lidar):
+        features = pipeline.process(revolution)
+        counts += len(features['lines']), len(features['corners']), len(features['clusters'])
+    lidar.deactivate()
+    metrics = pipeline.metrics()
+    print(metrics)
+    if metrics['revolutions']:
+        lines, corners, clusters = counts / metrics['revolutions']
+        print(f"per revolution: {lines:.1f} lines, {corners:.1f} corners, {clusters:.1f} clusters")
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+from collections import deque
+import numpy as np
+
+# STL27L points are moved into the A2M8 frame
+REFERENCE_SENSOR = 'A2M8'
+MOVED_SENSOR = 'STL27L'
+CALIBRATION_FILE = os.path.join('Calibration', 'extrinsics.json')
+
+
+def load_extrinsics(filename=CALIBRATION_FILE):
+    # params are (tx, ty, theta) of ICP_function.apply_transformation; identity until the sensors are calibrated
+    if not os.path.exists(filename):
+        return {'params': [0.0, 0.0, 0.0]}
+    with open(filename) as file:
+        return json.load(file)
+
+
+def save_extrinsics(params, filename=CALIBRATION_FILE, **details):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, mode='w') as file:
+        json.dump({'params': [float(value) for value in params], **details}, file, indent=2)
+
+
+class RevolutionFuser:
+    # Pairs every revolution of the primary sensor with the other sensor's revolution nearest in time
+    def __init__(self, params=(0.0, 0.0, 0.0), primary=MOVED_SENSOR, tolerance=0.05, history=8, window=200):
+        self.primary = primary
+        self.tolerance = tolerance
+        self.pending = deque()
+        self.others = deque(maxlen=history)
+        self.set_extrinsics(params)
+        self.stats = {'frames': 0, 'unmatched': 0, 'dropped': 0}
+        self.latencies = deque(maxlen=window)
+        self.compute_times = deque(maxlen=window)
+        self.offsets = deque(maxlen=window)
+
+    def set_extrinsics(self, params):
+        self.params = tuple(float(value) for value in params)
+        tx, ty, theta = params
+        # Same rotation as apply_transformation, applied column by column
+        self.cos, self.sin = np.float32(np.cos(theta)), np.float32(np.sin(theta))
+        self.translation = np.float32(tx), np.float32(ty)
+
+    def add(self, sensor, revolution_buffer, revolution_index, now=None):
+        # Returns the fused frames that became complete, oldest first
+        revolution = revolution_buffer.view(revolution_index)
+        if revolution is None:
+            self.stats['dropped'] += 1
+        else:
+            entry = (float(revolution['timestamp']), revolution_buffer, revolution_index)
+            (self.pending if sensor == self.primary else self.others).append(entry)
+        return self.flush(now)
+
+    def flush(self, now=None):
+        now = time.monotonic() if now is None else now
+        frames = []
+        while self.pending:
+            timestamp = self.pending[0][0]
+            other = min(self.others, key=lambda entry: abs(entry[0] - timestamp), default=None)
+            offset = abs(other[0] - timestamp) if other is not None else np.inf
+            if not self.others or self.others[-1][0] < timestamp:
+                # The next revolution of the other sensor could still be nearer - wait for it while that is possible
+                next_other = self.others[-1][0] + self.other_period() if self.others else timestamp
+                if now - timestamp < self.tolerance and next_other - timestamp < min(offset, self.tolerance):
+                    break
+            primary = self.pending.popleft()
+            if offset > self.tolerance:
+                self.stats['unmatched'] += 1
+                continue
+            frame = self.fuse(primary, other, now)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def other_period(self):
+        if len(self.others) < 2:
+            return 0.0
+        return (self.others[-1][0] - self.others[0][0]) / (len(self.others) - 1)
+
+    def fuse(self, primary, other, now):
+        start_time = time.perf_counter()
+        reference, moved = (primary, other) if self.primary == REFERENCE_SENSOR else (other, primary)
+        reference_points = reference[1].view(reference[2])
+        moved_points = moved[1].view(moved[2])
+        if reference_points is None or moved_points is None:
+            self.stats['dropped'] += 1
+            return None
+        n_reference = len(reference_points['X'])
+        points = np.empty((n_reference + len(moved_points['X']), 2), dtype=np.float32)
+        points[:n_reference, 0] = reference_points['X']
+        points[:n_reference, 1] = reference_points['Y']
+        x, y = moved_points['X'], moved_points['Y']
+        moved_x, moved_y = points[n_reference:, 0], points[n_reference:, 1]
+        np.multiply(x, self.cos, out=moved_x)
+        moved_x += y * self.sin
+        moved_x += self.translation[0]
+        np.multiply(y, self.cos, out=moved_y)
+        moved_y -= x * self.sin
+        moved_y += self.translation[1]
+        # A writer in another process may have reached one of the slots while they were copied
+        if reference[1].view(reference[2]) is None or moved[1].view(moved[2]) is None:
+            self.stats['dropped'] += 1
+            return None
+
+        offset = other[0] - primary[0]
+        latency = now - max(primary[0], other[0])
+        self.compute_times.append(time.perf_counter() - start_time)
+        self.latencies.append(latency)
+        self.offsets.append(abs(offset))
+        self.stats['frames'] += 1
+        return {'points': points, 'timestamp': primary[0], 'offset': offset, 'latency': latency,
+                'counts': {REFERENCE_SENSOR: n_reference, MOVED_SENSOR: len(points) - n_reference}}
+
+    def metrics(self):
+        metrics = dict(self.stats)
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            metrics.update(latency_p50_ms=float(np.percentile(latencies, 50)),
+                           latency_p95_ms=float(np.percentile(latencies, 95)),
+                           latency_max_ms=float(latencies.max()),
+                           compute_p95_ms=float(np.percentile(np.array(self.compute_times) * 1000, 95)),
+                           offset_mean_ms=float(np.mean(self.offsets) * 1000))
+        return metrics
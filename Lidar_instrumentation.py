@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import threading
+import cProfile
+from collections import deque, Counter
+from contextlib import nullcontext
+import numpy as np
+
+METRICS_DIRECTORY = 'Metrics'
+# Durations kept per span for the percentiles
+WINDOW = 1000
+PROFILE_INTERVAL = 0.005
+# Returned by span() while instrumentation is off - nothing is timed or stored
+NO_SPAN = nullcontext()
+
+
+class Span:
+    __slots__ = ('instruments', 'name', 'start')
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.instruments.record(self.name, time.perf_counter() - self.start)
+
+
+class SamplingProfiler:
+    # Stacks of every other thread sampled from a daemon thread - cProfile only sees the thread that enabled it,
+    # this also sees the sensor, feature and job workers. Written as collapsed stacks for flame graph tools
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        while self.running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def stop(self, filename):
+        self.running = False
+        self.thread.join()
+        with open(filename, mode='w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+class Instrumentation:
+    # Spans (durations with rolling percentiles), counters and gauges from any thread. Off by default: span()
+    # then hands out a shared no-op context and the other calls return right away
+    def __init__(self, window=WINDOW):
+        self.enabled = False
+        self.window = window
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+            self.gauges = {}
+            self.started = time.monotonic()
+
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else NO_SPAN
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        durations = self.spans.get(name)
+        if durations is None:
+            with self.lock:
+                durations = self.spans.setdefault(name, deque(maxlen=self.window))
+        durations.append(seconds)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        # Last and largest value
+        if self.enabled:
+            with self.lock:
+                self.gauges[name] = (value, max(value, self.gauges.get(name, (value, value))[1]))
+
+    def snapshot(self):
+        with self.lock:
+            spans = {name: np.array(durations) * 1000 for name, durations in self.spans.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+        elapsed = time.monotonic() - self.started
+        return {'elapsed_s': elapsed,
+                'spans': {name: {'count': len(durations), 'p50_ms': float(np.percentile(durations, 50)),
+                                 'p95_ms': float(np.percentile(durations, 95)),
+                                 'p99_ms': float(np.percentile(durations, 99)), 'max_ms': float(durations.max())}
+                          for name, durations in sorted(spans.items()) if len(durations)},
+                'counters': {name: {'total': value, 'per_s': value / elapsed if elapsed else 0.0}
+                             for name, value in sorted(counters.items())},
+                'gauges': {name: {'last': last, 'max': largest} for name, (last, largest) in sorted(gauges.items())}}
+
+    def overlay_text(self, max_spans=8):
+        # The slowest spans by p95, then the counters and gauges
+        snapshot = self.snapshot()
+        spans = sorted(snapshot['spans'].items(), key=lambda item: -item[1]['p95_ms'])[:max_spans]
+        lines = [f"{name} p50/p95/p99 {span['p50_ms']:.1f}/{span['p95_ms']:.1f}/{span['p99_ms']:.1f} ms"
+                 for name, span in spans]
+        counters = [f"{name} {counter['per_s']:.1f}/s" for name, counter in snapshot['counters'].items()]
+        gauges = [f"{name} {gauge['last']} (max {gauge['max']})" for name, gauge in snapshot['gauges'].items()]
+        return '\n'.join(lines + ['   '.join(counters + gauges)])
+
+    def export(self, filename=None):
+        if filename is None:
+            filename = os.path.join(METRICS_DIRECTORY, f"metrics_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, mode='w') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        return filename
+
+    @property
+    def profiling(self):
+        return self.profiler is not None
+
+    def start_profiler(self, kind='sampling'):
+        # 'cprofile' profiles the calling thread only (the GUI thread), 'sampling' every thread
+        if kind == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+
+    def stop_profiler(self, filename=None):
+        # cProfile writes pstats data (.prof), the sampling profiler collapsed stacks (.txt)
+        profiler, self.profiler = self.profiler, None
+        extension = 'prof' if isinstance(profiler, cProfile.Profile) else 'txt'
+        if filename is None:
+            filename = os.path.join(METRICS_DIRECTORY, f"profile_{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(filename)
+        else:
+            profiler.stop(filename)
+        return filename
+
+
+# One instance for the whole process, so any module can add spans without passing it around
+instruments = Instrumentation()
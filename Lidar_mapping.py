@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+import numpy as np
+import matplotlib.pyplot as plt
+from ICP_function import apply_transformation
+
+# Cell size in mm and tile edge in cells - a tile covers 12.8 m x 12.8 m
+MAP_RESOLUTION = 50.0
+TILE_SIZE = 256
+# Log-odds added per revolution to a cell a beam ended in / passed through, and the clamping range
+LOG_ODDS_HIT = 0.85
+LOG_ODDS_MISS = -0.4
+LOG_ODDS_LIMIT = 5.0
+# Beams longer than this are treated as no return: free space up to the range, no obstacle
+MAX_RANGE = 25000.0
+
+
+def trace_rays(origin, ends, width):
+    # Flat indices (row * width + column) of the cells a beam from the origin cell passes through before it ends,
+    # one per step along its longer axis like Bresenham's algorithm. All beams are traced at once
+    deltas = ends - origin
+    steps = np.abs(deltas).max(axis=1)
+    total = int(steps.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    increments = (deltas / np.maximum(steps, 1)[:, np.newaxis]).astype(np.float32)
+    # Step number within its beam: 0, 1, ... n - 1 for every beam. float32 holds the indices of a window of up
+    # to 16M cells exactly and halves the memory traffic
+    t = np.arange(total, dtype=np.float32)
+    t -= np.repeat((np.cumsum(steps) - steps).astype(np.float32), steps)
+    columns = np.repeat(increments[:, 0], steps)
+    columns *= t
+    np.rint(columns, out=columns)
+    rows = np.repeat(increments[:, 1], steps)
+    rows *= t
+    np.rint(rows, out=rows)
+    rows *= width
+    rows += columns
+    rows += origin[1] * width + origin[0]
+    return rows.astype(np.int64)
+
+
+class OccupancyGrid:
+    # Log-odds occupancy in square tiles that are only allocated once a beam reaches them
+    def __init__(self, resolution=MAP_RESOLUTION, tile_size=TILE_SIZE, hit=LOG_ODDS_HIT, miss=LOG_ODDS_MISS,
+                 limit=LOG_ODDS_LIMIT, max_range=MAX_RANGE, window=1000):
+        self.resolution = resolution
+        self.tile_size = tile_size
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.max_range = max_range
+        # (tile column, tile row) -> float32 log-odds indexed [row, column], row = y
+        self.tiles = {}
+        self.latencies = deque(maxlen=window)
+        self.stats = {'revolutions': 0, 'beams': 0}
+
+    def cell(self, points):
+        return np.floor(points / self.resolution).astype(np.int64)
+
+    def integrate(self, x, y, pose=(0.0, 0.0, 0.0)):
+        # pose takes the revolution into the map frame like ICP_function.apply_transformation
+        start_time = time.perf_counter()
+        points = np.column_stack((x, y)).astype(float)
+        ranges = np.hypot(points[:, 0], points[:, 1])
+        valid = ranges > 0
+        points, ranges = points[valid], ranges[valid]
+        hit = ranges <= self.max_range
+        points[~hit] *= (self.max_range / ranges[~hit])[:, np.newaxis]
+        origin = self.cell(np.array(pose[:2], dtype=float))
+        ends = self.cell(apply_transformation(points, pose))
+
+        # Free and occupied cells of the revolution in a window around it, each counted once
+        low = np.minimum(ends.min(axis=0), origin) if len(ends) else origin
+        shape = (np.maximum(ends.max(axis=0), origin) - low + 1) if len(ends) else np.ones(2, dtype=np.int64)
+        update = np.zeros((shape[1], shape[0]), dtype=np.float32)
+        # Neighbouring beams often end in the same cell - trace it once
+        traced = np.unique((ends[:, 1] - low[1]) * shape[0] + ends[:, 0] - low[0])
+        traced = np.column_stack((traced % shape[0], traced // shape[0]))
+        update.ravel()[trace_rays(origin - low, traced, shape[0])] = self.miss
+        occupied = ends[hit] - low
+        update[occupied[:, 1], occupied[:, 0]] = self.hit
+        self.add_update(update, low)
+
+        latency = time.perf_counter() - start_time
+        self.latencies.append(latency)
+        self.stats['revolutions'] += 1
+        self.stats['beams'] += len(points)
+        return latency
+
+    def add_update(self, update, low):
+        size = self.tile_size
+        high = low + (update.shape[1], update.shape[0])
+        for tile_x in range(low[0] // size, (high[0] - 1) // size + 1):
+            for tile_y in range(low[1] // size, (high[1] - 1) // size + 1):
+                # Overlap of the update window with the tile, in both index spaces
+                x0, x1 = max(low[0], tile_x * size), min(high[0], (tile_x + 1) * size)
+                y0, y1 = max(low[1], tile_y * size), min(high[1], (tile_y + 1) * size)
+                part = update[y0 - low[1]:y1 - low[1], x0 - low[0]:x1 - low[0]]
+                if not part.any():
+                    continue
+                tile = self.tiles.get((tile_x, tile_y))
+                if tile is None:
+                    tile = self.tiles[tile_x, tile_y] = np.zeros((size, size), dtype=np.float32)
+                cells = tile[y0 - tile_y * size:y1 - tile_y * size, x0 - tile_x * size:x1 - tile_x * size]
+                cells += part
+                np.clip(cells, -self.limit, self.limit, out=cells)
+
+    def bounds(self):
+        # (min tile x, min tile y, max tile x, max tile y) of the allocated tiles
+        keys = np.array(list(self.tiles))
+        return (*keys.min(axis=0), *keys.max(axis=0))
+
+    def to_array(self):
+        # Mosaic of all tiles, unexplored tiles in between stay 0 (unknown), and the map coordinates of cell [0, 0]
+        if not self.tiles:
+            return np.zeros((0, 0), dtype=np.float32), (0.0, 0.0)
+        min_x, min_y, max_x, max_y = self.bounds()
+        size = self.tile_size
+        mosaic = np.zeros(((max_y - min_y + 1) * size, (max_x - min_x + 1) * size), dtype=np.float32)
+        for (tile_x, tile_y), tile in self.tiles.items():
+            row, column = (tile_y - min_y) * size, (tile_x - min_x) * size
+            mosaic[row:row + size, column:column + size] = tile
+        return mosaic, (min_x * size * self.resolution, min_y * size * self.resolution)
+
+    def probabilities(self, log_odds=None):
+        log_odds = self.to_array()[0] if log_odds is None else log_odds
+        return 1 / (1 + np.exp(-log_odds))
+
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def save(self, filename):
+        # Tiles under their (x, y) key, the grid parameters in a JSON header
+        header = {'resolution': self.resolution, 'tile_size': self.tile_size, 'hit': self.hit, 'miss': self.miss,
+                  'limit': self.limit, 'max_range': self.max_range}
+        np.savez_compressed(filename, header=json.dumps(header),
+                            **{f'{tile_x}_{tile_y}': tile for (tile_x, tile_y), tile in self.tiles.items()})
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            grid = cls(**json.loads(str(data['header'])))
+            for key in data.files:
+                if key != 'header':
+                    tile_x, tile_y = map(int, key.split('_'))
+                    grid.tiles[tile_x, tile_y] = data[key]
+        return grid
+
+    def save_image(self, filename):
+        # Occupied black, free white, unknown grey; north (+y) up
+        mosaic, _ = self.to_array()
+        plt.imsave(filename, 1 - self.probabilities(mosaic), cmap='gray', vmin=0, vmax=1, origin='lower')
+
+    def export_tiles(self, directory, image=True):
+        # One file per tile named after its key, as image or as log-odds array
+        os.makedirs(directory, exist_ok=True)
+        for (tile_x, tile_y), tile in self.tiles.items():
+            filename = os.path.join(directory, f'tile_{tile_x}_{tile_y}')
+            if image:
+                plt.imsave(f'{filename}.png', 1 - self.probabilities(tile), cmap='gray', vmin=0, vmax=1,
+                           origin='lower')
+            else:
+                np.save(f'{filename}.npy', tile)
+
+    def metrics(self):
+        metrics = dict(self.stats, tiles=len(self.tiles), megabytes=self.nbytes() / 1e6)
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            metrics.update(latency_p50_ms=float(np.percentile(latencies, 50)),
+                           latency_p95_ms=float(np.percentile(latencies, 95)),
+                           latency_max_ms=float(latencies.max()))
+        return metrics
+
+
+def load_trajectory(filename):
+    # Poses written by Lidar_odometry.py: timestamp, tx, ty, theta
+    return np.loadtxt(filename, delimiter=',', ndmin=2)
+
+
+def pose_at(trajectory, timestamp):
+    # Pose of the trajectory entry nearest in time
+    return trajectory[np.argmin(np.abs(trajectory[:, 0] - timestamp)), 1:]
+
+
+if __name__ == '__main__':
+    from Lidar_replay import make_replay_lidar, iter_revolutions
+    from Lidar_odometry import ScanOdometry
+    parser = argparse.ArgumentParser(description='Occupancy grid map of a recording, scan files or a capture')
+    parser.add_argument('path')
+    parser.add_argument('--sensor', choices=['A2M8', 'STL27L'], default='STL27L')
+    parser.add_argument('--trajectory', help='CSV file with the poses (Lidar_odometry.py --trajectory), '
+                                             'without it the poses come from scan matching')
+    parser.add_argument('--resolution', type=float, default=MAP_RESOLUTION, help='cell size in mm')
+    parser.add_argument('--output', default='map', help='writes <output>.npz and <output>.png')
+    parser.add_argument('--tiles', help='directory for one image per tile')
+    args = parser.parse_args()
+    lidar = make_replay_lidar(args.path, args.sensor, 0)
+    if not lidar.is_active:
+        sys.exit(f"{args.path}: nothing to replay for {args.sensor}")
+    trajectory = load_trajectory(args.trajectory) if args.trajectory else None
+    odometry = ScanOdometry() if trajectory is None else None
+    grid = OccupancyGrid(args.resolution)
+    for revolution in iter_revolutions(lidar):
+        if trajectory is not None:
+            pose = pose_at(trajectory, revolution['timestamp'])
+        elif odometry.add_revolution(revolution['X'], revolution['Y'], revolution['timestamp']) is not None:
+            pose = odometry.pose
+        else:
+            continue
+        grid.integrate(revolution['X'], revolution['Y'], pose)
+    lidar.deactivate()
+    print(grid.metrics())
+    grid.save(f'{args.output}.npz')
+    grid.save_image(f'{args.output}.png')
+    if args.tiles:
+        grid.export_tiles(args.tiles)
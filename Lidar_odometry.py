@@ -0,0 +1,134 @@
+import sys
+import time
+import argparse
+from collections import deque
+import numpy as np
+from scipy.spatial import KDTree
+from ICP_function import icp, estimate_normals, calculate_rmse, compose_params, invert_params
+from Lidar_instrumentation import instruments
+
+# Latency histogram bins of a match in ms, the last bin collects everything slower
+LATENCY_BINS = np.append(np.arange(0, 105, 5), np.inf)
+
+
+def voxel_downsample(points, voxel_size):
+    # One point per occupied voxel: the centroid of the points that fell into it
+    if len(points) == 0 or not voxel_size:
+        return points
+    cells = np.floor(points / voxel_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    keys = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    centroids = np.column_stack((np.bincount(inverse, weights=points[:, 0]),
+                                 np.bincount(inverse, weights=points[:, 1])))
+    return centroids / counts[:, np.newaxis]
+
+
+class ScanOdometry:
+    # Poses are (tx, ty, theta) of apply_transformation taking a revolution into the frame of the first one
+    def __init__(self, voxel_size=50.0, max_iterations=15, max_correspondence_distance=500.0,
+                 keyframe_distance=300.0, keyframe_angle=np.radians(10), min_points=50, window=1000):
+        self.voxel_size = voxel_size
+        self.max_iterations = max_iterations
+        self.max_correspondence_distance = max_correspondence_distance
+        self.keyframe_distance = keyframe_distance
+        self.keyframe_angle = keyframe_angle
+        self.min_points = min_points
+        self.keyframe = None
+        self.kdtree = None
+        self.normals = None
+        self.keyframe_pose = np.zeros(3)
+        # Current revolution relative to the keyframe, and the motion between the last two revolutions
+        self.relative = np.zeros(3)
+        self.motion = np.zeros(3)
+        self.pose = np.zeros(3)
+        self.trajectory = []
+        self.latencies = deque(maxlen=window)
+        self.stats = {'matches': 0, 'keyframes': 0, 'skipped': 0}
+
+    def set_keyframe(self, points):
+        # The KD-tree and normals are built once per keyframe and reused by every match against it. The keyframe
+        # keeps every point: voxel centroids on both sides would bias each match by a few millimetres
+        self.keyframe = points
+        self.kdtree = KDTree(points)
+        self.normals = estimate_normals(points, self.kdtree)
+        self.keyframe_pose = self.pose.copy()
+        self.relative = np.zeros(3)
+        self.stats['keyframes'] += 1
+
+    def add_revolution(self, x, y, timestamp=None):
+        start_time = time.perf_counter()
+        full_points = np.column_stack((x, y)).astype(float)
+        points = voxel_downsample(full_points, self.voxel_size)
+        if len(points) < self.min_points:
+            self.stats['skipped'] += 1
+            return None
+        if self.keyframe is None:
+            self.set_keyframe(full_points)
+            self.trajectory.append((timestamp, *self.pose))
+            return {'pose': self.pose.copy(), 'rmse': 0.0, 'iterations': 0, 'keyframe': True, 'latency': 0.0}
+
+        # Warm start: the same motion as between the previous two revolutions
+        predicted = compose_params(self.motion, self.relative)
+        result = icp(points, self.keyframe, predicted, method='point_to_line', max_iterations=self.max_iterations,
+                     tolerance=1e-3, max_correspondence_distance=self.max_correspondence_distance, kdtree=self.kdtree,
+                     normals=self.normals, loss='huber')
+        rmse = calculate_rmse(result['transformed_cloud'], self.keyframe, self.kdtree)
+        self.motion = compose_params(result['params'], invert_params(self.relative))
+        self.relative = result['params']
+        self.pose = compose_params(self.relative, self.keyframe_pose)
+
+        new_keyframe = np.hypot(*self.relative[:2]) > self.keyframe_distance or \
+            abs(self.relative[2]) > self.keyframe_angle or result['inlier_ratio'] < 0.5
+        if new_keyframe:
+            self.set_keyframe(full_points)
+        latency = time.perf_counter() - start_time
+        self.latencies.append(latency)
+        instruments.record('odometry.match', latency)
+        self.stats['matches'] += 1
+        self.trajectory.append((timestamp, *self.pose))
+        return {'pose': self.pose.copy(), 'rmse': rmse, 'iterations': result['iterations'], 'keyframe': new_keyframe,
+                'latency': latency}
+
+    def latency_histogram(self):
+        counts, _ = np.histogram(np.array(self.latencies) * 1000, bins=LATENCY_BINS)
+        return counts, LATENCY_BINS
+
+    def metrics(self):
+        metrics = dict(self.stats)
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            metrics.update(latency_p50_ms=float(np.percentile(latencies, 50)),
+                           latency_p95_ms=float(np.percentile(latencies, 95)),
+                           latency_max_ms=float(latencies.max()))
+        return metrics
+
+
+def format_histogram(counts, bins, width=40):
+    lines = []
+    for count, low, high in zip(counts, bins[:-1], bins[1:]):
+        if count:
+            label = f"{low:3.0f}-{high:3.0f} ms" if np.isfinite(high) else f"   >{low:3.0f} ms"
+            lines.append(f"{label} {count:6d} {'#' * int(np.ceil(width * count / counts.max()))}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from Lidar_replay import make_replay_lidar, iter_revolutions
+    parser = argparse.ArgumentParser(description='Scan-to-scan odometry over a recording, scan files or a capture')
+    parser.add_argument('path')
+    parser.add_argument('--sensor', choices=['A2M8', 'STL27L'], default='STL27L')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, 0 = as fast as possible')
+    parser.add_argument('--trajectory', help='CSV file for the poses: timestamp, tx, ty, theta')
+    args = parser.parse_args()
+    lidar = make_replay_lidar(args.path, args.sensor, args.speed)
+    if not lidar.is_active:
+        sys.exit(f"{args.path}: nothing to replay for {args.sensor}")
+    odometry = ScanOdometry()
+    for revolution in iter_revolutions(lidar):
+        odometry.add_revolution(revolution['X'], revolution['Y'], revolution['timestamp'])
+    lidar.deactivate()
+    print(odometry.metrics())
+    print(format_histogram(*odometry.latency_histogram()))
+    if args.trajectory:
+        np.savetxt(args.trajectory, np.array(odometry.trajectory, dtype=float), delimiter=',')
@@ -0,0 +1,122 @@
+import time
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from Lidar_classes import LiDAR, RevolutionBuffer, STL27L, A2M8
+from Lidar_replay import make_replay_lidar, REPLAY_SENSORS
+
+# Spawned, not forked - the GUI process has Qt and matplotlib state that must not be copied
+PROCESS_CONTEXT = multiprocessing.get_context('spawn')
+PROCESS_START_TIMEOUT = 15
+PROCESS_STOP_TIMEOUT = 5
+
+
+def acquisition_process(sensor, shm_name, capacity, max_points, indices, stop, replay_source, speed, loop, port=None):
+    # Serial read and decode loop of one sensor; revolutions go to the shared ring, only indices to the GUI
+    shm = SharedMemory(name=shm_name)
+    if replay_source is not None:
+        lidar = make_replay_lidar(replay_source, sensor, speed, loop)
+    elif sensor == 'STL27L':
+        lidar = STL27L(port=port)
+    else:
+        lidar = A2M8(port=port)
+    indices.put(bool(lidar.is_active))
+    if lidar.is_active:
+        lidar.revolution_buffer = RevolutionBuffer(capacity, max_points, shm.buf)
+        scan_state = ()
+        if isinstance(lidar, A2M8):
+            lidar.reset()
+            lidar.run()
+            scan_state = (0, 0)
+        while not stop.is_set():
+            if scan_state:
+                revolution_index, *scan_state = lidar.make_full_scan(*scan_state)
+            else:
+                revolution_index = lidar.make_full_scan()
+            if revolution_index is not None:
+                indices.put(revolution_index)
+            elif replay_source is not None and not loop:
+                # A replay without loop has ended
+                break
+        lidar.deactivate()
+        lidar.revolution_buffer.release()
+    indices.put(None)
+    shm.close()
+
+
+class ProcessLiDAR(LiDAR):
+    # GUI-side handle of a sensor running in its own process, used by the workers like a local LiDAR
+    def __init__(self, sensor, replay_source=None, speed=1.0, loop=False, capacity=8, max_points=8192, port=None):
+        super().__init__(bandrate=0, timeout=None)
+        self.name = REPLAY_SENSORS[sensor]
+        self.shm = SharedMemory(create=True, size=RevolutionBuffer.nbytes(capacity, max_points))
+        self.revolution_buffer = RevolutionBuffer(capacity, max_points, self.shm.buf)
+        self.indices = PROCESS_CONTEXT.Queue()
+        self.stop = PROCESS_CONTEXT.Event()
+        self.process = PROCESS_CONTEXT.Process(
+            target=acquisition_process, name=f'{sensor} acquisition', daemon=True,
+            args=(sensor, self.shm.name, capacity, max_points, self.indices, self.stop, replay_source, speed, loop,
+                  port))
+        self.process.start()
+        # The sensor opens in the acquisition process - whether it did is its first queued item, read by the worker
+        # thread in make_full_scan, so the GUI does not wait for it
+        self.is_active = True
+        self.started = False
+        self.start_deadline = time.monotonic() + PROCESS_START_TIMEOUT
+
+    def make_full_scan(self, *scan_state):
+        # Scan state stays in the acquisition process, the A2M8 worker's arguments are passed through
+        try:
+            revolution_index = self.indices.get(timeout=0.1)
+        except Empty:
+            revolution_index = None
+            if not self.started and time.monotonic() > self.start_deadline:
+                print(f"{self.name} acquisition process did not start within {PROCESS_START_TIMEOUT} s")
+                self.is_active = False
+        if isinstance(revolution_index, bool):
+            # Start report of the acquisition process - the worker stops when the sensor could not be opened
+            self.started = True
+            self.is_active = revolution_index
+            revolution_index = None
+        if revolution_index is not None:
+            self.record_revolution(revolution_index)
+        return (revolution_index, *scan_state) if scan_state else revolution_index
+
+    def record_revolution(self, revolution_index):
+        recorder = self.recorder
+        if recorder is None:
+            return
+        revolution = self.revolution_buffer.copy(revolution_index)
+        if revolution is None:
+            # Overwritten before the GUI process got to it
+            recorder.count_dropped()
+        else:
+            recorder.add_revolution(self.name, revolution_index, revolution['timestamp'], revolution)
+
+    def reset(self):
+        pass
+
+    def run(self):
+        pass
+
+    def deactivate(self):
+        self.stop.set()
+        # The process only exits once its queued indices are read
+        deadline = time.monotonic() + PROCESS_STOP_TIMEOUT
+        while self.process.is_alive() and time.monotonic() < deadline:
+            try:
+                self.indices.get(timeout=0.1)
+            except Empty:
+                pass
+        if self.process.is_alive():
+            # Stuck in a blocking serial read
+            self.process.terminate()
+            self.process.join()
+        self.is_active = False
+        self.scan.queue.clear()
+        # The GUI may still hold the ring (pending revolutions, fuser) - released, it reads as overwritten and no
+        # longer exports the mapping, which can then be closed
+        self.revolution_buffer.release()
+        self.revolution_buffer = None
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,233 @@
+import os
+import sys
+import time
+import glob
+import argparse
+import numpy as np
+from Lidar_classes import LiDAR, STL27L, A2M8
+from Scan_format import is_scan_file, load_cloud, SCAN_EXTENSION
+from Scan_recorder import RecordingReader, LOG_MAGIC
+
+REPLAY_SENSORS = {'A2M8': 'Slamtec-A2M8-R5', 'STL27L': 'Waveshare-STL27L'}
+REPLAY_BANDRATES = {'A2M8': 115200, 'STL27L': 921600}
+# Scan files carry no per-revolution timing, so they are paced like a 10 Hz sensor
+SCAN_FILE_PERIOD = 0.1
+# Without pacing a raw capture is served in reads of this size instead of all at once
+REPLAY_READ_SIZE = 4096
+
+
+class ReplaySerial:
+    # Serial port stand-in that serves a captured byte stream. With a speed the bytes arrive at
+    # speed times the line rate, without one the whole capture is available at once
+    def __init__(self, data, bandrate=None, speed=None, timeout=None, chunk_size=None, loop=False):
+        self.data = data
+        self.position = 0
+        self.bytes_per_second = bandrate / 10 * speed if bandrate and speed else None
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        # A looped capture starts over at its first byte and never ends
+        self.loop = loop
+        self.start_time = None
+        self.written = bytearray()
+        self.is_open = True
+
+    def arrived(self):
+        end = self.position + len(self.data) if self.loop else len(self.data)
+        if self.bytes_per_second is None:
+            return end
+        if self.start_time is None:
+            # The line clock starts with the first access, not when the capture was loaded
+            self.start_time = time.monotonic()
+        return min(end, int((time.monotonic() - self.start_time) * self.bytes_per_second))
+
+    @property
+    def in_waiting(self):
+        waiting = self.arrived() - self.position
+        return waiting if self.chunk_size is None else min(waiting, self.chunk_size)
+
+    def read(self, size=1):
+        end = self.position + size if self.loop else min(self.position + size, len(self.data))
+        if self.bytes_per_second is not None and self.arrived() < end:
+            # Block like a real port until the bytes have arrived or the timeout passes
+            wait = self.start_time + end / self.bytes_per_second - time.monotonic()
+            time.sleep(wait if self.timeout is None else max(min(wait, self.timeout), 0))
+            end = min(end, self.arrived())
+        chunk = bytearray()
+        while self.position < end:
+            start = self.position % len(self.data)
+            part = self.data[start:start + end - self.position]
+            chunk += part
+            self.position += len(part)
+        return bytes(chunk)
+
+    def write(self, data):
+        # Commands are kept so a replay can be checked against what the driver sent
+        self.written += data
+        return len(data)
+
+    def flushInput(self):
+        # A capture starts at its first byte - nothing to discard
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def setDTR(self, value=True):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class ReplayLiDAR(LiDAR):
+    # Feeds already decoded revolutions (a session recording or scan files) into the ring buffer
+    def __init__(self, name, revolutions, timestamps, speed=1.0, loop=False):
+        super().__init__(bandrate=0, timeout=None)
+        self.name = name
+        self.revolutions = revolutions
+        self.timestamps = np.asarray(timestamps, dtype=float)
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.start_time = None
+        self.is_active = len(self.timestamps) > 0
+
+    @classmethod
+    def from_recording(cls, filename, sensor, speed=1.0, loop=False):
+        reader = RecordingReader(filename)
+        entries = reader.sensor_revolutions(REPLAY_SENSORS.get(sensor, sensor))
+        revolutions = [lambda i=i: reader.read(i) for i in entries]
+        return cls(REPLAY_SENSORS.get(sensor, sensor), revolutions, reader.index['timestamp'][entries], speed, loop)
+
+    @classmethod
+    def from_scan_files(cls, filenames, sensor, speed=1.0, loop=False):
+        revolutions = [lambda filename=filename: cloud_to_revolution(load_cloud(filename)) for filename in filenames]
+        return cls(REPLAY_SENSORS.get(sensor, sensor), revolutions, np.arange(len(filenames)) * SCAN_FILE_PERIOD,
+                   speed, loop)
+
+    def make_full_scan(self, *scan_state):
+        # Works for both worker loops: the STL27L call takes no state, the A2M8 one passes it through
+        revolution_index = self.next_revolution()
+        return (revolution_index, *scan_state) if scan_state else revolution_index
+
+    def next_revolution(self):
+        if self.position == len(self.revolutions):
+            if not self.loop:
+                time.sleep(SCAN_FILE_PERIOD)
+                return None
+            self.position = 0
+            self.start_time = None
+        if self.start_time is None:
+            self.start_time = time.monotonic() - (self.timestamps[self.position] - self.timestamps[0]) / (
+                self.speed or 1)
+        if self.speed:
+            wait = self.start_time + (self.timestamps[self.position] - self.timestamps[0]) / self.speed - \
+                time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        revolution = self.revolutions[self.position]()
+        self.position += 1
+        self.revolution_buffer.append(revolution['angle'], revolution['distance'], revolution.get('intensity'))
+        return self.commit_revolution()
+
+    def reset(self):
+        pass
+
+    def run(self):
+        pass
+
+    def deactivate(self):
+        self.is_active = False
+        self.scan.queue.clear()
+
+
+def cloud_to_revolution(cloud):
+    # Scan files hold x, y only - the angle convention of polar_to_cartesian is inverted here
+    x, y = cloud[:, 0], cloud[:, 1]
+    return {'angle': np.degrees(np.arctan2(x, y)) % 360, 'distance': np.hypot(x, y)}
+
+
+def is_recording(filename):
+    with open(filename, mode='rb') as file:
+        return file.read(len(LOG_MAGIC)) == LOG_MAGIC
+
+
+def scan_files(path, sensor):
+    # A directory replays every scan of the sensor in it, in name (= time) order
+    prefix = REPLAY_SENSORS[sensor][0]
+    if os.path.isfile(path):
+        return [path]
+    filenames = sorted(glob.glob(os.path.join(path, '**', f'{prefix}_*'), recursive=True))
+    return [filename for filename in filenames if
+            (filename.endswith('.csv') or is_scan_file(filename)) and os.path.getsize(filename) > 0]
+
+
+def make_replay_lidar(path, sensor, speed=1.0, loop=False):
+    # speed: 1.0 real time, N for N times faster, 0 or None as fast as possible
+    if os.path.isdir(path) or path.endswith('.csv') or path.endswith(SCAN_EXTENSION):
+        return ReplayLiDAR.from_scan_files(scan_files(path, sensor), sensor, speed, loop)
+    if is_recording(path):
+        return ReplayLiDAR.from_recording(path, sensor, speed, loop)
+    # Anything else is a raw capture of the serial line, decoded by the real driver
+    with open(path, mode='rb') as file:
+        ser = ReplaySerial(file.read(), REPLAY_BANDRATES[sensor], speed, timeout=1,
+                           chunk_size=None if speed else REPLAY_READ_SIZE, loop=loop)
+    if sensor == 'STL27L':
+        return STL27L(ser=ser)
+    return A2M8(ser=ser)
+
+
+def replay(lidar, max_revolutions=None):
+    # Drains a replay source the way the acquisition workers do and reports the throughput
+    previous_angle, previous_start_angle = 0, 0
+    revolutions = 0
+    points = 0
+    latest = lidar.revolution_buffer.latest
+    start_time = time.perf_counter()
+    while max_revolutions is None or revolutions < max_revolutions:
+        if isinstance(lidar, A2M8):
+            revolution_index, previous_angle, previous_start_angle = lidar.make_full_scan(previous_angle,
+                                                                                          previous_start_angle)
+        else:
+            revolution_index = lidar.make_full_scan()
+        if revolution_index is None:
+            break
+        # One read can complete several revolutions, the GUI only ever shows the newest
+        revolutions += revolution_index - latest
+        points += len(lidar.revolution_buffer.view(revolution_index)['X'])
+        latest = revolution_index
+    elapsed = time.perf_counter() - start_time
+    return {'revolutions': revolutions, 'points_shown': points, 'seconds': elapsed,
+            'revolutions_per_second': revolutions / elapsed if elapsed else 0.0}
+
+
+def iter_revolutions(lidar):
+    # Every revolution of a replay source in order, including those completed by the same read
+    scan_state = (0, 0) if isinstance(lidar, A2M8) else ()
+    latest = lidar.revolution_buffer.latest
+    while True:
+        if scan_state:
+            revolution_index, *scan_state = lidar.make_full_scan(*scan_state)
+        else:
+            revolution_index = lidar.make_full_scan()
+        if revolution_index is None:
+            return
+        for index in range(latest + 1, revolution_index + 1):
+            revolution = lidar.revolution_buffer.view(index)
+            if revolution is not None:
+                yield revolution
+        latest = revolution_index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recording, scan files or a raw serial capture')
+    parser.add_argument('path')
+    parser.add_argument('--sensor', choices=sorted(REPLAY_SENSORS), default='STL27L')
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, 0 = as fast as possible')
+    parser.add_argument('--revolutions', type=int, default=None)
+    args = parser.parse_args()
+    replay_lidar = make_replay_lidar(args.path, args.sensor, args.speed)
+    if not replay_lidar.is_active:
+        sys.exit(f"{args.path}: nothing to replay for {args.sensor}")
+    print(replay(replay_lidar, args.revolutions))
+    replay_lidar.deactivate()
@@ -0,0 +1,448 @@
+import os
+import time
+import select
+import signal
+import struct
+import argparse
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import serial
+from Lidar_classes import STL27L, A2M8, STL27L_HEADER, STL27L_FRAME_SIZE, STL27L_FRAME_DTYPE, STL27L_POINTS_PER_FRAME, \
+    stl27l_crc8, A2M8_PACKET_SIZE, A2M8_POINTS_PER_PACKET, A2M8_ANGLE_OFFSET, A2M8_RESPONSE_SYNC
+from Lidar_replay import cloud_to_revolution, replay
+from Scan_format import load_cloud
+
+SIMULATOR_SCHEME = 'sim'
+SCAN_RATE_HZ = 10.0
+# Points per revolution at 10 Hz: 21600 samples/s of the STL27L, what an A2M8 express scan fits into 115200 baud
+POINTS_PER_REVOLUTION = {'STL27L': 2160, 'A2M8': 384}
+MAX_RANGE = {'STL27L': 25000.0, 'A2M8': 12000.0}
+# Range noise (one sigma, mm)
+RANGE_NOISE = 10.0
+STL27L_INTENSITY = 200
+# Largest A2M8 angle compensation in 1/8 degree
+A2M8_MAX_COMPENSATION = 8
+# A2M8 requests and what the device answers
+A2M8_REQUEST_SYNC = 0xA5
+A2M8_STOP = 0x25
+A2M8_RESET = 0x40
+A2M8_EXPRESS_SCAN = 0x82
+A2M8_SET_PWM = 0xF0
+# Response descriptor of the express scan: 84-byte packets, sent until stopped, data type 0x82
+A2M8_EXPRESS_DESCRIPTOR = A2M8_RESPONSE_SYNC + bytes([0x54, 0x00, 0x00, 0x40, 0x82])
+A2M8_BOOT_MESSAGE = b'RP LIDAR System.\r\nFirmware Ver 1.29 - rc1, HW Ver 5\r\nModel: 44\r\n'
+# Longest run of bytes cut out of a frame or packet by a simulated drop
+MAX_DROPPED_BYTES = 20
+# A port with nothing to send returns empty reads after its timeout, or after this long without one
+IDLE_READ_WAIT = 0.1
+PTY_POLL_INTERVAL = 0.002
+
+
+def encode_stl27l_frames(angles, distances, intensities=STL27L_INTENSITY, timestamps=0, speed=3600):
+    # Byte-exact frames of 12 points: header, speed in degrees/s, start angle, distance and intensity of every
+    # point, end angle, timestamp in ms and CRC-8 - the layout decode_stl27l_frames reads
+    n_frames = len(angles) // STL27L_POINTS_PER_FRAME
+    n_points = n_frames * STL27L_POINTS_PER_FRAME
+    angles = np.asarray(angles[:n_points], dtype=float).reshape(n_frames, STL27L_POINTS_PER_FRAME)
+    frames = np.zeros(n_frames, dtype=STL27L_FRAME_DTYPE)
+    frames['header'] = STL27L_HEADER[0]
+    frames['ver_len'] = STL27L_HEADER[1]
+    frames['speed'] = speed
+    frames['start_angle'] = np.round(angles[:, 0] * 100).astype(np.int64) % 36000
+    frames['end_angle'] = np.round(angles[:, -1] * 100).astype(np.int64) % 36000
+    frames['timestamp'] = np.asarray(timestamps, dtype=np.int64) % 30000
+    frames['points']['distance'] = np.clip(np.round(distances[:n_points]), 0, 0xFFFF).reshape(n_frames, -1)
+    frames['points']['intensity'] = np.broadcast_to(intensities, (n_points,)).reshape(n_frames, -1)
+    data = frames.view(np.uint8).reshape(n_frames, STL27L_FRAME_SIZE)
+    data[:, -1] = stl27l_crc8(data[:, :-1])
+    return data.tobytes()
+
+
+def encode_a2m8_packets(start_angles, distances, compensation, new_scan=False):
+    # start_angles (N,), distances and compensation (N, 32) in mm and degrees; new_scan sets the start flag
+    # of the first packet, as after the express scan request
+    n_packets = len(start_angles)
+    packets = np.zeros((n_packets, A2M8_PACKET_SIZE), dtype=np.uint8)
+    start_q6 = np.round(np.asarray(start_angles) % 360 * 64).astype(np.int64) % (360 * 64)
+    packets[:, 2] = start_q6 & 0xFF
+    packets[:, 3] = start_q6 >> 8
+    if new_scan and n_packets:
+        packets[0, 3] |= 0x80
+
+    d = np.clip(np.round(distances), 0, 0x3FFF).astype(np.int64)
+    q = np.clip(np.round(np.abs(compensation) * 8), 0, 31).astype(np.int64)
+    negative = (np.asarray(compensation) < 0).astype(np.int64)
+    low = ((d & 0x3F) << 2) | (negative << 1) | (q >> 4)
+    cabins = packets[:, 4:].reshape(n_packets, -1, 5)
+    cabins[:, :, 0] = low[:, 0::2]
+    cabins[:, :, 1] = d[:, 0::2] >> 6
+    cabins[:, :, 2] = low[:, 1::2]
+    cabins[:, :, 3] = d[:, 1::2] >> 6
+    cabins[:, :, 4] = (q[:, 0::2] & 0x0F) | ((q[:, 1::2] & 0x0F) << 4)
+    packets[:, 4:] = cabins.reshape(n_packets, -1)
+
+    checksum = np.bitwise_xor.reduce(packets[:, 2:], axis=1)
+    packets[:, 0] = 0xA0 | (checksum & 0x0F)
+    packets[:, 1] = 0x50 | (checksum >> 4)
+    return packets.tobytes()
+
+
+def inject_faults(data, size, crc_error_rate, drop_rate, rng):
+    # Flips one byte behind the checksum of crc_error_rate of the frames or packets and cuts a run of bytes out
+    # of drop_rate of them; returns the damaged bytes, the number of corrupted frames and of dropped bytes
+    frames = np.frombuffer(data, dtype=np.uint8).reshape(-1, size).copy()
+    corrupted = np.flatnonzero(rng.random(len(frames)) < crc_error_rate)
+    frames[corrupted, rng.integers(2, size, len(corrupted))] ^= rng.integers(1, 256, len(corrupted)).astype(np.uint8)
+    keep = np.ones(frames.size, dtype=bool)
+    for frame in np.flatnonzero(rng.random(len(frames)) < drop_rate):
+        start = frame * size + int(rng.integers(0, size))
+        keep[start:start + int(rng.integers(1, MAX_DROPPED_BYTES + 1))] = False
+    return frames.ravel()[keep].tobytes(), len(corrupted), int(keep.size - np.count_nonzero(keep))
+
+
+class Scene:
+    # Walls (line segments) and round pillars around the sensor at the origin, in mm. Ranges use the bearing
+    # convention of polar_to_cartesian: x = d * sin(angle), y = d * cos(angle)
+    def __init__(self, walls=(), pillars=()):
+        self.walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+        self.pillars = np.asarray(pillars, dtype=float).reshape(-1, 3)
+
+    @classmethod
+    def room(cls, width=8000.0, depth=6000.0, n_pillars=2, seed=0):
+        # A rectangular room with the sensor off its centre, an L-profile 3 m in front and pillars of 150 mm
+        rng = np.random.default_rng(seed)
+        left, right, back, front = -width / 2, width / 2, -depth / 3, 2 * depth / 3
+        corners = np.array([[left, back], [right, back], [right, front], [left, front]])
+        walls = [(corners[k], corners[(k + 1) % 4]) for k in range(4)]
+        walls += [((-300.0, 3000.0), (0.0, 3000.0)), ((0.0, 3000.0), (0.0, 3200.0))]
+        pillars = []
+        while len(pillars) < n_pillars:
+            x, y = rng.uniform(left + 500, right - 500), rng.uniform(back + 500, front - 500)
+            if np.hypot(x, y) > 1000 and abs(x) > 500:
+                pillars.append((x, y, 150.0))
+        return cls(walls, pillars)
+
+    def ranges(self, angles):
+        # Distance to the nearest wall or pillar along every ray, 0 where nothing is hit
+        radians = np.radians(angles)
+        rays = np.column_stack((np.sin(radians), np.cos(radians)))
+        ranges = np.full(len(rays), np.inf)
+        if len(self.walls):
+            start, direction = self.walls[:, 0], self.walls[:, 1] - self.walls[:, 0]
+            # t * ray = start + s * direction, solved with 2D cross products
+            denominator = rays[:, [0]] * direction[:, 1] - rays[:, [1]] * direction[:, 0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (start[:, 0] * direction[:, 1] - start[:, 1] * direction[:, 0]) / denominator
+                s = (start[:, 0] * rays[:, [1]] - start[:, 1] * rays[:, [0]]) / denominator
+            t[~((t > 0) & (s >= 0) & (s <= 1))] = np.inf
+            ranges = np.minimum(ranges, t.min(axis=1))
+        if len(self.pillars):
+            centres, radii = self.pillars[:, :2], self.pillars[:, 2]
+            along = rays @ centres.T
+            discriminant = along ** 2 - np.sum(centres ** 2, axis=1) + radii ** 2
+            with np.errstate(invalid='ignore'):
+                t = along - np.sqrt(discriminant)
+            t[~((discriminant >= 0) & (t > 0))] = np.inf
+            ranges = np.minimum(ranges, t.min(axis=1))
+        ranges[np.isinf(ranges)] = 0
+        return ranges
+
+
+class ScanScene:
+    # A recorded scan file seen from where it was taken, interpolated between its bearings
+    def __init__(self, filename):
+        revolution = cloud_to_revolution(load_cloud(filename))
+        order = np.argsort(revolution['angle'])
+        self.angles = revolution['angle'][order]
+        self.distances = revolution['distance'][order]
+
+    def ranges(self, angles):
+        return np.interp(np.asarray(angles) % 360, self.angles, self.distances, period=360)
+
+
+class SimulatedSerial:
+    # Serial port stand-in playing a simulated STL27L or A2M8. Revolutions of the scene are encoded when the line
+    # clock reaches them, at speed times the scan rate (0 = as fast as they are read). The STL27L streams from the
+    # start, the A2M8 answers reset, set_pwm and the express scan request like the device and only streams while
+    # it scans with the motor on
+    def __init__(self, sensor='STL27L', scene=None, speed=1.0, noise=RANGE_NOISE, crc_error_rate=0.0, drop_rate=0.0,
+                 points_per_revolution=None, rate_hz=SCAN_RATE_HZ, timeout=None, seed=0):
+        self.sensor = sensor
+        self.scene = scene if scene is not None else Scene.room()
+        self.noise = noise
+        self.crc_error_rate = crc_error_rate
+        self.drop_rate = drop_rate
+        self.points_per_revolution = points_per_revolution or POINTS_PER_REVOLUTION[sensor]
+        self.points_per_revolution -= self.points_per_revolution % (
+            STL27L_POINTS_PER_FRAME if sensor == 'STL27L' else A2M8_POINTS_PER_PACKET)
+        self.frame_size = STL27L_FRAME_SIZE if sensor == 'STL27L' else A2M8_PACKET_SIZE
+        frames_per_revolution = self.points_per_revolution // (
+            STL27L_POINTS_PER_FRAME if sensor == 'STL27L' else A2M8_POINTS_PER_PACKET)
+        self.revolution_size = frames_per_revolution * self.frame_size
+        self.rate_hz = rate_hz
+        self.bytes_per_second = self.revolution_size * rate_hz * speed if speed else None
+        self.timeout = timeout
+        self.rng = np.random.default_rng(seed)
+        self.counters = {'revolutions': 0, 'frames': 0, 'crc_errors': 0, 'dropped_bytes': 0, 'commands': 0,
+                         'bad_commands': 0}
+        # Line bytes generated but not read yet, answers to requests (sent right away) and unparsed requests
+        self.stream = bytearray()
+        self.responses = bytearray()
+        self.requests = bytearray()
+        self.position = 0
+        self.clock_start = None
+        self.scanning = sensor == 'STL27L'
+        self.motor_pwm = 0
+        self.new_scan = False
+        self.packet_start_angle = 0.0
+        self.is_open = True
+        if self.scanning:
+            self.start_clock()
+
+    @property
+    def streaming(self):
+        return self.is_open and self.scanning and (self.sensor == 'STL27L' or self.motor_pwm > 0)
+
+    def start_clock(self):
+        self.stream.clear()
+        self.position = 0
+        self.clock_start = time.monotonic()
+
+    def arrived(self):
+        # Line bytes sent since the clock started; without pacing there is always a revolution more
+        if not self.streaming:
+            return self.position
+        if self.bytes_per_second is None:
+            return self.position + self.revolution_size
+        return int((time.monotonic() - self.clock_start) * self.bytes_per_second)
+
+    def measure(self, angles):
+        distances = self.scene.ranges(angles)
+        hit = (distances > 0) & (distances <= MAX_RANGE[self.sensor])
+        distances = np.where(hit, distances + self.rng.normal(0, self.noise, len(distances)), 0)
+        return np.maximum(distances, 0), hit
+
+    def next_revolution(self):
+        step = 360 / self.points_per_revolution
+        if self.sensor == 'STL27L':
+            angles = np.arange(self.points_per_revolution) * step
+            distances, hit = self.measure(angles)
+            n_frames = self.points_per_revolution // STL27L_POINTS_PER_FRAME
+            timestamps = np.round((self.counters['revolutions'] + np.arange(n_frames) / n_frames) * 1000 /
+                                  self.rate_hz)
+            data = encode_stl27l_frames(angles, distances, np.where(hit, STL27L_INTENSITY, 0), timestamps,
+                                        int(round(360 * self.rate_hz)))
+        else:
+            # Every packet holds the points between the start angle of the one before and its own
+            n_packets = self.points_per_revolution // A2M8_POINTS_PER_PACKET
+            start_angles = (self.packet_start_angle + np.arange(1, n_packets + 1) * A2M8_POINTS_PER_PACKET * step) % 360
+            self.packet_start_angle = start_angles[-1]
+            point_angles = (start_angles[:, np.newaxis] - A2M8_POINTS_PER_PACKET * step +
+                            step * np.arange(1, A2M8_POINTS_PER_PACKET + 1) + A2M8_ANGLE_OFFSET)
+            # Small enough that the driver still sees the wrap of more than 355 degrees at every revolution
+            compensation = self.rng.integers(-A2M8_MAX_COMPENSATION, A2M8_MAX_COMPENSATION + 1,
+                                             size=point_angles.shape) / 8
+            distances, _ = self.measure((point_angles - compensation).ravel() % 360)
+            data = encode_a2m8_packets(start_angles, distances.reshape(point_angles.shape), compensation,
+                                       self.new_scan)
+            self.new_scan = False
+        self.counters['revolutions'] += 1
+        self.counters['frames'] += len(data) // self.frame_size
+        if self.crc_error_rate or self.drop_rate:
+            data, corrupted, dropped = inject_faults(data, self.frame_size, self.crc_error_rate, self.drop_rate,
+                                                     self.rng)
+            self.counters['crc_errors'] += corrupted
+            self.counters['dropped_bytes'] += dropped
+        return data
+
+    def fill(self, end):
+        while self.position + len(self.stream) < end:
+            self.stream += self.next_revolution()
+
+    @property
+    def in_waiting(self):
+        return len(self.responses) + max(self.arrived() - self.position, 0)
+
+    def read(self, size=1):
+        chunk = bytearray(self.responses[:size])
+        del self.responses[:size]
+        if len(chunk) == size:
+            return bytes(chunk)
+        if not self.streaming:
+            if not chunk:
+                # Nothing is sent - a real port waits for its timeout
+                time.sleep(IDLE_READ_WAIT if self.timeout is None else min(self.timeout, IDLE_READ_WAIT))
+            return bytes(chunk)
+        end = self.position + size - len(chunk)
+        if self.bytes_per_second is not None and self.arrived() < end and not chunk:
+            # Block like a real port until the bytes have arrived or the timeout passes
+            wait = self.clock_start + end / self.bytes_per_second - time.monotonic()
+            time.sleep(wait if self.timeout is None else max(min(wait, self.timeout), 0))
+        end = min(end, self.arrived())
+        if end > self.position:
+            self.fill(end)
+            chunk += self.stream[:end - self.position]
+            del self.stream[:end - self.position]
+            self.position = end
+        return bytes(chunk)
+
+    def write(self, data):
+        self.requests += data
+        if self.sensor == 'A2M8':
+            self.handle_requests()
+        else:
+            # The STL27L has no commands, it only streams
+            self.requests.clear()
+        return len(data)
+
+    def handle_requests(self):
+        # A5 command, or A5 command size payload checksum for the commands with bit 7 set
+        requests = self.requests
+        while requests:
+            if requests[0] != A2M8_REQUEST_SYNC:
+                del requests[0]
+                continue
+            if len(requests) < 2:
+                return
+            command = requests[1]
+            payload = b''
+            if command & 0x80:
+                if len(requests) < 3 or len(requests) < requests[2] + 4:
+                    return
+                request = bytes(requests[:requests[2] + 4])
+                del requests[:len(request)]
+                checksum = 0
+                for byte in request[:-1]:
+                    checksum ^= byte
+                if checksum != request[-1]:
+                    self.counters['bad_commands'] += 1
+                    continue
+                payload = request[3:-1]
+            else:
+                del requests[:2]
+            self.counters['commands'] += 1
+            self.handle_command(command, payload)
+
+    def handle_command(self, command, payload):
+        if command == A2M8_RESET:
+            self.scanning = False
+            self.motor_pwm = 0
+            self.responses[:] = A2M8_BOOT_MESSAGE
+        elif command == A2M8_STOP:
+            self.scanning = False
+        elif command == A2M8_SET_PWM and len(payload) == 2:
+            self.motor_pwm = struct.unpack('<H', payload)[0]
+        elif command == A2M8_EXPRESS_SCAN:
+            self.responses += A2M8_EXPRESS_DESCRIPTOR
+            self.scanning = True
+            self.new_scan = True
+            self.start_clock()
+        else:
+            self.counters['bad_commands'] += 1
+
+    def flushInput(self):
+        # Whatever was sent so far is discarded, the stream goes on from now
+        self.responses.clear()
+        if self.streaming:
+            self.start_clock()
+
+    def reset_input_buffer(self):
+        self.flushInput()
+
+    def setDTR(self, value=True):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def serial_for_url(url, *args, timeout=None, **kwargs):
+    # sim://STL27L?speed=4&noise=10&crc=0.001&drop=0.001&points=2160&rate=10&seed=0&scene=room&pillars=2 (or
+    # scene=<scan file>) opens a simulator, any other URL or device path goes to pyserial
+    parts = urlsplit(url)
+    if parts.scheme != SIMULATOR_SCHEME:
+        return serial.serial_for_url(url, *args, timeout=timeout, **kwargs)
+    options = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+    scene = options.get('scene', 'room')
+    if scene == 'room':
+        scene = Scene.room(float(options.get('width', 8000)), float(options.get('depth', 6000)),
+                           int(options.get('pillars', 2)), int(options.get('seed', 0)))
+    else:
+        scene = ScanScene(scene)
+    return SimulatedSerial(parts.netloc.upper() or 'STL27L', scene, float(options.get('speed', 1)),
+                           float(options.get('noise', RANGE_NOISE)), float(options.get('crc', 0)),
+                           float(options.get('drop', 0)), int(options.get('points', 0)) or None,
+                           float(options.get('rate', SCAN_RATE_HZ)), timeout, int(options.get('seed', 0)))
+
+
+def serve_pty(simulated, link=None):
+    # Serves the simulator on a pseudo terminal (POSIX), so anything that opens a serial device can use it
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if link:
+        if os.path.islink(link):
+            os.remove(link)
+        os.symlink(name, link)
+    print(f"{simulated.sensor} simulator on {link or name}", flush=True)
+    # Stopped with Ctrl+C or kill, both remove the link
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            readable, _, _ = select.select([master], [], [], PTY_POLL_INTERVAL)
+            if readable:
+                simulated.write(os.read(master, 4096))
+            waiting = simulated.in_waiting
+            if waiting:
+                os.write(master, simulated.read(waiting))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if link and os.path.islink(link):
+            os.remove(link)
+        os.close(master)
+        os.close(slave)
+
+
+def load_test(simulated, revolutions):
+    # Decodes the simulated stream with the real driver, like the acquisition workers do
+    lidar = STL27L(ser=simulated) if simulated.sensor == 'STL27L' else A2M8(ser=simulated)
+    if isinstance(lidar, A2M8):
+        lidar.run()
+    result = replay(lidar, revolutions)
+    result['line_bytes_per_second'] = simulated.position / result['seconds'] if result['seconds'] else 0.0
+    return result, lidar
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated STL27L or A2M8 serial stream: decoded by the real '
+                                                 'driver as a load test, served on a pty or written as a capture')
+    parser.add_argument('sensor', choices=sorted(POINTS_PER_REVOLUTION))
+    parser.add_argument('--speed', type=float, default=0, help='1 = real time, 0 = as fast as possible')
+    parser.add_argument('--noise', type=float, default=RANGE_NOISE, help='range noise sigma in mm')
+    parser.add_argument('--crc', type=float, default=0.0, help='fraction of frames with a corrupted byte')
+    parser.add_argument('--drop', type=float, default=0.0, help='fraction of frames losing a run of bytes')
+    parser.add_argument('--points', type=int, default=None, help='points per revolution')
+    parser.add_argument('--scene', default='room', help="'room' or a scan file")
+    parser.add_argument('--revolutions', type=int, default=100)
+    parser.add_argument('--pty', action='store_true', help='serve on a pseudo terminal until interrupted')
+    parser.add_argument('--link', default=None, help='symlink to the pty, e.g. /tmp/ttySTL27L')
+    parser.add_argument('--capture', default=None, help='write the stream of --revolutions to this file')
+    args = parser.parse_args()
+    simulated = serial_for_url(f"{SIMULATOR_SCHEME}://{args.sensor}?speed={args.speed}&noise={args.noise}"
+                               f"&crc={args.crc}&drop={args.drop}&points={args.points or 0}&scene={args.scene}",
+                               timeout=1)
+    if args.pty:
+        serve_pty(simulated, args.link)
+    elif args.capture:
+        # From the first frame or packet on, as the replay tools expect
+        with open(args.capture, mode='wb') as file:
+            for _ in range(args.revolutions):
+                file.write(simulated.next_revolution())
+        print(f"{args.revolutions} revolutions written to {args.capture}, {simulated.counters}")
+    else:
+        result, lidar = load_test(simulated, args.revolutions)
+        print(result)
+        print(f"simulator: {simulated.counters}")
+        print(f"decoder: {lidar.frame_counters}")
@@ -0,0 +1,161 @@
+import numpy as np
+
+# Largest distance in mm of a point from its line, and from the next point of the same segment; both grow with
+# the range, as the noise and the spacing of the points do
+LINE_THRESHOLD = 30.0
+RANGE_THRESHOLD = 0.015
+MAX_GAP = 300.0
+RANGE_GAP = 0.05
+MIN_SEGMENT_POINTS = 8
+# Segments meet at a corner when their ends are at most this far from the intersection of their lines
+MAX_CORNER_DISTANCE = 200.0
+
+
+def tls_lines(n, sx, sy, sxx, syy, sxy):
+    # Total least squares from the sums of x, y, x^2, y^2 and xy of n points (scalars or arrays): the line through
+    # the centroid along the principal direction of the 2x2 covariance, in closed form like
+    # ICP_function.estimate_normals. Returns centroids, unit directions, unit normals and the RMS of the
+    # orthogonal residuals
+    centroid = np.stack((sx / n, sy / n), axis=-1)
+    cxx = sxx - sx * sx / n
+    cyy = syy - sy * sy / n
+    cxy = sxy - sx * sy / n
+    angle = 0.5 * np.arctan2(2 * cxy, cxx - cyy)
+    direction = np.stack((np.cos(angle), np.sin(angle)), axis=-1)
+    normal = np.stack((-np.sin(angle), np.cos(angle)), axis=-1)
+    # The smaller eigenvalue is the sum of squared residuals
+    smallest = (cxx + cyy) / 2 - np.hypot((cxx - cyy) / 2, cxy)
+    return centroid, direction, normal, np.sqrt(np.maximum(smallest, 0) / n)
+
+
+def running_sums(points):
+    # Sums of every run start:end of the points are sums[end] - sums[start]
+    x, y = points[:, 0], points[:, 1]
+    sums = np.zeros((6, len(points) + 1))
+    np.cumsum(np.stack((np.ones(len(points)), x, y, x * x, y * y, x * y)), axis=1, out=sums[:, 1:])
+    return sums
+
+
+def scan_order(points):
+    # Points by bearing from the sensor, starting after the widest empty sector so no wall is cut at +-180 degrees
+    angles = np.arctan2(points[:, 1], points[:, 0])
+    order = np.argsort(angles)
+    gaps = np.diff(np.r_[angles[order], angles[order[0]] + 2 * np.pi])
+    return np.roll(order, -(int(np.argmax(gaps)) + 1))
+
+
+def chord_distances(x, y):
+    # Distance of every point from the line through the first and the last one
+    x0, y0, dx, dy = x[0], y[0], x[-1] - x[0], y[-1] - y[0]
+    length = np.hypot(dx, dy)
+    if length == 0:
+        return np.hypot(x - x0, y - y0)
+    return np.abs(dx * (y - y0) - dy * (x - x0)) / length
+
+
+def gap_breaks(points, max_gap):
+    # Indices of the points that start a new run: farther than max_gap (one value per point) from the one before
+    return np.flatnonzero(np.hypot(*np.diff(points, axis=0).T) > max_gap[1:]) + 1
+
+
+def split_ranges(points, tolerance, breaks, min_points):
+    # Split: cut at the breaks, then cut every run at the point farthest beyond its tolerance from the chord until
+    # all points are near it
+    stack = list(zip(np.r_[0, breaks].tolist(), np.r_[breaks, len(points)].tolist()))
+    x, y = points[:, 0], points[:, 1]
+    ranges = []
+    while stack:
+        start, end = stack.pop()
+        # Splitting never makes a run longer
+        if end - start < min_points:
+            continue
+        excess = chord_distances(x[start:end], y[start:end]) - tolerance[start:end]
+        farthest = int(np.argmax(excess))
+        if excess[farthest] > 0 and 0 < farthest < end - start - 1:
+            # The corner point belongs to both sides
+            stack.append((start + farthest, end))
+            stack.append((start, start + farthest + 1))
+        else:
+            ranges.append((start, end))
+    return sorted(ranges)
+
+
+def merge_ranges(points, sums, ranges, tolerance):
+    # Merge: neighbouring runs on one line (a split caused by noise) become one segment again. Only runs sharing
+    # the point they were split at, never across a break
+    merged = []
+    for start, end in ranges:
+        if merged and merged[-1][1] > start:
+            previous_start = merged[-1][0]
+            centroid, _, normal, _ = tls_lines(*(sums[:, end] - sums[:, previous_start]))
+            residuals = np.dot(points[previous_start:end] - centroid, normal)
+            if np.all(np.abs(residuals) <= tolerance[previous_start:end]):
+                merged[-1] = (previous_start, end)
+                continue
+        merged.append((start, end))
+    return merged
+
+
+def extract_lines(points, threshold=LINE_THRESHOLD, max_gap=MAX_GAP, min_points=MIN_SEGMENT_POINTS, ordered=True,
+                  breaks=None):
+    # Split-and-merge line segments of points in scan order (a revolution, or a slice with ordered=False), in mm
+    # around the sensor. Breaks of ordered points can come from elsewhere, by default they are the gaps. Each
+    # segment: original indices, TLS line, endpoints projected on the line, length and RMS
+    points = np.asarray(points, dtype=float)[:, :2]
+    order = np.arange(len(points)) if ordered else scan_order(points)
+    points = points[order]
+    if len(points) < min_points:
+        return []
+    ranges = np.hypot(points[:, 0], points[:, 1])
+    tolerance = np.maximum(threshold, RANGE_THRESHOLD * ranges)
+    if breaks is None or not ordered:
+        breaks = gap_breaks(points, np.maximum(max_gap, RANGE_GAP * ranges))
+    sums = running_sums(points)
+    runs = merge_ranges(points, sums, split_ranges(points, tolerance, breaks, min_points), tolerance)
+    if not runs:
+        return []
+    starts, ends = np.array(runs).T
+    centroids, directions, normals, rms = tls_lines(*(sums[:, ends] - sums[:, starts]))
+    # The extent of every segment along its line
+    along = np.stack([np.sum((points[starts] - centroids) * directions, axis=1),
+                      np.sum((points[ends - 1] - centroids) * directions, axis=1)])
+    endpoints = centroids + along[..., np.newaxis] * directions
+    lengths = np.abs(along[1] - along[0])
+    return [{'indices': order[start:end], 'centroid': centroid, 'direction': direction, 'normal': normal,
+             'rms': float(error), 'endpoints': np.array([first, last]), 'length': float(length)}
+            for start, end, centroid, direction, normal, error, first, last, length in
+            zip(starts, ends, centroids, directions, normals, rms, endpoints[0], endpoints[1], lengths)]
+
+
+def intersection(first, second):
+    # Point where the lines of two segments cross, None for parallel lines
+    (dx1, dy1), (dx2, dy2) = first['direction'], second['direction']
+    determinant = dx1 * dy2 - dy1 * dx2
+    if abs(determinant) < 1e-9:
+        return None
+    ox, oy = second['centroid'] - first['centroid']
+    return first['centroid'] + (ox * dy2 - oy * dx2) / determinant * first['direction']
+
+
+def corner_angle(first, second):
+    # Angle between two walls in degrees, 0-180, measured at the intersection of their lines towards each wall
+    # (an L-profile gives 90). None for parallel walls
+    corner = intersection(first, second)
+    if corner is None:
+        return None, None
+    (x1, y1), (x2, y2) = first['centroid'] - corner, second['centroid'] - corner
+    return float(np.degrees(abs(np.arctan2(x1 * y2 - y1 * x2, x1 * x2 + y1 * y2)))), corner
+
+
+def find_corners(segments, max_distance=MAX_CORNER_DISTANCE):
+    # Corners between segments that follow each other and whose near ends reach the intersection of their lines.
+    # 'segments' are the positions of the two in the list
+    corners = []
+    for k, (first, second) in enumerate(zip(segments[:-1], segments[1:])):
+        angle, corner = corner_angle(first, second)
+        if corner is None:
+            continue
+        if np.hypot(*(first['endpoints'][1] - corner)) <= max_distance and \
+                np.hypot(*(second['endpoints'][0] - corner)) <= max_distance:
+            corners.append({'point': corner, 'angle_deg': angle, 'segments': (k, k + 1)})
+    return corners
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import struct
+import numpy as np
+
+# 64-byte header: magic, version, column flags, point count, timestamp, units, sensor name
+SCAN_MAGIC = b'LSCAN\x00'
+SCAN_VERSION = 1
+SCAN_EXTENSION = '.lscan'
+SCAN_HEADER = struct.Struct('<6sHHQd8s30s')
+# x and y are always stored, the remaining columns are optional
+OPTIONAL_COLUMNS = {'angle': 1, 'distance': 2, 'quality': 4}
+SENSOR_PREFIXES = {'S': 'Slamtec-A2M8-R5', 'W': 'Waveshare-STL27L'}
+
+
+def save_scan(filename, x, y, sensor='', timestamp=None, units='mm', angle=None, distance=None, quality=None):
+    optional = {'angle': angle, 'distance': distance, 'quality': quality}
+    flags = 0
+    columns = [x, y]
+    for name, bit in OPTIONAL_COLUMNS.items():
+        if optional[name] is not None:
+            flags |= bit
+            columns.append(optional[name])
+    if timestamp is None:
+        timestamp = time.time()
+    header = SCAN_HEADER.pack(SCAN_MAGIC, SCAN_VERSION, flags, len(x), timestamp, units.encode()[:8],
+                              sensor.encode()[:30])
+    with open(filename, mode='wb') as file:
+        file.write(header)
+        for column in columns:
+            file.write(np.asarray(column, dtype='<f4').tobytes())
+
+
+def read_scan_header(filename):
+    with open(filename, mode='rb') as file:
+        magic, version, flags, count, timestamp, units, sensor = SCAN_HEADER.unpack(file.read(SCAN_HEADER.size))
+    if magic != SCAN_MAGIC:
+        raise ValueError(f"{filename} is not a scan file")
+    if version > SCAN_VERSION:
+        raise ValueError(f"{filename} has unsupported scan format version {version}")
+    return {'flags': flags, 'count': count, 'timestamp': timestamp, 'units': units.rstrip(b'\x00').decode(),
+            'sensor': sensor.rstrip(b'\x00').decode()}
+
+
+def load_scan(filename):
+    # Zero-copy: every column is a read-only view into the memory-mapped file
+    header = read_scan_header(filename)
+    names = ['x', 'y'] + [name for name, bit in OPTIONAL_COLUMNS.items() if header['flags'] & bit]
+    if header['count'] == 0:
+        data = np.empty((len(names), 0), dtype='<f4')
+    else:
+        data = np.memmap(filename, dtype='<f4', mode='r', offset=SCAN_HEADER.size,
+                         shape=(len(names), header['count']))
+    header.update(zip(names, data))
+    return header
+
+
+def is_scan_file(filename):
+    return filename.endswith(SCAN_EXTENSION)
+
+
+def load_cloud(filename):
+    # (N, 2) float64 cloud from either a CSV or a binary scan file. Not zero-copy: the stored float32 columns are
+    # copied once into rows, as the analysis code needs contiguous points in double precision (line fits sum
+    # squared millimetres). load_scan gives the memory-mapped columns without a copy
+    if is_scan_file(filename):
+        scan = load_scan(filename)
+        cloud = np.empty((len(scan['x']), 2))
+        cloud[:, 0] = scan['x']
+        cloud[:, 1] = scan['y']
+        return cloud
+    return np.loadtxt(filename, delimiter=',', ndmin=2)
+
+
+def csv_scan_info(filename):
+    # Sensor and timestamp from names like W_scan_20240526-125233.csv, file time otherwise
+    name = os.path.basename(filename)
+    sensor = SENSOR_PREFIXES.get(name.split('_')[0], '')
+    try:
+        timestamp = time.mktime(time.strptime(os.path.splitext(name)[0].split('_scan_')[1], "%Y%m%d-%H%M%S"))
+    except (IndexError, ValueError):
+        timestamp = os.path.getmtime(filename)
+    return sensor, timestamp
+
+
+def convert_csv_tree(root='Scans', remove_csv=False):
+    converted = 0
+    for directory, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if not file_name.endswith('.csv'):
+                continue
+            csv_filename = os.path.join(directory, file_name)
+            cloud = load_cloud(csv_filename)
+            if cloud.shape[1] < 2:
+                cloud = np.empty((0, 2))
+            sensor, timestamp = csv_scan_info(csv_filename)
+            save_scan(os.path.splitext(csv_filename)[0] + SCAN_EXTENSION, cloud[:, 0], cloud[:, 1], sensor, timestamp)
+            if remove_csv:
+                os.remove(csv_filename)
+            converted += 1
+    return converted
+
+
+if __name__ == '__main__':
+    for tree in sys.argv[1:] or ['Scans']:
+        print(f"{tree}: converted {convert_csv_tree(tree)} files")
@@ -0,0 +1,177 @@
+import os
+import time
+import struct
+import threading
+from queue import Queue, Full, Empty
+import numpy as np
+
+# Session log: file header, then self-describing revolution records appended in batches
+LOG_MAGIC = b'LSLOG\x00'
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<6sHd')
+RECORD_MAGIC = b'LREV'
+# magic, point count, monotonic timestamp, revolution index, sensor id - padded so the columns stay aligned
+RECORD_HEADER = struct.Struct('<4sIdQB7x')
+RECORD_COLUMNS = ('angle', 'distance', 'X', 'Y')
+INDEX_EXTENSION = '.idx'
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('timestamp', '<f8'), ('index', '<u8'), ('count', '<u4'),
+                        ('sensor', 'u1')])
+SENSOR_IDS = {'Slamtec-A2M8-R5': 1, 'Waveshare-STL27L': 2}
+
+
+class ScanRecorder:
+    def __init__(self, filename, queue_size=512, batch_size=32, flush_interval=0.5, buffer_size=1 << 20):
+        self.filename = filename
+        self.queue = Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.stats = {'recorded': 0, 'dropped': 0, 'queue_high_water': 0, 'batches': 0, 'bytes': 0,
+                      'write_time': 0.0, 'max_batch_time': 0.0}
+        # The writer and the acquisition threads update the stats while the GUI reads them
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ScanRecorder', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def add_revolution(self, sensor, revolution_index, timestamp, revolution):
+        # Called from the acquisition threads - never blocks, a full queue is counted as dropped
+        columns = np.stack([revolution[name] for name in RECORD_COLUMNS]).astype('<f4', copy=False)
+        try:
+            self.queue.put_nowait((SENSOR_IDS.get(sensor, 0), revolution_index, timestamp, columns))
+        except Full:
+            self.count_dropped()
+            return False
+        with self.stats_lock:
+            self.stats['queue_high_water'] = max(self.stats['queue_high_water'], self.queue.qsize())
+        return True
+
+    def count_dropped(self, n=1):
+        # Revolutions that never reached the queue, also those lost before add_revolution
+        with self.stats_lock:
+            self.stats['dropped'] += n
+
+    def snapshot(self):
+        # Consistent copy of the stats for another thread
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def run(self):
+        new_file = not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0
+        with open(self.filename, mode='ab', buffering=self.buffer_size) as log, \
+                open(self.filename + INDEX_EXTENSION, mode='ab') as index:
+            if new_file:
+                log.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, time.time()))
+            offset = log.tell()
+            running = True
+            while running:
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except Empty:
+                        break
+                    if item is None:
+                        running = False
+                        break
+                    batch.append(item)
+                if batch:
+                    offset = self.write_batch(log, index, batch, offset)
+
+    def write_batch(self, log, index, batch, offset):
+        start_time = time.perf_counter()
+        entries = np.zeros(len(batch), dtype=INDEX_DTYPE)
+        parts = []
+        for i, (sensor, revolution_index, timestamp, columns) in enumerate(batch):
+            count = columns.shape[1]
+            entries[i] = (offset, timestamp, revolution_index, count, sensor)
+            parts.append(RECORD_HEADER.pack(RECORD_MAGIC, count, timestamp, revolution_index, sensor))
+            parts.append(columns.tobytes())
+            offset += RECORD_HEADER.size + columns.nbytes
+        data = b''.join(parts)
+        log.write(data)
+        log.flush()
+        # The index only points at records that are already on disk
+        index.write(entries.tobytes())
+        index.flush()
+
+        batch_time = time.perf_counter() - start_time
+        with self.stats_lock:
+            self.stats['recorded'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['bytes'] += len(data)
+            self.stats['write_time'] += batch_time
+            self.stats['max_batch_time'] = max(self.stats['max_batch_time'], batch_time)
+        return offset
+
+
+def index_matches(index, filename):
+    # The last record the index points at has to end where the log ends - a shorter index lost its last batch,
+    # a longer one belongs to a truncated log
+    end = LOG_HEADER.size
+    if len(index):
+        last = index[-1]
+        end = int(last['offset']) + RECORD_HEADER.size + int(last['count']) * len(RECORD_COLUMNS) * 4
+    return end == os.path.getsize(filename)
+
+
+def rebuild_index(filename):
+    # Walks the records of a log whose index is missing or does not match it
+    entries = []
+    with open(filename, mode='rb') as log:
+        offset = LOG_HEADER.size
+        log.seek(offset)
+        while True:
+            header = log.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            magic, count, timestamp, revolution_index, sensor = RECORD_HEADER.unpack(header)
+            size = RECORD_HEADER.size + count * len(RECORD_COLUMNS) * 4
+            if magic != RECORD_MAGIC or offset + size > os.path.getsize(filename):
+                break
+            entries.append((offset, timestamp, revolution_index, count, sensor))
+            offset += size
+            log.seek(offset)
+    index = np.array(entries, dtype=INDEX_DTYPE)
+    index.tofile(filename + INDEX_EXTENSION)
+    return index
+
+
+class RecordingReader:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, mode='rb') as log:
+            magic, version, self.start_time = LOG_HEADER.unpack(log.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{filename} is not a recording")
+        index_filename = filename + INDEX_EXTENSION
+        self.index = None
+        if os.path.exists(index_filename) and os.path.getsize(index_filename) % INDEX_DTYPE.itemsize == 0:
+            self.index = np.fromfile(index_filename, dtype=INDEX_DTYPE)
+        if self.index is None or not index_matches(self.index, filename):
+            self.index = rebuild_index(filename)
+        self.data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, i):
+        entry = self.index[i]
+        start = int(entry['offset']) + RECORD_HEADER.size
+        columns = self.data[start:start + int(entry['count']) * len(RECORD_COLUMNS) * 4].view('<f4')
+        revolution = dict(zip(RECORD_COLUMNS, columns.reshape(len(RECORD_COLUMNS), -1)))
+        revolution.update(timestamp=float(entry['timestamp']), index=int(entry['index']),
+                          sensor=int(entry['sensor']))
+        return revolution
+
+    def sensor_revolutions(self, sensor):
+        return np.flatnonzero(self.index['sensor'] == SENSOR_IDS.get(sensor, sensor))
@@ -0,0 +1,270 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import numpy as np
+from Scan_format import load_cloud, is_scan_file
+from Line_extraction import extract_lines, find_corners, corner_angle
+
+# Bumped whenever a metric changes, so cached results of older code are computed again
+METRICS_VERSION = 3
+# A slice has few points on a narrow flange far from the sensor
+ANGLE_MIN_POINTS = 4
+# Sides closer to parallel than this (degrees) are one wall, not the two sides of a corner
+ANGLE_MIN_SIDES_ANGLE = 20.0
+CACHE_FILE = '.slice_metrics_cache.json'
+REPORT_COLUMNS = ['file', 'points', 'rmse', 'correlation_coefficient', 'longest_distance', 'distance_to_lidar',
+                  'angle_deg', 'error', 'content_hash']
+
+
+def fit_line(x, y):
+    # Least squares y = slope * x + intercept, as sklearn's LinearRegression; vertical data gets slope 0 like it
+    x_mean, y_mean = x.mean(), y.mean()
+    sxx = np.sum((x - x_mean) ** 2)
+    slope = np.sum((x - x_mean) * (y - y_mean)) / sxx if sxx > 0 else 0.0
+    return slope, y_mean - slope * x_mean
+
+
+def cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def cross_xy(o, a, b):
+    # Same for two-element lists - the hull loops run on Python floats, much faster than on NumPy scalars
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def hull_candidates(points):
+    # Akl-Toussaint: points strictly inside the polygon of the extreme points in x, y, x + y and x - y can not be
+    # hull vertices. For a profile that leaves a handful of points for the monotone chain
+    directions = np.array([[1, 0], [1, 1], [0, 1], [-1, 1], [-1, 0], [-1, -1], [0, -1], [1, -1]])
+    extremes = np.argmax(points @ directions.T, axis=0)
+    # Directions are in counter-clockwise order, so are their extreme points; repeated ones are dropped
+    extremes = extremes[np.r_[True, extremes[1:] != extremes[:-1]]]
+    if len(extremes) > 1 and extremes[0] == extremes[-1]:
+        extremes = extremes[:-1]
+    polygon = points[extremes]
+    if len(polygon) < 3:
+        return np.arange(len(points))
+    inside = np.ones(len(points), dtype=bool)
+    for a, b in zip(polygon, np.roll(polygon, -1, axis=0)):
+        inside &= cross(a, b, points) > 0
+    return np.flatnonzero(~inside)
+
+
+def convex_hull(points):
+    # Indices of the hull vertices in counter-clockwise order (Andrew's monotone chain), collinear points left out
+    candidates = hull_candidates(points)
+    candidates = candidates[np.lexsort((points[candidates, 1], points[candidates, 0]))]
+    candidate_points = points[candidates].tolist()
+    hull = []
+    for half in (range(len(candidates)), range(len(candidates) - 1, -1, -1)):
+        chain = []
+        for k in half:
+            while len(chain) >= 2 and cross_xy(candidate_points[chain[-2]], candidate_points[chain[-1]],
+                                               candidate_points[k]) <= 0:
+                chain.pop()
+            chain.append(k)
+        hull.extend(chain[:-1])
+    # A single point or duplicates of it have no chain left
+    return candidates[hull] if hull else candidates[:1]
+
+
+def diameter(points):
+    # Largest distance between two points with rotating calipers over the convex hull: linear memory,
+    # O(n log n) time. Returns the distance and the point indices np.argmax over the full distance matrix gives
+    hull = convex_hull(points)
+    hull_points = points[hull].tolist()
+    m = len(hull)
+    if m < 3:
+        pairs = [(0, m - 1)]
+    else:
+        # For every hull edge the vertex farthest from it, found by walking round once
+        pairs = []
+        j = 1
+        for i in range(m):
+            following = (i + 1) % m
+            while cross_xy(hull_points[i], hull_points[following], hull_points[(j + 1) % m]) > \
+                    cross_xy(hull_points[i], hull_points[following], hull_points[j]):
+                j = (j + 1) % m
+            pairs.extend(((i, j), (following, j)))
+    pairs = np.array(pairs)
+    # Same expression as the distance matrix, so pairs that tie up to rounding are ranked the same way
+    difference = points[hull[pairs[:, 0]]] - points[hull[pairs[:, 1]]]
+    lengths = np.sqrt(difference[:, 0] ** 2 + difference[:, 1] ** 2)
+    # Ties: the lowest index of any point at a longest pair's ends, then its lowest partner - the row-major argmax
+    best = pairs[lengths == lengths.max()]
+    first_index = {}
+    for end in np.unique(hull[best]):
+        first_index[end] = np.flatnonzero(np.all(points == points[end], axis=1))[0]
+    i, j = min(sorted((first_index[hull[a]], first_index[hull[b]])) for a, b in best)
+    return lengths.max(), i, j
+
+
+def slice_metrics(selected_slice):
+    x = selected_slice[:, 0]
+    y = selected_slice[:, 1]
+    # Linear regression
+    slope, intercept = fit_line(x, y)
+    y_pred = slope * x + intercept
+    # RMS error
+    rmse = np.sqrt(np.mean((y - y_pred) ** 2))
+    # Pearson correlation
+    correlation_matrix = np.corrcoef(y, y_pred)
+    correlation_coefficient = correlation_matrix[0, 1]
+    # Length (largest distance vector)
+    longest_distance, i, j = diameter(np.column_stack((x, y)))
+    point1 = (x[i], y[i])
+    point2 = (x[j], y[j])
+    # Distance (distance from lidar to point cloud centroid)
+    centroid_x = np.mean(x)
+    centroid_y = np.mean(y)
+    distance_to_lidar = np.sqrt(centroid_x ** 2 + centroid_y ** 2)
+
+    return {'x': x, 'y': y, 'y_pred': y_pred, 'rmse': rmse, 'correlation_coefficient': correlation_coefficient,
+            'longest_distance': longest_distance, 'point1': point1, 'point2': point2,
+            'distance_to_lidar': distance_to_lidar}
+
+
+def largest_sides(segments):
+    # The two segments with the most points that meet at a corner, as (angle, corner, first, second) in scan order
+    order = sorted(range(len(segments)), key=lambda k: len(segments[k]['indices']), reverse=True)
+    for k1, k2 in combinations(order, 2):
+        first, second = segments[min(k1, k2)], segments[max(k1, k2)]
+        angle, corner = corner_angle(first, second)
+        if angle is not None and ANGLE_MIN_SIDES_ANGLE <= angle <= 180 - ANGLE_MIN_SIDES_ANGLE:
+            return angle, corner, first, second
+    return None
+
+
+def angle_metrics(selected_slice):
+    # Sides of the profile found by split-and-merge in any orientation. A slice is one object, so sparse far
+    # points are not cut at gaps. The corner is the one between the neighbouring segments with the most points
+    # whose ends meet, otherwise between the two largest segments
+    segments = extract_lines(selected_slice, min_points=ANGLE_MIN_POINTS, ordered=False, max_gap=np.inf)
+    corners = find_corners(segments)
+    if corners:
+        corner = max(corners, key=lambda corner: sum(len(segments[k]['indices']) for k in corner['segments']))
+        angle, point = corner['angle_deg'], corner['point']
+        first, second = (segments[k] for k in corner['segments'])
+    else:
+        sides = largest_sides(segments)
+        if sides is None:
+            raise ValueError('No two sides found in the slice')
+        angle, point, first, second = sides
+    x1, y1 = selected_slice[first['indices'], 0], selected_slice[first['indices'], 1]
+    x2, y2 = selected_slice[second['indices'], 0], selected_slice[second['indices'], 1]
+    # Fitted sides from their far ends to the corner
+    far1 = max(first['endpoints'], key=lambda end: np.hypot(*(end - point)))
+    far2 = max(second['endpoints'], key=lambda end: np.hypot(*(end - point)))
+    line1 = np.array([far1, point])
+    line2 = np.array([point, far2])
+
+    # Reported as the acute angle between the lines of the sides, 0-90 degrees
+    return {'x1': x1, 'y1': y1, 'line1': line1, 'x2': x2, 'y2': y2, 'line2': line2, 'corner': point,
+            'angle_deg': min(angle, 180 - angle)}
+
+
+def content_hash(filename):
+    with open(filename, mode='rb') as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+def file_metrics(filename):
+    # One report row; the angle is only meaningful for L-shaped profiles, slices without a corner leave it empty
+    try:
+        selected_slice = load_cloud(filename)
+        metrics = slice_metrics(selected_slice)
+        try:
+            angle_deg = float(angle_metrics(selected_slice)['angle_deg'])
+        except ValueError:
+            angle_deg = ''
+    except Exception as error:
+        return {'points': 0, 'error': str(error) or type(error).__name__}
+    return {'points': len(selected_slice), 'rmse': float(metrics['rmse']),
+            'correlation_coefficient': float(metrics['correlation_coefficient']),
+            'longest_distance': float(metrics['longest_distance']),
+            'distance_to_lidar': float(metrics['distance_to_lidar']), 'angle_deg': angle_deg, 'error': ''}
+
+
+def find_slices(paths):
+    # Files, directories (searched recursively) and glob patterns, each file once, in name order
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = glob.glob(os.path.join(path, '**', '*'), recursive=True)
+        else:
+            candidates = glob.glob(path, recursive=True)
+        filenames.update(filename for filename in candidates if os.path.isfile(filename) and
+                         (filename.endswith('.csv') or is_scan_file(filename)))
+    return sorted(filenames)
+
+
+def load_cache(filename):
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename) as file:
+        cache = json.load(file)
+    return cache['results'] if cache.get('version') == METRICS_VERSION else {}
+
+
+def save_cache(filename, results):
+    # Written next to the old cache and swapped in, so an interrupted run never leaves a broken file
+    temporary = f'{filename}.tmp'
+    with open(temporary, mode='w') as file:
+        json.dump({'version': METRICS_VERSION, 'results': results}, file)
+    os.replace(temporary, filename)
+
+
+def batch_metrics(filenames, cache_file=CACHE_FILE, max_workers=None):
+    # Results keyed by file content: renamed or copied slices are not computed again either
+    cache = load_cache(cache_file)
+    hashes = [content_hash(filename) for filename in filenames]
+    missing = sorted({file_hash: filename for filename, file_hash in zip(filenames, hashes)
+                      if file_hash not in cache}.items())
+    missing_files = [filename for _, filename in missing]
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(missing), 1))
+    if max_workers == 1:
+        computed = [file_metrics(filename) for filename in missing_files]
+    else:
+        with ProcessPoolExecutor(max_workers) as pool:
+            computed = list(pool.map(file_metrics, missing_files, chunksize=4))
+    cache.update((file_hash, result) for (file_hash, _), result in zip(missing, computed))
+    if cache_file and missing:
+        save_cache(cache_file, cache)
+    rows = [dict(cache[file_hash], file=filename, content_hash=file_hash)
+            for filename, file_hash in zip(filenames, hashes)]
+    return rows, len(missing)
+
+
+def write_report(filename, rows):
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=REPORT_COLUMNS, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Slice metrics (RMSE, Pearson, length, distance, angle) for '
+                                                 'every slice in directories, files or glob patterns')
+    parser.add_argument('paths', nargs='*', default=['Slices'])
+    parser.add_argument('--output', default='slice_report.csv', help='CSV report, one row per slice')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default: one per CPU')
+    parser.add_argument('--cache', default=CACHE_FILE, help='results of earlier runs, keyed by file content')
+    parser.add_argument('--no-cache', action='store_true', help='compute every slice again')
+    args = parser.parse_args()
+    slices = find_slices(args.paths)
+    if not slices:
+        sys.exit(f"No slices in {' '.join(args.paths)}")
+    start_time = time.perf_counter()
+    report, computed_count = batch_metrics(slices, None if args.no_cache else args.cache, args.workers)
+    write_report(args.output, report)
+    failed = sum(1 for row in report if row['error'])
+    print(f"{len(report)} slices, {computed_count} computed, {len(report) - computed_count} from the cache or "
+          f"identical to another slice, {failed} failed, {time.perf_counter() - start_time:.2f} s -> {args.output}")
@@ -0,0 +1,19 @@
+import pytest
+from Lidar_simulator import SimulatedSerial
+from Lidar_classes import A2M8_PACKET_SIZE
+from Benchmarks.bench_a2m8_decoder import legacy_decode, vectorized_decode, compare
+
+
+def simulated_stream(revolutions):
+    simulated = SimulatedSerial('A2M8', speed=0)
+    return b''.join(simulated.next_revolution() for _ in range(revolutions))
+
+
+@pytest.mark.parametrize('chunk_size', [None, A2M8_PACKET_SIZE, 16 * A2M8_PACKET_SIZE])
+def test_revolutions_match_the_loop(chunk_size):
+    stream = simulated_stream(6)
+    legacy = legacy_decode(stream)
+    revolutions = vectorized_decode(stream, chunk_size)
+    assert len(revolutions) == len(legacy) >= 5
+    # Largest point deviation in mm - float32 columns against the float64 loop
+    assert compare(legacy, revolutions) < 0.01
@@ -0,0 +1,55 @@
+import numpy as np
+from Lidar_classes import A2M8, A2M8_PACKET_SIZE, A2M8_POINTS_PER_PACKET, find_a2m8_packets
+from Lidar_replay import ReplaySerial
+from Lidar_simulator import encode_a2m8_packets
+
+
+def make_packets(n_packets):
+    start_angles = np.arange(n_packets) * 30.0
+    distances = np.tile(np.linspace(1000, 2000, A2M8_POINTS_PER_PACKET), (n_packets, 1))
+    return bytearray(encode_a2m8_packets(start_angles, distances, np.zeros_like(distances)))
+
+
+def test_aligned_packets():
+    starts, n_corrupt = find_a2m8_packets(make_packets(5))
+    assert starts.tolist() == [k * A2M8_PACKET_SIZE for k in range(5)]
+    assert n_corrupt == 0
+
+
+def test_corrupt_packet():
+    stream = make_packets(5)
+    stream[2 * A2M8_PACKET_SIZE + 40] ^= 0xFF
+    starts, n_corrupt = find_a2m8_packets(stream)
+    assert starts.tolist() == [k * A2M8_PACKET_SIZE for k in (0, 1, 3, 4)]
+    assert n_corrupt >= 1
+
+
+def test_resync_after_dropped_bytes():
+    stream = make_packets(6)
+    del stream[2 * A2M8_PACKET_SIZE + 10:2 * A2M8_PACKET_SIZE + 13]
+    lidar = A2M8(ser=ReplaySerial(b''))
+    lidar.packet_buffer += stream
+    packets, follows = lidar.take_packets()
+    clean = np.frombuffer(bytes(make_packets(6)), dtype=np.uint8).reshape(-1, A2M8_PACKET_SIZE)
+    assert np.array_equal(packets, clean[[0, 1, 3, 4, 5]])
+    # The packet after the lost one has no known start angle before it
+    assert follows.tolist() == [True, True, False, True, True]
+    assert lidar.frame_counters['skipped_bytes'] == A2M8_PACKET_SIZE - 3
+    assert len(lidar.packet_buffer) == 0
+
+
+def test_driver_decodes_after_a_lost_packet():
+    clean = make_packets(40)
+    stream = clean[:10 * A2M8_PACKET_SIZE + 5] + clean[11 * A2M8_PACKET_SIZE:]
+    results = []
+    for data in (clean, stream):
+        lidar = A2M8(ser=ReplaySerial(bytes(data)))
+        previous_angle = previous_start_angle = 0
+        while lidar.ser.in_waiting:
+            _, previous_angle, previous_start_angle = lidar.make_full_scan(previous_angle, previous_start_angle)
+        results.append(lidar)
+    assert results[1].frame_counters['valid'] == 39
+    # Every revolution starts at the same angle, the lost packet only leaves a hole
+    for lidar in results:
+        for index in range(lidar.revolution_buffer.latest + 1):
+            assert lidar.revolution_buffer.view(index)['angle'][0] < 30
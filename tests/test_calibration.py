@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+from Lidar_calibration import robust_average
+
+
+def test_robust_average_of_agreeing_pairs():
+    params = np.array([[10.0, -5.0, 0.01], [10.2, -5.1, 0.011], [9.8, -4.9, 0.009]])
+    mean, std, keep = robust_average(params, np.array([2.0, 2.1, 1.9]))
+    assert keep.all()
+    assert np.allclose(mean, [10.0, -5.0, 0.01])
+
+
+def test_robust_average_without_aligned_pair():
+    params = np.zeros((3, 3))
+    with pytest.raises(ValueError):
+        robust_average(params, np.full(3, np.inf))
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from matplotlib.path import Path
+from Cloud_index import GridIndex
+
+
+def cloud(n_points=20000, seed=0):
+    # Dense walls and sparse clutter, so the grid has full and empty cells
+    rng = np.random.default_rng(seed)
+    t = rng.uniform(-5000, 5000, n_points)
+    walls = np.column_stack((t, np.where(rng.random(n_points) < 0.5, 3000.0, -2000.0) + rng.normal(0, 5, n_points)))
+    return np.r_[walls, rng.uniform(-6000, 6000, (n_points // 10, 2))]
+
+
+@pytest.mark.parametrize('rect', [(-1000, -2500, 2500, 3100), (4000, 3200, -200, -1900), (-9000, -9000, -8000, -8000),
+                                  (0, 0, 0, 0), (-7000, -7000, 7000, 7000)])
+def test_rectangle_matches_a_full_mask(rect):
+    points = cloud()
+    x1, y1, x2, y2 = rect
+    x_min, x_max, y_min, y_max = min(x1, x2), max(x1, x2), min(y1, y2), max(y1, y2)
+    mask = (points[:, 0] >= x_min) & (points[:, 0] <= x_max) & (points[:, 1] >= y_min) & (points[:, 1] <= y_max)
+    assert np.array_equal(GridIndex(points).points_in_rect(*rect), np.flatnonzero(mask))
+
+
+def test_polygon_matches_a_full_mask():
+    points = cloud()
+    vertices = np.array([[-4000, -2500], [3000, -2200], [4500, 3500], [0, 1000], [-3500, 3300]])
+    mask = Path(vertices).contains_points(points)
+    assert mask.any() and np.array_equal(GridIndex(points).points_in_polygon(vertices), np.flatnonzero(mask))
+
+
+def test_view_of_everything_zoomed_in():
+    points = cloud(2000)
+    view = GridIndex(points).view(-7000, 7000, -7000, 7000, 4000, 4000)
+    assert len(view) == len(points)
+
+
+def test_coarse_view_draws_real_points():
+    points = cloud()
+    view = GridIndex(points).view(-7000, 7000, -7000, 7000, 100, 100)
+    assert 0 < len(view) <= 100 * 100 / 4
+    assert set(map(tuple, view)) <= set(map(tuple, points))
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from ICP_function import icp, apply_transformation, invert_params
+
+
+def room(n_points=400, noise=1.0, seed=0):
+    # Three walls of different lengths, so no other pose fits them
+    rng = np.random.default_rng(seed)
+    t = rng.uniform(0, 1, n_points)
+    side = rng.integers(0, 3, n_points)
+    corners = np.array([[-1500.0, 2500.0], [2000.0, 2500.0], [2000.0, -800.0], [-1500.0, -800.0]])
+    points = corners[side] + t[:, np.newaxis] * (corners[side + 1] - corners[side])
+    return points + rng.normal(0, noise, points.shape)
+
+
+@pytest.mark.parametrize('method', ['point_to_point', 'point_to_line'])
+def test_converges_to_known_transform(method):
+    target = room()
+    true_params = np.array([60.0, -40.0, np.radians(8)])
+    source = apply_transformation(target, invert_params(true_params))
+    result = icp(source, target, method=method)
+    assert result['converged']
+    np.testing.assert_allclose(result['params'][:2], true_params[:2], atol=1.0)
+    assert result['params'][2] == pytest.approx(true_params[2], abs=np.radians(0.1))
+    assert result['rmse'] < 2.0
+    np.testing.assert_allclose(apply_transformation(source, result['params']), target, atol=2.0)
@@ -0,0 +1,73 @@
+import numpy as np
+from Lidar_classes import polar_to_cartesian
+from Lidar_features import FeaturePipeline, breakpoints, filter_points, euclidean_clusters
+from Lidar_simulator import Scene
+
+
+def test_no_breakpoints_on_a_wall():
+    angles = np.radians(np.arange(-30, 30, 0.5))
+    distances = 3000 / np.cos(angles)
+    assert breakpoints(angles, distances).size == 0
+
+
+def test_range_jump():
+    angles = np.radians(np.arange(0, 20, 0.5))
+    distances = np.where(np.arange(len(angles)) < 20, 2000.0, 6000.0)
+    assert breakpoints(angles, distances).tolist() == [20]
+
+
+def test_angular_hole_with_range_jump():
+    # 12 degrees without returns between a wall at 2 m and one at 6 m
+    angles = np.radians(np.r_[np.arange(0, 10, 0.5), np.arange(22, 32, 0.5)])
+    distances = np.r_[np.full(20, 2000.0), np.full(20, 6000.0)]
+    assert breakpoints(angles, distances).tolist() == [20]
+
+
+def test_angular_hole_on_one_wall():
+    angles = np.radians(np.r_[np.arange(-20, -6, 0.5), np.arange(6, 20, 0.5)])
+    assert breakpoints(angles, 3000 / np.cos(angles)).tolist() == [28]
+
+
+def test_intensity_filter_keeps_points_without_intensity():
+    revolution = {'X': np.arange(4.0), 'Y': np.zeros(4), 'angle': np.zeros(4),
+                  'distance': np.full(4, 1000.0), 'intensity': np.array([200, 5, np.nan, 10], dtype=np.float32)}
+    assert filter_points(revolution)['points'][:, 0].tolist() == [0, 2, 3]
+    assert len(filter_points(revolution, min_intensity=0)['points']) == 4
+
+
+def test_clusters_join_points_within_the_distance_only():
+    # Diagonal neighbours 210 mm apart, in neighbouring 150 mm cells
+    blob = np.random.default_rng(0).uniform(0, 5, (5, 2))
+    points = np.r_[blob, blob + 210, blob + [0, 2000]]
+    labels, clusters = euclidean_clusters(points, distance=150)
+    assert len(clusters) == 3 and len(set(labels[:5])) == 1 and labels[0] != labels[5]
+
+
+def test_clusters_chain():
+    points = np.column_stack((np.arange(20) * 100.0, np.zeros(20)))
+    labels, clusters = euclidean_clusters(np.r_[points, [[5000.0, 0]]], distance=150)
+    assert labels.tolist() == [0] * 20 + [-1] and clusters[0]['points'] == 20
+
+
+def room_revolution(intensity):
+    angles = np.arange(0, 360, 360 / 2160)
+    distances = Scene.room(n_pillars=0).ranges(angles)
+    x, y = polar_to_cartesian(angles, distances)
+    return {'X': x, 'Y': y, 'angle': angles, 'distance': distances, 'intensity': intensity(angles), 'timestamp': 1.5}
+
+
+def test_pipeline_on_a_room():
+    pipeline = FeaturePipeline(max_range=10000)
+    pipeline.add_stage('wall_count', lambda features: features.update(walls=len(features['lines'])))
+    # No return from a dark quarter of the room
+    features = pipeline.process(room_revolution(lambda angles: np.where(angles < 90, 2.0, 200.0)))
+    assert 'revolution' not in features and features['timestamp'] == 1.5
+    assert list(features['timings']) == ['filter', 'segments', 'lines', 'clusters', 'wall_count']
+    assert np.all(np.degrees(features['angle']) >= 90)
+    # The four room walls and the L-profile in front, one room corner is in the dark quarter
+    assert features['walls'] == len(features['lines']) == 5
+    assert len(features['corners']) == 3
+    # The room and the L-profile
+    assert sorted(cluster['points'] for cluster in features['clusters'])[0] < 50
+    assert len(features['clusters']) == 2 and features['labels'].max() == 1
+    assert pipeline.metrics()['revolutions'] == 1
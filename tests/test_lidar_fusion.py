@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from Lidar_classes import RevolutionBuffer
+from Lidar_fusion import RevolutionFuser
+
+
+def add(fuser, sensor, revolution_buffer, timestamp, x0):
+    angles = np.linspace(0, 90, 20)
+    revolution_buffer.append(angles, np.full(20, 1000.0))
+    revolution_buffer.x[(revolution_buffer.latest + 1) % revolution_buffer.capacity, :20] = x0 + np.arange(20)
+    return fuser.add(sensor, revolution_buffer, revolution_buffer.commit(timestamp), now=timestamp)
+
+
+def test_pairs_the_nearest_revolution():
+    fuser = RevolutionFuser((100.0, -50.0, 0.0))
+    a2m8, stl27l = RevolutionBuffer(4, 64), RevolutionBuffer(4, 64)
+    assert add(fuser, 'A2M8', a2m8, 1.00, 0.0) == []
+    assert add(fuser, 'A2M8', a2m8, 1.10, 500.0) == []
+    frames = add(fuser, 'STL27L', stl27l, 1.08, 2000.0)
+    assert len(frames) == 1
+    frame = frames[0]
+    assert frame['offset'] == pytest.approx(0.02)
+    assert frame['counts'] == {'A2M8': 20, 'STL27L': 20}
+    # The A2M8 revolution of 1.10 s as it is, the STL27L one moved by the extrinsics
+    reference, moved = frame['points'][:20], frame['points'][20:]
+    np.testing.assert_allclose(reference[:, 0], 500.0 + np.arange(20))
+    np.testing.assert_allclose(moved[:, 0], 2100.0 + np.arange(20))
+    np.testing.assert_allclose(moved[:, 1], stl27l.view(0)['Y'] - 50.0, rtol=1e-6)
+
+
+@pytest.mark.parametrize('offset, matched', [(0.04, True), (0.06, False)])
+def test_tolerance(offset, matched):
+    fuser = RevolutionFuser(tolerance=0.05)
+    a2m8, stl27l = RevolutionBuffer(4, 64), RevolutionBuffer(4, 64)
+    add(fuser, 'A2M8', a2m8, 1.0, 0.0)
+    frames = add(fuser, 'STL27L', stl27l, 1.0 + offset, 0.0)
+    # A later A2M8 revolution could still be nearer - settled once the tolerance has passed
+    frames += fuser.flush(now=2.0)
+    assert len(frames) == int(matched)
+    assert fuser.stats['unmatched'] == int(not matched)
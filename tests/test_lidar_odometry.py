@@ -0,0 +1,34 @@
+import numpy as np
+from ICP_function import apply_transformation, invert_params, wrap_angle
+from Lidar_classes import polar_to_cartesian
+from Lidar_odometry import ScanOdometry
+from Lidar_simulator import Scene
+
+
+def seen_from(scene, pose, angles, noise, rng):
+    # The scene in the sensor frame: pose takes sensor points into the scene frame
+    walls = apply_transformation(scene.walls.reshape(-1, 2), invert_params(pose)).reshape(-1, 2, 2)
+    pillars = np.column_stack((apply_transformation(scene.pillars[:, :2], invert_params(pose)), scene.pillars[:, 2]))
+    distances = Scene(walls, pillars).ranges(angles)
+    hit = distances > 0
+    return polar_to_cartesian(angles[hit], distances[hit] + rng.normal(0, noise, np.count_nonzero(hit)))
+
+
+def test_pose_error_on_a_synthetic_path():
+    rng = np.random.default_rng(0)
+    scene = Scene.room()
+    angles = np.arange(0, 360, 360 / 2160)
+    odometry = ScanOdometry()
+    pose = np.zeros(3)
+    poses = []
+    for i in range(40):
+        poses.append(pose.copy())
+        odometry.add_revolution(*seen_from(scene, pose, angles, 5.0, rng), i * 0.1)
+        # 40 mm forward and 1 degree to the side per revolution
+        pose = np.array([pose[0] + 40 * np.sin(-pose[2]), pose[1] + 40 * np.cos(-pose[2]), pose[2] + np.radians(1)])
+    trajectory = np.array(odometry.trajectory)[:, 1:]
+    assert len(trajectory) == 40 and odometry.stats['keyframes'] > 1
+    position_error = np.hypot(*(trajectory[:, :2] - np.array(poses)[:, :2]).T)
+    # 1.56 m travelled
+    assert position_error.max() < 10.0
+    assert abs(np.degrees(wrap_angle(trajectory[-1, 2] - poses[-1][2]))) < 0.1
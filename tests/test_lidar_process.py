@@ -0,0 +1,44 @@
+import time
+import numpy as np
+from Lidar_classes import RevolutionBuffer
+from Lidar_process import ProcessLiDAR
+
+
+def test_released_buffer_reads_as_overwritten():
+    buffer = bytearray(RevolutionBuffer.nbytes(4, 16))
+    revolution_buffer = RevolutionBuffer(4, 16, memoryview(buffer))
+    revolution_buffer.append(np.array([0.0, 90.0]), np.array([1000.0, 2000.0]))
+    index = revolution_buffer.commit()
+    revolution_buffer.release()
+    assert revolution_buffer.view(index) is None
+    assert revolution_buffer.copy() is None
+    assert revolution_buffer.latest == -1
+
+
+def test_process_start_does_not_block_and_reports_failure():
+    start_time = time.monotonic()
+    lidar = ProcessLiDAR('STL27L', port='/dev/nonexistent')
+    assert time.monotonic() - start_time < 1
+    assert lidar.is_active is True
+    deadline = time.monotonic() + 30
+    while lidar.is_active and time.monotonic() < deadline:
+        lidar.make_full_scan()
+    assert lidar.started and lidar.is_active is False
+    lidar.deactivate()
+    # The ring no longer exports the shared memory, so the mapping was closed
+    assert lidar.shm.buf is None
+
+
+def test_deactivate_closes_the_ring_while_the_gui_holds_it():
+    lidar = ProcessLiDAR('STL27L', port='sim://STL27L?speed=1')
+    deadline = time.monotonic() + 30
+    revolution_index = None
+    while revolution_index is None and time.monotonic() < deadline:
+        revolution_index = lidar.make_full_scan()
+    assert lidar.started and revolution_index is not None
+    # Held like the pending revolutions and the fuser do
+    revolution_buffer = lidar.revolution_buffer
+    assert len(revolution_buffer.copy(revolution_index)['X']) > 0
+    lidar.deactivate()
+    assert lidar.shm.buf is None
+    assert revolution_buffer.view(revolution_index) is None
@@ -0,0 +1,45 @@
+import numpy as np
+from Lidar_classes import A2M8, STL27L
+from Lidar_replay import replay
+from Lidar_simulator import Scene, SimulatedSerial, STL27L_INTENSITY, load_test
+
+
+def range_errors(lidar, scene):
+    # Distance of every decoded point against the scene along its decoded angle
+    errors = []
+    for index in range(lidar.revolution_buffer.latest + 1):
+        revolution = lidar.revolution_buffer.view(index)
+        errors.append(revolution['distance'] - scene.ranges(revolution['angle'] % 360))
+    return np.abs(np.concatenate(errors))
+
+
+def test_stl27l_round_trip():
+    simulated = SimulatedSerial('STL27L', speed=0, noise=0)
+    lidar = STL27L(ser=simulated)
+    assert replay(lidar, 5)['revolutions'] == 5
+    # Distances are sent in whole mm, angles in 1/100 degree move the rays grazing a wall a little more
+    errors = range_errors(lidar, simulated.scene)
+    assert np.percentile(errors, 99) <= 1 and errors.max() <= 2
+    for index in range(lidar.revolution_buffer.latest + 1):
+        assert np.all(lidar.revolution_buffer.view(index)['intensity'] == STL27L_INTENSITY)
+
+
+def test_a2m8_round_trip():
+    simulated = SimulatedSerial('A2M8', speed=0, noise=0)
+    lidar = A2M8(ser=simulated)
+    lidar.run()
+    assert replay(lidar, 5)['revolutions'] == 5
+    # The decoder places every cabin back at the angle it was measured at, distances are sent in whole mm
+    assert range_errors(lidar, simulated.scene).max() <= 1
+    assert np.all(np.isnan(lidar.revolution_buffer.view(0)['intensity']))
+
+
+def test_decoder_counts_the_simulated_faults():
+    simulated = SimulatedSerial('STL27L', speed=0, crc_error_rate=0.05, seed=1)
+    result, lidar = load_test(simulated, 20)
+    assert result['revolutions'] == 20
+    assert simulated.counters['crc_errors'] > 0
+    # Every frame sent is either decoded, reported corrupt or still waiting in the driver's buffer
+    counters = lidar.frame_counters
+    assert counters['corrupt'] == simulated.counters['crc_errors']
+    assert counters['valid'] + simulated.counters['crc_errors'] <= simulated.counters['frames']
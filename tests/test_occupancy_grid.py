@@ -0,0 +1,41 @@
+import numpy as np
+from Lidar_mapping import OccupancyGrid, LOG_ODDS_HIT, LOG_ODDS_MISS
+
+
+def log_odds(grid, x, y):
+    # Value of the cell holding the map point, 0 for unexplored tiles
+    column, row = grid.cell(np.array([x, y], dtype=float))
+    tile = grid.tiles.get((column // grid.tile_size, row // grid.tile_size))
+    return 0.0 if tile is None else float(tile[row % grid.tile_size, column % grid.tile_size])
+
+
+def test_hit_and_miss_cells():
+    grid = OccupancyGrid(resolution=50.0, tile_size=16)
+    # A beam along +x ending in cell 20, one along -y ending in cell -10 - both cross tile borders
+    grid.integrate(np.array([1025.0, 25.0]), np.array([25.0, -475.0]))
+    assert np.isclose(log_odds(grid, 1025, 25), LOG_ODDS_HIT)
+    assert all(np.isclose(log_odds(grid, 25 + 50 * k, 25), LOG_ODDS_MISS) for k in range(20))
+    assert log_odds(grid, 1075, 25) == 0
+    assert np.isclose(log_odds(grid, 25, -475), LOG_ODDS_HIT)
+    assert all(np.isclose(log_odds(grid, 25, 25 - 50 * k), LOG_ODDS_MISS) for k in range(1, 10))
+    assert log_odds(grid, 75, 75) == 0
+
+
+def test_pose_and_no_return():
+    grid = OccupancyGrid(resolution=50.0, max_range=1000.0)
+    # Sensor at (500, 500) turned by 90 degrees: the beam along its +y axis points along map +x
+    grid.integrate(np.array([0.0]), np.array([400.0]), pose=(500.0, 500.0, np.pi / 2))
+    assert np.isclose(log_odds(grid, 925, 525), LOG_ODDS_HIT)
+    assert all(np.isclose(log_odds(grid, x, 525), LOG_ODDS_MISS) for x in range(525, 925, 50))
+    assert log_odds(grid, 525, 925) == 0
+    # Beyond the range: free space up to it, no obstacle
+    grid.integrate(np.array([5000.0]), np.array([0.0]))
+    assert np.isclose(log_odds(grid, 975, 25), LOG_ODDS_MISS)
+    assert log_odds(grid, 1025, 25) == 0 and log_odds(grid, 4975, 25) == 0
+
+
+def test_log_odds_are_clamped():
+    grid = OccupancyGrid(limit=2.0)
+    for _ in range(10):
+        grid.integrate(np.array([1000.0]), np.array([0.0]))
+    assert np.isclose(log_odds(grid, 1000, 0), 2.0) and np.isclose(log_odds(grid, 500, 0), -2.0)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from Lidar_classes import RevolutionBuffer, polar_to_cartesian
+
+
+def fill(revolution_buffer, n_revolutions, n_points=10):
+    for k in range(n_revolutions):
+        angles = np.linspace(0, 350, n_points)
+        revolution_buffer.append(angles, np.full(n_points, 1000.0 + k), np.full(n_points, float(k)))
+        revolution_buffer.commit(timestamp=float(k))
+
+
+def test_wrap_around():
+    revolution_buffer = RevolutionBuffer(capacity=3, max_points=16)
+    fill(revolution_buffer, 5)
+    assert revolution_buffer.latest == 4
+    # The slot after the latest one is the next to be written, so a ring of 3 keeps 2 readable revolutions
+    assert [revolution_buffer.view(k) is None for k in range(6)] == [True, True, True, False, False, True]
+    for k in (3, 4):
+        revolution = revolution_buffer.view(k)
+        assert revolution['timestamp'] == k
+        assert np.all(revolution['distance'] == 1000.0 + k) and np.all(revolution['intensity'] == k)
+        x, y = polar_to_cartesian(revolution['angle'], revolution['distance'])
+        np.testing.assert_allclose(revolution['X'], x, rtol=1e-5, atol=1e-3)
+        np.testing.assert_allclose(revolution['Y'], y, rtol=1e-5, atol=1e-3)
+
+
+def test_view_and_copy_agree():
+    revolution_buffer = RevolutionBuffer(capacity=4, max_points=16)
+    fill(revolution_buffer, 2)
+    view, copy = revolution_buffer.view(1), revolution_buffer.copy(1)
+    for name in ('X', 'Y', 'angle', 'distance', 'intensity'):
+        assert np.array_equal(view[name], copy[name])
+        assert not view[name].flags.writeable
+        assert not np.shares_memory(copy[name], view[name])
+    assert copy['timestamp'] == view['timestamp'] == 1.0
+    # The copy survives the slot being written again, the view does not
+    fill(revolution_buffer, 3)
+    assert revolution_buffer.view(1) is None and revolution_buffer.copy(1) is None
+    assert np.all(copy['distance'] == 1001.0)
+    with pytest.raises(ValueError):
+        view['X'][0] = 0
+
+
+def test_points_beyond_the_slot_are_dropped():
+    revolution_buffer = RevolutionBuffer(capacity=2, max_points=8)
+    revolution_buffer.append(np.arange(6.0), np.full(6, 500.0))
+    revolution_buffer.append(np.arange(6.0), np.full(6, 600.0))
+    revolution = revolution_buffer.view(revolution_buffer.commit())
+    assert len(revolution['X']) == 8 and np.isnan(revolution['intensity']).all()
+    assert revolution['distance'].tolist() == [500.0] * 6 + [600.0] * 2
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+from Scan_recorder import ScanRecorder, RecordingReader, INDEX_EXTENSION, INDEX_DTYPE, SENSOR_IDS
+
+
+def revolution(n, seed):
+    rng = np.random.default_rng(seed)
+    return {name: rng.uniform(0, 1000, n).astype(np.float32) for name in ('angle', 'distance', 'X', 'Y')}
+
+
+def record(filename, revolutions):
+    recorder = ScanRecorder(filename, batch_size=2)
+    recorder.start()
+    for i, (sensor, columns) in enumerate(revolutions):
+        assert recorder.add_revolution(sensor, i, 10.0 + i, columns)
+    recorder.stop()
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'session.lslog')
+    revolutions = [('Waveshare-STL27L', revolution(300, 0)), ('Slamtec-A2M8-R5', revolution(120, 1)),
+                   ('Waveshare-STL27L', revolution(310, 2))]
+    recorder = record(filename, revolutions)
+    stats = recorder.snapshot()
+    assert stats['recorded'] == 3 and stats['dropped'] == 0 and stats['batches'] == 2
+    reader = RecordingReader(filename)
+    assert len(reader) == 3
+    for i, (sensor, columns) in enumerate(revolutions):
+        read = reader.read(i)
+        assert read['index'] == i and read['timestamp'] == 10.0 + i and read['sensor'] == SENSOR_IDS[sensor]
+        for name, values in columns.items():
+            np.testing.assert_array_equal(read[name], values)
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    filename = str(tmp_path / 'session.lslog')
+    record(filename, [('Waveshare-STL27L', revolution(100 + i, i)) for i in range(4)])
+    index_filename = filename + INDEX_EXTENSION
+    full = np.fromfile(index_filename, dtype=INDEX_DTYPE)
+    # The last batch reached the log but not the index
+    full[:2].tofile(index_filename)
+    assert len(RecordingReader(filename)) == 4
+    np.testing.assert_array_equal(np.fromfile(index_filename, dtype=INDEX_DTYPE), full)
+
+
+def test_truncated_log(tmp_path):
+    filename = str(tmp_path / 'session.lslog')
+    record(filename, [('Waveshare-STL27L', revolution(100, i)) for i in range(3)])
+    with open(filename, mode='r+b') as log:
+        log.truncate(os.path.getsize(filename) - 10)
+    reader = RecordingReader(filename)
+    assert len(reader) == 2
+    assert len(reader.read(1)['X']) == 100
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from Slice_metrics import angle_metrics, diameter
+
+
+def l_profile(corner_angle, starts=(20, 20), n_points=60, noise=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    corner = np.array([0.0, 3000.0])
+    sides = []
+    # Opening towards the sensor, so the points of the two sides do not overlap in bearing
+    for angle, start in zip(np.radians([-90 - corner_angle / 2, -90 + corner_angle / 2]), starts):
+        direction = np.array([np.cos(angle), np.sin(angle)])
+        sides.append(corner + np.linspace(start, start + 380, n_points)[:, np.newaxis] * direction)
+    return np.concatenate(sides) + rng.normal(0, noise, (2 * n_points, 2))
+
+
+@pytest.mark.parametrize('corner_angle, expected', [(90.0, 90.0), (120.0, 60.0)])
+def test_angle_is_acute(corner_angle, expected):
+    assert angle_metrics(l_profile(corner_angle))['angle_deg'] == pytest.approx(expected, abs=1.0)
+
+
+def test_sides_that_do_not_meet():
+    # The near end of the second side is far from the intersection of the lines, only the largest sides are left
+    assert angle_metrics(l_profile(90.0, starts=(100, 600)))['angle_deg'] == pytest.approx(90.0, abs=1.0)
+
+
+def test_single_wall():
+    x = np.linspace(-500, 500, 50)
+    with pytest.raises(ValueError):
+        angle_metrics(np.column_stack((x, np.full_like(x, 3000.0))))
+
+
+def brute_force_diameter(points):
+    difference = points[:, np.newaxis] - points[np.newaxis]
+    distances = np.sqrt(difference[..., 0] ** 2 + difference[..., 1] ** 2)
+    i, j = np.unravel_index(np.argmax(distances), distances.shape)
+    return distances[i, j], i, j
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_diameter_equals_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    # A noisy profile, a grid full of ties with duplicate points, and a few points on one line
+    for points in (l_profile(90.0, seed=seed), rng.integers(0, 4, (40, 2)).astype(float),
+                   np.column_stack((rng.uniform(0, 100, 6), np.zeros(6))), rng.normal(0, 1, (2, 2))):
+        length, i, j = diameter(points)
+        expected_length, expected_i, expected_j = brute_force_diameter(points)
+        assert length == pytest.approx(expected_length)
+        assert (i, j) == (expected_i, expected_j)
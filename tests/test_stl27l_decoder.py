@@ -0,0 +1,37 @@
+import numpy as np
+from Lidar_classes import STL27L, decode_stl27l_frames, polar_to_cartesian
+from Lidar_replay import ReplaySerial
+from Lidar_simulator import SimulatedSerial, STL27L_INTENSITY
+from Benchmarks.bench_stl27l_decoder import legacy_decode
+
+
+def simulated_stream(revolutions):
+    simulated = SimulatedSerial('STL27L', speed=0)
+    return b''.join(simulated.next_revolution() for _ in range(revolutions))
+
+
+def test_frames_match_the_loop():
+    stream = simulated_stream(1)
+    legacy_x, legacy_y = legacy_decode(ReplaySerial(stream))
+    angles, distances, intensities = decode_stl27l_frames(stream)
+    x, y = polar_to_cartesian(angles, distances)
+    np.testing.assert_allclose(x, legacy_x, atol=1e-6)
+    np.testing.assert_allclose(y, legacy_y, atol=1e-6)
+    assert np.array_equal(intensities, np.where(distances > 0, STL27L_INTENSITY, 0))
+
+
+def test_driver_revolutions():
+    stream = simulated_stream(3)
+    lidar = STL27L(ser=ReplaySerial(stream))
+    while lidar.ser.in_waiting:
+        lidar.make_full_scan()
+    angles, distances, _ = decode_stl27l_frames(stream)
+    # The last revolution is committed when the next one starts
+    assert lidar.revolution_buffer.latest == 1
+    for index in range(2):
+        revolution = lidar.revolution_buffer.view(index)
+        points = slice(index * 2160, (index + 1) * 2160)
+        hit = distances[points] > 0
+        np.testing.assert_allclose(revolution['angle'], angles[points][hit], atol=1e-4)
+        np.testing.assert_allclose(revolution['distance'], distances[points][hit])
+        assert np.all(revolution['intensity'] == STL27L_INTENSITY)
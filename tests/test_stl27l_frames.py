@@ -0,0 +1,31 @@
+import numpy as np
+from Lidar_classes import STL27L_POINTS_PER_FRAME, find_stl27l_frames
+from Lidar_simulator import encode_stl27l_frames
+
+
+def make_frames(n_frames):
+    angles = np.arange(n_frames * STL27L_POINTS_PER_FRAME) * 0.5
+    return bytearray(encode_stl27l_frames(angles, np.full(len(angles), 1000.0)))
+
+
+def test_no_frames():
+    starts, n_corrupt = find_stl27l_frames(bytes(100))
+    assert starts.size == 0
+    assert n_corrupt == 0
+
+
+def test_only_corrupt_frames():
+    stream = make_frames(3)
+    for frame in range(3):
+        stream[frame * 47 + 46] ^= 0xFF
+    starts, n_corrupt = find_stl27l_frames(bytes(stream))
+    assert starts.size == 0
+    assert n_corrupt == 3
+
+
+def test_valid_and_corrupt_frames():
+    stream = make_frames(3)
+    stream[47 + 46] ^= 0xFF
+    starts, n_corrupt = find_stl27l_frames(bytes(stream))
+    assert starts.tolist() == [0, 94]
+    assert n_corrupt == 1